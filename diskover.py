@@ -13,15 +13,31 @@ LICENSE for the full license text.
 
 from scandir import scandir
 from rq import SimpleWorker, Queue
-from rq.registry import StartedJobRegistry
+from rq.registry import StartedJobRegistry, FailedJobRegistry
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
 from datetime import datetime
-from random import randint
+from random import randint, uniform
+from diskover_patterns import ExcludeMatcher
+from diskover_frontier import WalkFrontier
+from diskover_throttle import QueueThrottle
+from diskover_enqueue import BulkEnqueuer
+from diskover_bulk import BulkSizer, bulk_retryable
+from diskover_deadletter import DeadLetterStore
+from diskover_context import new_crawl_id, crawl_id_index, publish_context, delete_context
+from diskover_tagindex import TagIndex
+from diskover_plugins import PluginRegistry
+from diskover_stat import stat_functions
+from diskover_query import PathQuery, PATH_TREE_ANALYSIS, PATH_PARENT_MAPPING, \
+    index_path_fields, path_field_indices
 try:
     import configparser as ConfigParser
 except ImportError:
     import ConfigParser
 from multiprocessing import cpu_count
 from threading import Thread, Lock
+from functools import partial
+import multiprocessing
 try:
     from queue import Queue as PyQueue
 except ImportError:
@@ -32,10 +48,13 @@ import logging
 import importlib
 import time
 import math
-import re
 import os
 import sys
 import json
+import zlib
+import struct
+import hashlib
+import calendar
 import requests
 
 
@@ -214,6 +233,18 @@ def load_config():
             configsettings['ownersgroups_keepdomain'] = config.get('ownersgroups', 'keepdomain').lower()
         except ConfigParser.NoOptionError:
             configsettings['ownersgroups_keepdomain'] = "false"
+        try:
+            configsettings['ownersgroups_domainfirst'] = config.get('ownersgroups', 'domainfirst').lower()
+        except ConfigParser.NoOptionError:
+            configsettings['ownersgroups_domainfirst'] = "true"
+        try:
+            configsettings['ownersgroups_cachettl'] = int(config.get('ownersgroups', 'cachettl'))
+        except ConfigParser.NoOptionError:
+            configsettings['ownersgroups_cachettl'] = 3600
+        try:
+            configsettings['ownersgroups_preload'] = config.get('ownersgroups', 'preload').lower()
+        except ConfigParser.NoOptionError:
+            configsettings['ownersgroups_preload'] = "false"
         try:
             t = config.get('autotag', 'files')
             if os.path.isfile("%s/%s" % (os.getcwd(),t)):
@@ -282,6 +313,42 @@ def load_config():
             configsettings['es_chunksize'] = int(config.get('elasticsearch', 'chunksize'))
         except ConfigParser.NoOptionError:
             configsettings['es_chunksize'] = 500
+        try:
+            configsettings['es_bulkbytes'] = int(config.get('elasticsearch', 'bulkbytes'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulkbytes'] = 0
+        try:
+            configsettings['es_bulkminbytes'] = int(config.get('elasticsearch', 'bulkminbytes'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulkminbytes'] = 1048576
+        try:
+            configsettings['es_bulkmaxbytes'] = int(config.get('elasticsearch', 'bulkmaxbytes'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulkmaxbytes'] = 52428800
+        try:
+            configsettings['es_bulkmaxdocs'] = int(config.get('elasticsearch', 'bulkmaxdocs'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulkmaxdocs'] = 10000
+        try:
+            configsettings['es_bulklatency'] = float(config.get('elasticsearch', 'bulklatency'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulklatency'] = 2.0
+        try:
+            configsettings['es_bulkretries'] = int(config.get('elasticsearch', 'bulkretries'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulkretries'] = 5
+        try:
+            configsettings['es_bulkbackoff'] = float(config.get('elasticsearch', 'bulkbackoff'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulkbackoff'] = 0.5
+        try:
+            configsettings['es_bulkmaxbackoff'] = float(config.get('elasticsearch', 'bulkmaxbackoff'))
+        except ConfigParser.NoOptionError:
+            configsettings['es_bulkmaxbackoff'] = 30.0
+        try:
+            configsettings['es_deadletter'] = config.get('elasticsearch', 'deadletter')
+        except ConfigParser.NoOptionError:
+            configsettings['es_deadletter'] = ""
         try:
             configsettings['index_shards'] = int(config.get('elasticsearch', 'shards'))
         except ConfigParser.NoOptionError:
@@ -346,6 +413,34 @@ def load_config():
             configsettings['redis_queue_calcdir'] = config.get('redis', 'queuecalcdir')
         except ConfigParser.NoOptionError:
             configsettings['redis_queue_calcdir'] = "diskover_calcdir"
+        try:
+            configsettings['redis_enqueuesize'] = int(config.get('redis', 'enqueuesize'))
+        except ConfigParser.NoOptionError:
+            configsettings['redis_enqueuesize'] = 100
+        try:
+            configsettings['redis_enqueueinterval'] = float(config.get('redis', 'enqueueinterval'))
+        except ConfigParser.NoOptionError:
+            configsettings['redis_enqueueinterval'] = 1.0
+        try:
+            configsettings['redis_queue_highwater'] = int(config.get('redis', 'queuehighwater'))
+        except ConfigParser.NoOptionError:
+            configsettings['redis_queue_highwater'] = 0
+        try:
+            configsettings['redis_queue_lowwater'] = int(config.get('redis', 'queuelowwater'))
+        except ConfigParser.NoOptionError:
+            configsettings['redis_queue_lowwater'] = 0
+        try:
+            configsettings['redis_queue_maxmb'] = int(config.get('redis', 'queuemaxmb'))
+        except ConfigParser.NoOptionError:
+            configsettings['redis_queue_maxmb'] = 0
+        try:
+            configsettings['redis_contextttl'] = int(config.get('redis', 'contextttl'))
+        except ConfigParser.NoOptionError:
+            configsettings['redis_contextttl'] = 604800
+        try:
+            configsettings['redis_tagindexmax'] = int(config.get('redis', 'tagindexmax'))
+        except ConfigParser.NoOptionError:
+            configsettings['redis_tagindexmax'] = 100000
         try:
             configsettings['adaptivebatch_startsize'] = int(config.get('adaptivebatch', 'startsize'))
         except ConfigParser.NoOptionError:
@@ -362,6 +457,66 @@ def load_config():
             configsettings['adaptivebatch_maxfiles'] = int(config.get('adaptivebatch', 'maxfiles'))
         except ConfigParser.NoOptionError:
             configsettings['adaptivebatch_maxfiles'] = 50000
+        try:
+            configsettings['treewalk_order'] = config.get('treewalk', 'order').lower()
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['treewalk_order'] = "bfs"
+        try:
+            configsettings['treewalk_maxmem'] = int(config.get('treewalk', 'maxmem'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['treewalk_maxmem'] = 0
+        try:
+            configsettings['treewalk_spilldir'] = config.get('treewalk', 'spilldir')
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['treewalk_spilldir'] = ""
+        try:
+            configsettings['treewalk_hybridpaths'] = int(config.get('treewalk', 'hybridpaths'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['treewalk_hybridpaths'] = 1000
+        try:
+            configsettings['treewalk_maxresults'] = int(config.get('treewalk', 'maxresults'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['treewalk_maxresults'] = 10000
+        try:
+            configsettings['treewalk_statbackend'] = config.get('treewalk', 'statbackend').lower()
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['treewalk_statbackend'] = "lstat"
+        try:
+            configsettings['bots_statthreads'] = int(config.get('bots', 'statthreads'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['bots_statthreads'] = 0
+        try:
+            configsettings['bots_statbackend'] = config.get('bots', 'statbackend').lower()
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['bots_statbackend'] = "lstat"
+        try:
+            configsettings['bots_bulkbuffer'] = config.get('bots', 'bulkbuffer').lower()
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['bots_bulkbuffer'] = "false"
+        try:
+            configsettings['bots_bulkdocs'] = int(config.get('bots', 'bulkdocs'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['bots_bulkdocs'] = 0
+        try:
+            configsettings['bots_bulkbytes'] = int(config.get('bots', 'bulkbytes'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['bots_bulkbytes'] = 10485760
+        try:
+            configsettings['bots_bulkage'] = float(config.get('bots', 'bulkage'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['bots_bulkage'] = 5.0
+        try:
+            configsettings['plugins_executor'] = config.get('plugins', 'executor').lower()
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['plugins_executor'] = "inline"
+        try:
+            configsettings['plugins_workers'] = int(config.get('plugins', 'workers'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['plugins_workers'] = 4
+        try:
+            configsettings['plugins_timeout'] = float(config.get('plugins', 'timeout'))
+        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+            configsettings['plugins_timeout'] = 60.0
         try:
             configsettings['listener_host'] = config.get('socketlistener', 'host')
         except ConfigParser.NoOptionError:
@@ -458,9 +613,11 @@ def get_plugins_info():
 
 def load_plugins():
     """This is the load plugins function.
-    It dynamically load the plugins and return them in a list
+    It dynamically load the plugins and return them in a
+    plugin registry
     """
     loaded_plugins = []
+    names = []
     plugins_info = get_plugins_info()
     for plugin_info in plugins_info:
         if IS_PY3:
@@ -470,7 +627,8 @@ def load_plugins():
             import imp
             plugin_module = imp.load_module(plugin_info["name"], *plugin_info["spec"])
         loaded_plugins.append(plugin_module)
-    return loaded_plugins
+        names.append(plugin_info["name"])
+    return PluginRegistry(loaded_plugins, names)
 
 
 def list_plugins():
@@ -539,6 +697,9 @@ def index_create(indexname):
         elif cliargs['reindexrecurs']:
             logger.info('Reindexing (recursive, preserving tags)')
             return
+        elif cliargs['resume']:
+            logger.info('Resuming crawl, data is added to existing index')
+            return
         # delete existing index
         else:
             if cliargs['forcedropexisting']:
@@ -558,7 +719,8 @@ def index_create(indexname):
             "index" : {
                 "number_of_shards": config['index_shards'],
                 "number_of_replicas": config['index_replicas']
-            }
+            },
+            "analysis": PATH_TREE_ANALYSIS
         },
         "mappings": {
             "diskspace": {
@@ -613,6 +775,12 @@ def index_create(indexname):
                     "bulk_time": {
                         "type": "float"
                     },
+                    "bulk_bytes": {
+                        "type": "long"
+                    },
+                    "bulk_docs": {
+                        "type": "integer"
+                    },
                     "crawl_time": {
                         "type": "float"
                     },
@@ -622,12 +790,16 @@ def index_create(indexname):
                 }
             },
             "directory": {
+                "_meta": {
+                    "pathids": cliargs['pathids']
+                },
                 "properties": {
                     "filename": {
                         "type": "keyword"
                     },
-                    "path_parent": {
-                        "type": "keyword"
+                    "path_parent": PATH_PARENT_MAPPING,
+                    "depth": {
+                        "type": "integer"
                     },
                     "filesize": {
                         "type": "long"
@@ -692,6 +864,9 @@ def index_create(indexname):
                 }
             },
             "file": {
+                "_meta": {
+                    "pathids": cliargs['pathids']
+                },
                 "properties": {
                     "filename": {
                         "type": "keyword"
@@ -699,8 +874,9 @@ def index_create(indexname):
                     "extension": {
                         "type": "keyword"
                     },
-                    "path_parent": {
-                        "type": "keyword"
+                    "path_parent": PATH_PARENT_MAPPING,
+                    "depth": {
+                        "type": "integer"
                     },
                     "filesize": {
                         "type": "long"
@@ -753,39 +929,99 @@ def index_create(indexname):
     for plugin in plugins:
         mappings = (plugin.add_mappings(mappings))
 
+    # forget lookups of any index deleted above with the same name
+    pathids_indices.pop(indexname, None)
+    path_field_indices.pop(indexname, None)
+
     logger.info('Creating es index')
     es.indices.create(index=indexname, body=mappings)
     time.sleep(.5)
 
 
-def index_bulk_add(es, doclist, config, cliargs):
+def index_bulk_add(es, doclist, config, cliargs, sizes=None):
     """This is the es index bulk add function.
     It bulk adds/updates/removes using file/directory
     meta data lists from worker's crawl results.
+    Only docs which failed with a retryable error (es busy, version
+    conflict) are sent again, with jittered exponential backoff.
+    Docs which can't be added go to the dead letter store.
+    sizes are the doc sizes if already known (bulk buffer).
     """
     if config['es_wait_status_yellow'] == "true":
         # wait for es health to be at least yellow
         es.cluster.health(wait_for_status='yellow',
                           request_timeout=config['es_timeout'])
     # bulk load data to Elasticsearch index
-    try:
-        helpers.bulk(es, doclist, index=cliargs['index'],
-                chunk_size=config['es_chunksize'], request_timeout=config['es_timeout'])
-    except helpers.BulkIndexError:
-        # bulk index error can happen occasionaly when using splitfiles and
-        # if a doc trying be updated has a version mismatch, try to bulk
-        # upload the update list items again
-        time.sleep(.5)
-        if cliargs['splitfiles']:
-            update_doclist = []
-            for d in doclist:
-                try:
-                    if d['_op_type']:
-                        update_doclist.append(d)
-                except KeyError:
-                    pass
-            doclist = update_doclist
-        index_bulk_add(es, doclist, config, cliargs)
+    failed = []
+    for attempt in range(config['es_bulkretries'] + 1):
+        if attempt > 0:
+            time.sleep(uniform(0, min(config['es_bulkmaxbackoff'], config['es_bulkbackoff'] * 2 ** (attempt - 1))))
+        retry = []
+        for chunk in bulk_chunks(doclist, config, sizes):
+            retry.extend(bulk_request(es, chunk, config, cliargs, failed))
+        if not retry:
+            break
+        doclist = [doc for doc, status, error in retry]
+        sizes = None
+    else:
+        failed.extend(retry)
+
+    if failed:
+        logging.getLogger('diskover').error('%s docs failed to bulk add to %s, first error: %s (status %s)'
+                                            % (len(failed), cliargs['index'], failed[0][2], failed[0][1]))
+        if dead_letters:
+            dead_letters.add(cliargs['index'], failed)
+
+
+def bulk_chunks(doclist, config, sizes=None):
+    """This is the bulk chunks function.
+    It returns the doc lists to send in each bulk request, sized by
+    bulk_sizer if set or chunksize docs.
+    """
+    if bulk_sizer:
+        return bulk_sizer.chunks(doclist, sizes)
+    n = config['es_chunksize']
+    return (doclist[i:i + n] for i in range(0, len(doclist), n))
+
+
+def bulk_request(es, chunk, config, cliargs, failed):
+    """This is the bulk request function.
+    It bulk adds chunk of docs in one request and returns list of
+    (doc, status, error) for docs which can be retried, docs which
+    can't are added to failed.
+    """
+    retry = []
+    rejected = False
+    starttime = time.time()
+    results = helpers.streaming_bulk(es, chunk, index=cliargs['index'], chunk_size=len(chunk),
+                                     max_chunk_bytes=config['es_bulkmaxbytes'] * 2,
+                                     raise_on_error=False, raise_on_exception=False,
+                                     request_timeout=config['es_timeout'])
+    # results are in the same order as the docs
+    for doc, (ok, item) in zip(chunk, results):
+        if ok:
+            continue
+        result = list(item.values())[0]
+        status = result.get('status')
+        error = result.get('error')
+        if status == 429:
+            rejected = True
+        if bulk_retryable(status):
+            retry.append((doc, status, error))
+        else:
+            failed.append((doc, status, error))
+    if bulk_sizer:
+        bulk_sizer.update(len(chunk), time.time() - starttime, rejected)
+    return retry
+
+
+def bulk_stats():
+    """This is the bulk stats function.
+    It returns the bulk_sizer fields for worker docs.
+    """
+    if not bulk_sizer:
+        return {}
+    return {"bulk_bytes": bulk_sizer.bytes, "bulk_docs": bulk_sizer.docs}
 
 
 def index_delete_path(path, cliargs, logger, reindex_dict, recursive=False):
@@ -793,7 +1029,7 @@ def index_delete_path(path, cliargs, logger, reindex_dict, recursive=False):
     It finds all file and directory docs in path and deletes them from es
     including the directory (path).
     Recursive will also find and delete all docs in subdirs of path.
-    Stores any existing tags in reindex_dict.
+    Stores any existing tags in reindex_dict (TagIndex).
     Returns reindex_dict.
     """
     file_id_list = []
@@ -804,33 +1040,13 @@ def index_delete_path(path, cliargs, logger, reindex_dict, recursive=False):
     # refresh index
     es.indices.refresh(index=cliargs['index'])
 
-    # escape special characters
-    newpath = escape_chars(path)
-    # create wildcard string and check for / (root) path
-    if newpath == '\/':
-        newpathwildcard = '\/*'
-    else:
-        newpathwildcard = newpath + '\/*'
+    pathquery = PathQuery.for_index(es, cliargs['index'])
 
     # file doc search
     if recursive:
-        data = {
-            "query": {
-                "query_string": {
-                    "query": "path_parent: " + newpath + " OR "
-                    "path_parent: " + newpathwildcard,
-                    "analyze_wildcard": "true"
-                }
-            }
-        }
+        data = {"query": pathquery.subtree(path)}
     else:
-        data = {
-            "query": {
-                "query_string": {
-                    "query": "path_parent: " + newpath
-                }
-            }
-        }
+        data = {"query": pathquery.parent(path)}
 
     logger.info('Searching for all files in %s' % path)
     # search es and start scroll
@@ -842,11 +1058,9 @@ def index_delete_path(path, cliargs, logger, reindex_dict, recursive=False):
         for hit in res['hits']['hits']:
             # add doc id to file_id_list
             file_id_list.append(hit['_id'])
-            # add file path info inc. tags to reindex_file_list
-            reindex_dict['file'].append((hit['_source']['path_parent'] +
-                                      '/' + hit['_source']['filename'],
-                                      hit['_source']['tag'],
-                                      hit['_source']['tag_custom']))
+            # add file path tags to reindex_dict
+            reindex_dict.add('file', hit['_source']['path_parent'] + '/' + hit['_source']['filename'],
+                             hit['_source']['tag'], hit['_source']['tag_custom'])
         # get es scroll id
         scroll_id = res['_scroll_id']
         # use es scroll api
@@ -871,28 +1085,7 @@ def index_delete_path(path, cliargs, logger, reindex_dict, recursive=False):
         index_bulk_add(es, file_delete_list, config, cliargs)
 
     # directory doc search
-    if recursive:
-        data = {
-            'query': {
-                'query_string': {
-                    'query': '(path_parent: ' + newpath + ') OR '
-                             '(path_parent: ' + newpathwildcard + ') OR (filename: "'
-                             + os.path.basename(path) + '" AND path_parent: "'
-                             + os.path.abspath(os.path.join(path, os.pardir)) + '")',
-                    'analyze_wildcard': 'true'
-                }
-            }
-        }
-    else:
-        data = {
-            'query': {
-                'query_string': {
-                    'query': '(path_parent: ' + newpath + ') OR (filename: "'
-                             + os.path.basename(path) + '" AND path_parent: "'
-                             + os.path.abspath(os.path.join(path, os.pardir)) + '")'
-                }
-            }
-        }
+    data = {"query": pathquery.path_tree(path, recursive)}
 
     logger.info('Searching for all directories in %s' % path)
     # search es and start scroll
@@ -903,11 +1096,9 @@ def index_delete_path(path, cliargs, logger, reindex_dict, recursive=False):
         for hit in res['hits']['hits']:
             # add directory doc id to dir_id_list
             dir_id_list.append(hit['_id'])
-            # add directory path info inc. tags, filesize, items to reindex_dir_list
-            reindex_dict['directory'].append((hit['_source']['path_parent'] +
-                                     '/' + hit['_source']['filename'],
-                                     hit['_source']['tag'],
-                                     hit['_source']['tag_custom']))
+            # add directory path tags to reindex_dict
+            reindex_dict.add('directory', hit['_source']['path_parent'] + '/' + hit['_source']['filename'],
+                             hit['_source']['tag'], hit['_source']['tag_custom'])
         # get es scroll id
         scroll_id = res['_scroll_id']
         # use es scroll api
@@ -934,8 +1125,50 @@ def index_delete_path(path, cliargs, logger, reindex_dict, recursive=False):
     return reindex_dict
 
 
+def index_delete_files(paths, cliargs, logger):
+    """This is the es delete files function.
+    It finds all file docs directly in directory paths
+    and deletes them from es.
+    """
+    file_delete_list = []
+
+    # refresh index
+    es.indices.refresh(index=cliargs['index'])
+
+    for i in range(0, len(paths), 1000):
+        data = {
+            "_source": False,
+            "query": {
+                "terms": {"path_parent": paths[i:i + 1000]}
+            }
+        }
+        # search es and start scroll
+        res = es.search(index=cliargs['index'], doc_type='file', scroll='1m',
+                        size=config['es_scrollsize'], body=data,
+                        request_timeout=config['es_timeout'])
+
+        while res['hits']['hits'] and len(res['hits']['hits']) > 0:
+            for hit in res['hits']['hits']:
+                file_delete_list.append({
+                    '_op_type': 'delete',
+                    '_index': cliargs['index'],
+                    '_type': 'file',
+                    '_id': hit['_id']
+                })
+            # use es scroll api
+            res = es.scroll(scroll_id=res['_scroll_id'], scroll='1m',
+                            request_timeout=config['es_timeout'])
+
+    logger.info('Found %s files in %s directories' % (len(file_delete_list), len(paths)))
+
+    if len(file_delete_list) > 0:
+        # bulk delete files in es
+        logger.info('Bulk deleting files in es index')
+        index_bulk_add(es, file_delete_list, config, cliargs)
+
+
 def index_get_docs(cliargs, logger, doctype='directory', copytags=False, hotdirs=False,
-                   index=None, path=None, sort=False, maxdepth=None, pathid=False):
+                   index=None, path=None, sort=False, maxdepth=None, pathid=False, dirtimes=False):
     """This is the es get docs function.
     It finds all docs (by doctype) in es and returns doclist
     which contains doc id, fullpath and mtime for all docs.
@@ -943,6 +1176,8 @@ def index_get_docs(cliargs, logger, doctype='directory', copytags=False, hotdirs
     If path is specified will return just documents in and under directory path.
     If sort is True, will return paths in asc path order.
     if pathid is True, will return dict with path and their id.
+    If dirtimes is True, will return dict with path hash and packed mtime/ctime
+    and dict with path hash and list of subdir names.
     """
 
     data = _index_get_docs_data(index, cliargs, logger, doctype=doctype, path=path,
@@ -957,6 +1192,8 @@ def index_get_docs(cliargs, logger, doctype='directory', copytags=False, hotdirs
 
     doclist = []
     pathdict = {}
+    timesdict = {}
+    subdirsdict = {}
     doccount = 0
     while res['hits']['hits'] and len(res['hits']['hits']) > 0:
         for hit in res['hits']['hits']:
@@ -969,6 +1206,13 @@ def index_get_docs(cliargs, logger, doctype='directory', copytags=False, hotdirs
             elif pathid:
                 rel_path = fullpath.replace(rootdir_path, ".")
                 pathdict[rel_path] = hit['_id']
+            elif dirtimes:
+                # es times are utc
+                mtime = es_time_to_unix(hit['_source']['last_modified'])
+                ctime = es_time_to_unix(hit['_source']['last_change'])
+                timesdict[path_hash(fullpath)] = pack_times(mtime, ctime)
+                subdirsdict.setdefault(path_hash(hit['_source']['path_parent']), []).append(
+                    hit['_source']['filename'])
             else:
                 # convert es time to unix time format
                 mtime = time.mktime(datetime.strptime(
@@ -984,6 +1228,8 @@ def index_get_docs(cliargs, logger, doctype='directory', copytags=False, hotdirs
 
     if pathid:
         return pathdict
+    elif dirtimes:
+        return timesdict, subdirsdict
     else:
         return doclist
 
@@ -1018,36 +1264,16 @@ def _index_get_docs_data(index, cliargs, logger, doctype='directory', path=None,
                     }
                 }
             else:
-                # depth at rootdir
-                num_sep = cliargs['rootdir'].count(os.path.sep)
-                n = num_sep + maxdepth - 1
-                regexp = '(/[^/]+){1,' + str(n) + '}|/?'
                 logger.info('Searching for all %s docs in %s (maxdepth %s)...', doctype, index, maxdepth)
                 data = {
                     '_source': ['path_parent', 'filename', 'last_modified', 'last_access', 'last_change'],
-                    'query': {
-                        'regexp': {'path_parent': regexp}
-                    }
+                    'query': PathQuery.for_index(es, index).maxdepth(cliargs['rootdir'], maxdepth)
                 }
         else:
-            # escape special characters
-            newpath = escape_chars(path)
-            # create wildcard string and check for / (root) path
-            if newpath == '\/':
-                newpathwildcard = '\/*'
-            else:
-                newpathwildcard = newpath + '\/*'
             logger.info('Searching for all %s docs in %s for path %s...', doctype, index, path)
             data = {
                 '_source': ['path_parent', 'filename', 'last_modified', 'last_access', 'last_change'],
-                'query': {
-                    'query_string': {
-                        'query': '(path_parent: ' + newpath + ') OR '
-                                                              '(path_parent: ' + newpathwildcard + ') OR (filename: "'
-                                 + os.path.basename(path) + '" AND path_parent: "'
-                                 + os.path.abspath(os.path.join(path, os.pardir)) + '")',
-                    }
-                }
+                'query': PathQuery.for_index(es, index).path_tree(path)
             }
 
     if sort:
@@ -1056,6 +1282,76 @@ def _index_get_docs_data(index, cliargs, logger, doctype='directory', path=None,
     return data
 
 
+def es_time_to_unix(estime):
+    """This is the es time to unix function.
+    It converts an es utc date string to unix time (seconds).
+    """
+    return calendar.timegm(time.strptime(estime.split('.')[0], '%Y-%m-%dT%H:%M:%S'))
+
+
+def path_bytes(path):
+    """This is the path bytes function.
+    It returns path encoded as bytes for hashing.
+    """
+    if not isinstance(path, bytes):
+        path = path.encode('utf-8', 'surrogateescape' if IS_PY3 else 'replace')
+    return path
+
+
+def path_hash(path):
+    """This is the path hash function.
+    It returns a 64 bit int hash of path, used as the key for
+    directory times instead of keeping every path in memory.
+    """
+    return struct.unpack('<q', hashlib.md5(path_bytes(path)).digest()[:8])[0]
+
+
+def path_doc_id(doctype, path):
+    """This is the path doc id function.
+    It returns the es _id of the doctype doc for path in --pathids
+    indexes, sha1 hex of the doctype and normalized path.
+    """
+    parent = os.path.abspath(os.path.join(path, os.pardir))
+    path = os.path.join(parent, os.path.basename(path))
+    return hashlib.sha1(path_bytes(doctype + ':' + path)).hexdigest()
+
+
+def index_pathids(index):
+    """This is the index pathids function.
+    It returns True if docs in index have path hash ids (--pathids),
+    recorded in the directory mapping _meta when it was created.
+    """
+    if index not in pathids_indices:
+        res = es.indices.get_mapping(index=index, doc_type='directory')
+        meta = {}
+        for m in res.values():
+            meta = m['mappings'].get('directory', {}).get('_meta', {})
+        pathids_indices[index] = bool(meta.get('pathids'))
+    return pathids_indices[index]
+
+
+def pack_times(mtime, ctime):
+    """This is the pack times function.
+    It packs mtime and ctime (whole seconds) into a single int.
+    """
+    return (int(mtime) << 32) | (int(ctime) & 0xffffffff)
+
+
+def incremental_unchanged_subdirs(path, st, cliargs):
+    """This is the incremental unchanged subdirs function.
+    It returns the subdir names index2 has for directory path if
+    it's mtime and ctime in lstat st are the same as in index2
+    (--incremental), else None. A directory's entries can't be
+    added, removed or renamed without changing it's mtime.
+    """
+    if cliargs['replacepath']:
+        path = replace_path(path)
+    key = path_hash(path)
+    if incremental_dirtimes.get(key) != pack_times(st[8], st[9]):
+        return None
+    return incremental_subdirs.get(key, [])
+
+
 def replace_path(path):
     """This is the replace path function.
     It replaces paths and drive letters sent to bots.
@@ -1068,6 +1364,21 @@ def replace_path(path):
     return path
 
 
+def replace_listing_paths(root, files):
+    """This is the replace listing paths function.
+    It replaces paths in a directory listing root (which can be a tuple
+    for dir chunks or embeded stats) and in any files with embeded stats.
+    Returns root and files.
+    """
+    if type(root) is tuple:
+        root = (replace_path(root[0]),) + root[1:]
+    else:
+        root = replace_path(root)
+    if files and type(files[0]) is tuple:
+        files = [(replace_path(f[0]), f[1]) for f in files]
+    return root, files
+
+
 def split_list(a, n):
         """Generator that splits list a evenly into n pieces
         """
@@ -1137,90 +1448,13 @@ def add_crawl_stats(es, index, path, crawltime, state):
 def dir_excluded(path, config, cliargs):
     """Return True if path in excluded_dirs set,
     False if not in the list"""
-    name = os.path.basename(path)
-    # return if directory in included list (whitelist)
-    if name in config['included_dirs'] or path in config['included_dirs']:
-        return False
-    # skip any dirs in excluded_dirs
-    if name in config['excluded_dirs'] or path in config['excluded_dirs']:
-        if cliargs['verbose']:
-            logger.info('Skipping (excluded dir) %s', path)
-        return True
-    # skip any dirs which start with . (dot) and in excluded_dirs
-    if name.startswith('.') and u'.*' in config['excluded_dirs']:
-        if cliargs['verbose']:
-            logger.info('Skipping (.* dir) %s', path)
-        return True
-    # skip any dirs that are found in reg exp checks including wildcard searches
-    found_dir = False
-    found_path = False
-    for d in config['excluded_dirs']:
-        if d == '.*':
-            continue
-        if d.startswith('*') and d.endswith('*'):
-            d = d.replace('*', '')
-            if re.search(d, name):
-                found_dir = True
-                break
-            elif re.search(d, path):
-                found_path = True
-                break
-        elif d.startswith('*'):
-            d = d + '$'
-            if re.search(d, name):
-                found_dir = True
-                break
-            elif re.search(d, path):
-                found_path = True
-                break
-        elif d.endswith('*'):
-            d = '^' + d
-            if re.search(d, name):
-                found_dir = True
-                break
-            elif re.search(d, path):
-                found_path = True
-                break
-        else:
-            if d == name:
-                found_dir = True
-                break
-            elif d == path:
-                found_path = True
-                break
-
-    if found_dir or found_path:
+    if exclude_matcher.dir_excluded(path):
         if cliargs['verbose']:
             logger.info('Skipping (excluded dir) %s', path)
         return True
-
     return False
 
 
-def escape_chars(text):
-    """This is the escape special characters function.
-    It returns escaped path strings for es queries.
-    """
-    # escape any backslash chars
-    text = text.replace('\\', '\\\\')
-    # escape any characters in chr_dict
-    chr_dict = {'\n': '\\n', '\t': '\\t',
-                '/': '\\/', '(': '\\(', ')': '\\)', '[': '\\[', ']': '\\]', '$': '\\$',
-                ' ': '\\ ', '&': '\\&', '<': '\\<', '>': '\\>', '+': '\\+', '-': '\\-',
-                '|': '\\|', '!': '\\!', '{': '\\{', '}': '\\}', '^': '\\^', '~': '\\~',
-                '?': '\\?', ':': '\\:', '=': '\\=', '\'': '\\\'', '"': '\\"', '@': '\\@',
-                '.': '\\.', '#': '\\#', '*': '\\*', '　': '\\　'}
-    def char_trans(text, chr_dict):
-        for key, value in chr_dict.items():
-            text = text.replace(key, value)
-        return text
-    if IS_PY3:
-        text_esc = text.translate(str.maketrans(chr_dict))
-    else:
-        text_esc = char_trans(text, chr_dict)
-    return text_esc
-
-
 def get_time(seconds):
     """This is the get time function
     It returns human readable time format for stats.
@@ -1273,6 +1507,30 @@ def parse_cli_args(indexname):
                         help="Use filesize only for generating filehash field (default: use filesize + last_modified)")
     parser.add_argument("-T", "--walkthreads", type=int, default=cpu_count()*2,
                         help="Number of threads for treewalk (default: cpu core count x 2)")
+    parser.add_argument("--walkprocs", type=int, metavar='NUMPROCS', default=0,
+                        help="Number of processes for treewalk, the walk frontier is sharded across them \
+                                and -T threads are split between them (default: 0, walk in this process only)")
+    parser.add_argument("--pathids", action="store_true",
+                        help="Use a hash of the doc type and full path as the doc id for file and directory docs, \
+                                bots get docs by id instead of searching and reindexed docs replace their old doc")
+    parser.add_argument("--embedstats", action="store_true",
+                        help="Embed the stats scandir already has in crawl batches so worker bots don't lstat \
+                                files and dirs again, halves metadata calls on nfs (scandir only)")
+    parser.add_argument("--inodesort", action="store_true",
+                        help="Sort each directory's files by inode number so they are stat'ed in inode order, \
+                                much less seeking on ext4/xfs hard disk volumes (scandir only)")
+    parser.add_argument("--incremental", metavar='INDEX2',
+                        help="Incremental crawl, for directories with the same mtime and ctime as in index2 \
+                                (prev index) copy file docs and take subdirs from index2 instead of listing the \
+                                directory, files changed without changing their directory's times keep their \
+                                index2 docs, index2 should be crawled with the same excludes and maxdepth \
+                                (scandir only)")
+    parser.add_argument("--journal", action="store_true",
+                        help="Keep a crawl journal of the walk frontier in redis so the crawl can be continued \
+                                with --resume if the dispatcher stops (scandir only)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume a crawl from it's journal (--journal) into the same index without \
+                                walking finished directories again")
     parser.add_argument("-A", "--autotag", action="store_true",
                         help="Get bots to auto-tag files/dirs based on patterns in config")
     parser.add_argument("-S", "--sizeondisk", action="store_true",
@@ -1339,6 +1597,9 @@ def parse_cli_args(indexname):
                         help="Debug message output")
     parser.add_argument("--listplugins", action="store_true",
                         help="List plugins")
+    parser.add_argument("--replaydeadletters", action="store_true",
+                        help="Bulk add docs for index from the dead letter store ([elasticsearch] deadletter) \
+                                again, docs which fail again go back to the store")
     parser.add_argument("-V", "--version", action="version",
                         version="diskover v%s" % version,
                         help="Prints version and exits")
@@ -1417,6 +1678,9 @@ def adaptive_batch(q, cliargs, batchsize):
     if q_len == 0:
         if (batchsize - ab_step) >= ab_start:
             batchsize = batchsize - ab_step
+    elif q is crawl_throttle.queue and crawl_throttle.above_low(q_len):
+        # bots are behind, send fewer larger batches until the queue drains
+        batchsize = ab_max
     elif q_len > 0:
         if (batchsize + ab_step) <= ab_max:
             batchsize = batchsize + ab_step
@@ -1425,6 +1689,59 @@ def adaptive_batch(q, cliargs, batchsize):
     return batchsize
 
 
+def set_crawl_context(cliargs, reindex_dict=None):
+    """This is the set crawl context function.
+    It publishes cliargs and reindex_dict to Redis as the crawl
+    context for worker bots and sets cliargs['crawlid'], which rq
+    jobs carry in place of them. --resume sets the crawl id saved in
+    the crawl journal first so requeued jobs still find their context.
+    Large reindex tag sets are stored in a Redis hash of their own.
+    """
+    if reindex_dict is None:
+        reindex_dict = TagIndex()
+    if not cliargs.get('crawlid'):
+        cliargs['crawlid'] = new_crawl_id(cliargs['index'])
+    if reindex_dict.key is None and len(reindex_dict) > config['redis_tagindexmax']:
+        reindex_dict.store(redis_conn, 'diskover:tags:' + cliargs['crawlid'], config['redis_contextttl'])
+    publish_context(redis_conn, cliargs['crawlid'], cliargs, reindex_dict, config['redis_contextttl'])
+
+
+def delete_crawl_context(cliargs):
+    """This is the delete crawl context function.
+    It deletes the crawl context and any reindex tags hash from
+    Redis once worker bots are done with the crawl's jobs.
+    """
+    delete_context(redis_conn, cliargs['crawlid'])
+    redis_conn.delete('diskover:tags:' + cliargs['crawlid'])
+
+
+def job_index(job):
+    """This is the job index function.
+    It returns the index name of a crawl job from it's crawl id
+    (or cliargs for jobs without one).
+    """
+    if isinstance(job.args[1], dict):
+        return job.args[1]['index']
+    return crawl_id_index(job.args[1])
+
+
+def get_bulk_enqueuer(queue):
+    """This is the get bulk enqueuer function.
+    It returns a bulk enqueuer for queue using config settings.
+    """
+    return BulkEnqueuer(queue, config['redis_ttl'], size=config['redis_enqueuesize'],
+                        interval=config['redis_enqueueinterval'])
+
+
+def get_crawl_throttle(queue):
+    """This is the get crawl throttle function.
+    It returns a crawl queue throttle for queue using config settings.
+    """
+    return QueueThrottle(queue, highwater=config['redis_queue_highwater'],
+                         lowwater=config['redis_queue_lowwater'],
+                         maxbytes=config['redis_queue_maxmb'] * 1024 * 1024)
+
+
 def calc_dir_sizes(cliargs, logger, path=None):
     from diskover_bot_module import calc_dir_size
     jobcount = 0
@@ -1432,11 +1749,13 @@ def calc_dir_sizes(cliargs, logger, path=None):
     maxdepth = cliargs['maxdcdepth']
     index = cliargs['index']
 
+    jobdone = jobdone_subscribe()
+
     try:
         # wait for worker bots to be idle and all queues are empty
         logger.info('Waiting for diskover worker bots to be done with any jobs in rq...')
         while worker_bots_busy([q, q_crawl, q_calc]):
-            time.sleep(1)
+            wait_for_jobdone(jobdone)
 
         if cliargs['adaptivebatch']:
             batchsize = ab_start
@@ -1464,6 +1783,7 @@ def calc_dir_sizes(cliargs, logger, path=None):
         res = es.search(index=index, doc_type='directory', scroll='1m',
                         size=config['es_scrollsize'], body=data, request_timeout=config['es_timeout'])
 
+        enqueuer = get_bulk_enqueuer(q_calc)
         dirlist = []
         dircount = 0
         bartimestamp = time.time()
@@ -1481,7 +1801,7 @@ def calc_dir_sizes(cliargs, logger, path=None):
                 dircount += 1
                 dirlist_len = len(dirlist)
                 if dirlist_len >= batchsize:
-                    q_calc.enqueue(calc_dir_size, args=(dirlist, cliargs,), result_ttl=config['redis_ttl'])
+                    enqueuer.enqueue(calc_dir_size, (dirlist, cliargs['crawlid'],))
                     jobcount += 1
                     if cliargs['debug'] or cliargs['verbose']:
                         logger.info("enqueued batchsize: %s (batchsize: %s)" % (dirlist_len, batchsize))
@@ -1507,8 +1827,9 @@ def calc_dir_sizes(cliargs, logger, path=None):
 
         # enqueue dir calc job for any remaining in dirlist
         if len(dirlist) > 0:
-            q_calc.enqueue(calc_dir_size, args=(dirlist, cliargs,), result_ttl=config['redis_ttl'])
+            enqueuer.enqueue(calc_dir_size, (dirlist, cliargs['crawlid'],))
             jobcount += 1
+        enqueuer.close()
 
         logger.info('Found %s directory docs' % str(dircount))
 
@@ -1527,7 +1848,7 @@ def calc_dir_sizes(cliargs, logger, path=None):
                     bar.update(bar_max_val - q_len)
                 except (ZeroDivisionError, ValueError):
                     bar.update(0)
-            time.sleep(1)
+            wait_for_jobdone(jobdone)
 
         if bar:
             bar.finish()
@@ -1538,6 +1859,121 @@ def calc_dir_sizes(cliargs, logger, path=None):
     except KeyboardInterrupt:
         print("Ctrl-c keyboard interrupt, shutting down...")
         sys.exit(0)
+    finally:
+        jobdone.close()
+
+
+def stat_tuple(st):
+    """This is the stat tuple function.
+    It returns the stat tuple embeded in crawl batches for files,
+    the same fields bots unpack from lstat plus block count.
+    """
+    return tuple(st)[:10] + (getattr(st, 'st_blocks', 0),)
+
+
+def entry_files(entries, cliargs):
+    """This is the entry files function.
+    It returns the files list of a directory listing from scandir
+    file entries, file names or (path, stat tuple) for --embedstats.
+    For --inodesort the entries are sorted by inode number (from
+    readdir, no stat needed) so files are stat'ed in inode table
+    order instead of seeking around it on ext4/xfs hard disks.
+    """
+    if cliargs['inodesort']:
+        entries.sort(key=lambda e: e.inode())
+    if not cliargs['embedstats']:
+        return [entry.name for entry in entries]
+    files = []
+    for entry in entries:
+        try:
+            if walk_lstat:
+                st = walk_lstat(entry.path)
+            else:
+                st = entry.stat(follow_symlinks=False)
+            files.append((entry.path, stat_tuple(st)))
+        except OSError:
+            # file gone since listing
+            pass
+    return files
+
+
+def scandir_listdir(threadn, path, num_sep, level, cliargs, logger, put_path, put_result):
+    """This is the scandir list directory function.
+    It lists a directory using scandir, hands any subdirs to put_path
+    to be walked and hands the directory listing (and any file chunks)
+    to put_result. For --incremental, directories unchanged since
+    index2 are not listed, their subdirs are taken from index2 and
+    bots copy their file docs from index2.
+    """
+    dirs = []
+    nondirs = []
+    subdirs = []
+    item_count = 0
+    f_count = 0
+    chunked = False
+    unchanged = False
+    if cliargs['embedstats'] or cliargs['incremental']:
+        st = tuple(walk_lstat(path) if walk_lstat else os.lstat(path))[:10]
+        if cliargs['incremental']:
+            unchanged_subdirs = incremental_unchanged_subdirs(path, st, cliargs)
+            unchanged = unchanged_subdirs is not None
+    if cliargs['embedstats']:
+        # embed stats in listing so bots don't need to lstat again
+        root = (path, st)
+        chunkroot = (path, 'dchunk', True)
+    else:
+        root = path
+        chunkroot = (path, 'dchunk')
+    if unchanged:
+        root = (path, 'dcopy', st if cliargs['embedstats'] else None)
+        for name in unchanged_subdirs:
+            subpath = os.path.join(path, name)
+            if cliargs['maxdepth'] and num_sep + level < subpath.count(os.path.sep):
+                break
+            if dir_excluded(subpath, config, cliargs):
+                continue
+            if crawl_journal:
+                subdirs.append(subpath)
+            else:
+                put_path(subpath)
+            dirs.append(name)
+        entries = ()
+    else:
+        entries = scandir(path)
+    for entry in entries:
+        # check if at maxdepth level to not enqueue subdirs and 
+        # descend further down the tree
+        if cliargs['maxdepth']:
+            num_sep_this = entry.path.count(os.path.sep)
+            if num_sep + level < num_sep_this:
+                break
+        if entry.is_dir(follow_symlinks=False) and not dir_excluded(entry.path, config, cliargs):
+            if crawl_journal:
+                # journal subdirs along with the listing before walking them
+                subdirs.append(entry.path)
+            else:
+                put_path(entry.path)
+            dirs.append(entry.name)
+        elif entry.is_file(follow_symlinks=False):
+            nondirs.append(entry)
+            f_count += 1
+        if item_count == 10000 and (cliargs['debug'] or cliargs['verbose']):
+            logger.info("[thread-%s] scandirwalk_worker: processing directory with many items: %s" % (threadn, path))
+        if cliargs['chunkfiles'] and f_count > cliargs['chunkfilesnum']:
+            if cliargs['debug'] or cliargs['verbose']:
+                logger.info("[thread-%s] scandirwalk_worker: chunksize reached, sending partial dirlist to worker bots: %s" % (threadn, path))
+            if crawl_journal:
+                crawl_journal.chunked(path)
+                chunked = True
+            put_result((chunkroot, dirs[:], entry_files(nondirs, cliargs)))
+            del dirs[:]
+            del nondirs[:]
+            f_count = 0
+        item_count += 1
+    if crawl_journal and crawl_journal.listed(path, subdirs, chunked):
+        for d in subdirs:
+            put_path(d)
+    put_result((root, dirs, entry_files(nondirs, cliargs)))
 
 
 def scandirwalk_worker(threadn, num_sep, level, cliargs, logger):
@@ -1556,7 +1992,6 @@ def scandirwalk_worker(threadn, num_sep, level, cliargs, logger):
     while True:
         path = q_paths.get()
         try:
-            q_paths_in_progress.put(path)
             if cliargs['debug'] or cliargs['verbose']:
                 logger.info("[thread-%s] scandirwalk_worker: %s" % (threadn, path))
             if cliargs['crawlapi']:
@@ -1580,6 +2015,7 @@ def scandirwalk_worker(threadn, num_sep, level, cliargs, logger):
                     nondirs.append(f)
                 del api_dirs[:]
                 del api_nondirs[:]
+                q_paths_results.put((path, dirs[:], nondirs[:]))
             elif stor_agent:
                 # grab dir list from storage agent server
                 dir_list = stor_agent_conn.listdir(path)
@@ -1588,33 +2024,10 @@ def scandirwalk_worker(threadn, num_sep, level, cliargs, logger):
                 for d in dirs_noexcl:
                     if not dir_excluded(d, config, cliargs):
                         dirs.append(d)
+                q_paths_results.put((path, dirs[:], nondirs[:]))
             else:
-                item_count = 0
-                f_count = 0
-                for entry in scandir(path):
-                    # check if at maxdepth level to not enqueue subdirs and 
-                    # descend further down the tree
-                    if cliargs['maxdepth']:
-                        num_sep_this = entry.path.count(os.path.sep)
-                        if num_sep + level < num_sep_this:
-                            break
-                    if entry.is_dir(follow_symlinks=False) and not dir_excluded(entry.path, config, cliargs):
-                        q_paths.put(entry.path)
-                        dirs.append(entry.name)
-                    elif entry.is_file(follow_symlinks=False):
-                        nondirs.append(entry.name)
-                        f_count += 1
-                    if item_count == 10000 and (cliargs['debug'] or cliargs['verbose']):
-                        logger.info("[thread-%s] scandirwalk_worker: processing directory with many items: %s" % (threadn, path))
-                    if cliargs['chunkfiles'] and f_count > cliargs['chunkfilesnum']:
-                        if cliargs['debug'] or cliargs['verbose']:
-                            logger.info("[thread-%s] scandirwalk_worker: chunksize reached, sending partial dirlist to worker bots: %s" % (threadn, path))
-                        q_paths_results.put(((path, 'dchunk'), dirs[:], nondirs[:]))
-                        del dirs[:]
-                        del nondirs[:]
-                        f_count = 0
-                    item_count += 1
-            q_paths_results.put((path, dirs[:], nondirs[:]))
+                scandir_listdir(threadn, path, num_sep, level, cliargs, logger,
+                                q_paths.put, q_paths_results.put)
         except (OSError, IOError) as e:
             logger.warning("[thread-%s] OS/IO Exception caused by: %s" % (threadn, e))
             pass
@@ -1625,16 +2038,31 @@ def scandirwalk_worker(threadn, num_sep, level, cliargs, logger):
             logger.error("[thread-%s] Exception caused by: %s" % (threadn, e))
             raise
         finally:
-            q_paths_in_progress.get()
-        del dirs[:]
-        del nondirs[:]
-        q_paths.task_done()
+            del dirs[:]
+            del nondirs[:]
+            # done after subdirs and results have been put
+            q_paths.task_done()
 
 
-def scandirwalk(path, cliargs, logger):
-    q_paths.put(path)
+def scandirwalk_done():
+    """This is the scandir walk done function.
+    It waits for every path put in q_paths to be listed and
+    then tells scandirwalk the walk is done.
+    """
+    q_paths.join()
+    q_paths_results.put(None)
+
+
+def scandirwalk(paths, cliargs, logger):
+    for path in paths:
+        q_paths.put(path)
+    t = Thread(target=scandirwalk_done)
+    t.daemon = True
+    t.start()
     while True:
         entry = q_paths_results.get()
+        if entry is None:
+            break
         root, dirs, nondirs = entry
         if cliargs['debug'] or cliargs['verbose']:
             if cliargs['crawlapi']:
@@ -1643,10 +2071,6 @@ def scandirwalk(path, cliargs, logger):
                 logger.info("scandirwalk: %s (dircount: %s, filecount: %s)" % (root, str(len(dirs)), str(len(nondirs))))
         yield root, dirs, nondirs
         q_paths_results.task_done()
-        if q_paths_results.qsize() == 0 and q_paths.qsize() == 0:
-            time.sleep(.5)
-            if q_paths_results.qsize() == 0 and q_paths.qsize() == 0 and q_paths_in_progress.qsize() == 0:
-                break
 
 
 def treewalk(top, num_sep, level, batchsize, cliargs, logger, reindex_dict):
@@ -1655,19 +2079,8 @@ def treewalk(top, num_sep, level, batchsize, cliargs, logger, reindex_dict):
     to redis queue for rq worker bots to scrape meta and upload
     to ES index after batch size (dir count) has been reached.
     """
-    from diskover_bot_module import scrape_tree_meta
-    batch = []
-    dircount = 0
-    totaldirs = 0
-    totalfiles = 0
     starttime = time.time()
 
-    # set up threads for tree walk
-    for i in range(cliargs['walkthreads']):
-        t = Thread(target=scandirwalk_worker, args=(i, num_sep, level, cliargs, logger,))
-        t.daemon = True
-        t.start()
-
     # set up progress bar
     if not cliargs['quiet'] and not cliargs['debug'] and not cliargs['verbose']:
         widgets = [progressbar.AnimatedMarker(), ' Crawling (Queue: ', progressbar.Counter(),
@@ -1676,16 +2089,90 @@ def treewalk(top, num_sep, level, batchsize, cliargs, logger, reindex_dict):
         bar = progressbar.ProgressBar(widgets=widgets, max_value=progressbar.UnknownLength)
         bar.start()
     else:
+        widgets = None
         bar = None
 
+    if cliargs['walkprocs']:
+        totaldirs = treewalk_procs(top, num_sep, level, batchsize, cliargs, logger,
+                                   reindex_dict, bar, widgets)
+    else:
+        totaldirs = treewalk_threads(top, num_sep, level, batchsize, cliargs, logger,
+                                     reindex_dict, bar, widgets)
+
+    # walk is done and all batches are in rq
+    if crawl_journal:
+        crawl_journal.clear()
+
+    # set up progress bar with time remaining
+    if bar:
+        bar.finish()
+        bar_max_val = len(q_crawl)
+        bar = progressbar.ProgressBar(max_value=bar_max_val)
+        bar.start()
+
+    # update progress bar until bots are idle and queue is empty
+    jobdone = jobdone_subscribe()
+    try:
+        while worker_bots_busy([q_crawl]):
+            if bar:
+                q_len = len(q_crawl)
+                try:
+                    bar.update(bar_max_val - q_len)
+                except (ZeroDivisionError, ValueError):
+                    bar.update(0)
+            wait_for_jobdone(jobdone)
+    finally:
+        jobdone.close()
+
+    if bar:
+        bar.finish()
+
+    elapsed = time.time() - starttime
+    dirspersec = round(totaldirs / elapsed, 3)
+    elapsed = get_time(elapsed)
+
+    logger.info("Finished crawling in %s, dirs walked %s (%s dirs/sec)" %
+                (elapsed, totaldirs, dirspersec))
+    if crawl_throttle.stalls:
+        logger.info("Walk paused %s times for %s waiting for crawl queue to drain (backpressure)"
+                    % (crawl_throttle.stalls, get_time(crawl_throttle.stalltime)))
+
+
+def treewalk_threads(top, num_sep, level, batchsize, cliargs, logger, reindex_dict, bar, widgets):
+    """This is the tree walk threads function.
+    It walks the tree using treewalk threads in this process and
+    returns the number of directories walked.
+    """
+    from diskover_bot_module import scrape_tree_meta
+    batch = []
+    dircount = 0
+    totaldirs = 0
+    totalfiles = 0
+
+    # walk from the journal frontier if resuming
+    if cliargs['resume']:
+        tops = crawl_journal.frontier
+        if not tops:
+            return totaldirs
+    else:
+        tops = [top]
+
+    # set up threads for tree walk
+    for i in range(cliargs['walkthreads']):
+        t = Thread(target=scandirwalk_worker, args=(i, num_sep, level, cliargs, logger,))
+        t.daemon = True
+        t.start()
+
     bartimestamp = time.time()
-    for root, dirs, files in scandirwalk(top, cliargs, logger):
+    for root, dirs, files in scandirwalk(tops, cliargs, logger):
+        dircopy = False
         if type(root) is tuple:
             _root = root[0]
             if root[1] == 'dchunk':
                 dirchunk = True
                 statsembeded = False
             else:
+                dircopy = root[1] == 'dcopy'
                 statsembeded = True
                 dirchunk = False
         else:
@@ -1697,25 +2184,25 @@ def treewalk(top, num_sep, level, batchsize, cliargs, logger, reindex_dict):
             totaldirs += 1
         files_len = len(files)
         dirs_len = len(dirs)
-        # check for empty dirs
-        if not cliargs['indexemptydirs']:
+        # check for empty dirs, unchanged dirs (dcopy) have their files in index2
+        if not cliargs['indexemptydirs'] and not dircopy:
             if dirs_len == 0 and files_len == 0:
                 if cliargs['debug'] or cliargs['verbose']:
                     logger.info("skipping empty dir: %s" % _root)
+                if crawl_journal:
+                    crawl_journal.done(_root)
                 continue
         totalfiles += files_len
+        if crawl_journal and not dirchunk:
+            crawl_journal.done(_root)
         # replace path if cliarg
         if cliargs['replacepath']:
-            if dirchunk:
-                root[0] = replace_path(root[0])
-            else:
-                root = replace_path(root)
+            root, files = replace_listing_paths(root, files)
         # add directory and it's items to batch list
         batch.append((root, dirs, files))
         batch_len = len(batch)
         if batch_len >= batchsize or (cliargs['adaptivebatch'] and totalfiles >= config['adaptivebatch_maxfiles']):
-            q_crawl.enqueue(scrape_tree_meta, args=(batch, cliargs, reindex_dict,),
-                                    result_ttl=config['redis_ttl'])
+            crawl_batch_enqueue(scrape_tree_meta, batch, cliargs, logger)
             if cliargs['debug'] or cliargs['verbose']:
                 logger.info("enqueued batchsize: %s (batchsize: %s)" % (batch_len, batchsize))
             del batch[:]
@@ -1741,34 +2228,289 @@ def treewalk(top, num_sep, level, batchsize, cliargs, logger, reindex_dict):
 
     # add any remaining in batch to queue
     if len(batch) > 0:
-        q_crawl.enqueue(scrape_tree_meta, args=(batch, cliargs, reindex_dict,), result_ttl=config['redis_ttl'])
+        crawl_batch_enqueue(scrape_tree_meta, batch, cliargs, logger)
+    crawl_enqueuer.close()
 
-    # set up progress bar with time remaining
-    if bar:
-        bar.finish()
-        bar_max_val = len(q_crawl)
-        bar = progressbar.ProgressBar(max_value=bar_max_val)
-        bar.start()
+    return totaldirs
 
-    # update progress bar until bots are idle and queue is empty
-    while worker_bots_busy([q_crawl]):
+
+def crawl_batch_enqueue(job, batch, cliargs, logger):
+    """This is the crawl batch enqueue function.
+    It enqueues a crawl batch to rq using the crawl bulk enqueuer,
+    along with any crawl journal changes if keeping a journal. The
+    job gets the crawl id, bots get cliargs and reindex_dict from
+    the crawl context. Waits
+    first if the crawl queue is above it's high watermark (backpressure).
+    """
+    stalled = crawl_throttle.wait()
+    if stalled and (cliargs['debug'] or cliargs['verbose']):
+        logger.info("crawl queue reached high watermark, walk paused for %s sec" % round(stalled, 3))
+    if crawl_journal:
+        job = crawl_enqueuer.enqueue(job, (batch, cliargs['crawlid'],), crawl_journal.commit())
+    else:
+        job = crawl_enqueuer.enqueue(job, (batch, cliargs['crawlid'],))
+    crawl_throttle.add(job)
+    return job
+
+
+def resume_crawl(path, cliargs, logger):
+    """This is the resume crawl function.
+    It loads the crawl journal for --resume, requeues any failed
+    crawl jobs for the index and waits for bots to finish the crawl
+    jobs already in rq. Then deletes file docs sent in chunks for
+    directories which will be listed again.
+    """
+    if not crawl_journal.exists():
+        logger.error("No crawl journal found for %s, can't resume, exiting" % cliargs['index'])
+        sys.exit(1)
+    journal_rootdir = crawl_journal.meta()['rootdir']
+    if journal_rootdir != path:
+        logger.error("Crawl journal is for %s not %s, exiting" % (journal_rootdir, path))
+        sys.exit(1)
+
+    chunked = crawl_journal.load()
+    logger.info('Resuming crawl of %s, %s directories left in journal (--resume)'
+                % (path, len(crawl_journal.frontier)))
+
+    # requeue failed crawl jobs
+    registry = FailedJobRegistry(queue=q_crawl)
+    requeued = 0
+    for job_id in registry.get_job_ids():
+        try:
+            job = Job.fetch(job_id, connection=redis_conn)
+        except NoSuchJobError:
+            continue
+        if job.func_name.endswith('scrape_tree_meta') and job_index(job) == cliargs['index']:
+            registry.requeue(job_id)
+            requeued += 1
+    if requeued > 0:
+        logger.info('Requeued %s failed crawl jobs' % requeued)
+
+    wait_for_worker_bots(logger)
+    logger.info('Waiting for diskover worker bots to be done with any crawl jobs in rq...')
+    jobdone = jobdone_subscribe()
+    try:
+        while worker_bots_busy([q_crawl]):
+            wait_for_jobdone(jobdone)
+    finally:
+        jobdone.close()
+
+    # remove files already sent in chunks for directories being listed again
+    if chunked:
+        if cliargs['replacepath']:
+            chunked = [replace_path(p) for p in chunked]
+        index_delete_files(chunked, cliargs, logger)
+
+
+def get_mp_context():
+    """This is the get multiprocessing context function.
+    It returns a fork context so walk processes inherit config
+    and cliargs from the dispatcher.
+    """
+    try:
+        return multiprocessing.get_context('fork')
+    except AttributeError:  # python2 always forks
+        return multiprocessing
+
+
+def walkproc_shard(path, nprocs):
+    """This is the walk process shard function.
+    It returns the number of the walk process that owns path.
+    """
+    return (zlib.crc32(path_bytes(path)) & 0xffffffff) % nprocs
+
+
+def walkproc_put_path(path, shards, outstanding):
+    """This is the walk process put path function.
+    It counts path as outstanding work and puts it in the
+    frontier shard of the walk process that owns it.
+    """
+    with outstanding.get_lock():
+        outstanding.value += 1
+    shards[walkproc_shard(path, len(shards))].put(path)
+
+
+def walkproc_put_result(result, state, dirs_walked, cliargs, logger, reindex_dict):
+    """This is the walk process put result function.
+    It adds a directory listing to the walk process batch and
+    enqueues the batch to rq once batch size has been reached.
+    """
+    root, dirs, files = result
+    if type(root) is tuple:
+        _root = root[0]
+        dirchunk = root[1] == 'dchunk'
+        dircopy = root[1] == 'dcopy'
+    else:
+        _root = root
+        dirchunk = False
+        dircopy = False
+    if not dirchunk:
+        with dirs_walked.get_lock():
+            dirs_walked.value += 1
+    # check for empty dirs, unchanged dirs (dcopy) have their files in index2
+    if not cliargs['indexemptydirs'] and not dircopy and len(dirs) == 0 and len(files) == 0:
+        if cliargs['debug'] or cliargs['verbose']:
+            logger.info("skipping empty dir: %s" % _root)
+        return
+    # replace path if cliarg
+    if cliargs['replacepath']:
+        root, files = replace_listing_paths(root, files)
+    with state['lock']:
+        state['batch'].append((root, dirs, files))
+        state['totalfiles'] += len(files)
+        batch_len = len(state['batch'])
+        if batch_len >= state['batchsize'] or \
+                (cliargs['adaptivebatch'] and state['totalfiles'] >= config['adaptivebatch_maxfiles']):
+            crawl_batch_enqueue(state['job'], state['batch'], cliargs, logger)
+            if cliargs['debug'] or cliargs['verbose']:
+                logger.info("enqueued batchsize: %s (batchsize: %s)" % (batch_len, state['batchsize']))
+            state['batch'] = []
+            state['totalfiles'] = 0
+            if cliargs['adaptivebatch']:
+                state['batchsize'] = adaptive_batch(q_crawl, cliargs, state['batchsize'])
+
+
+def walkproc_thread(procn, threadn, shards, outstanding, walk_done, state, dirs_walked,
+                    num_sep, level, cliargs, logger, reindex_dict):
+    """This is the walk process thread function.
+    It gets paths from the walk process frontier shard and lists them.
+    The thread that finishes the last outstanding directory signals
+    the end of the walk.
+    """
+    shard = shards[procn]
+    put_path = partial(walkproc_put_path, shards=shards, outstanding=outstanding)
+    put_result = partial(walkproc_put_result, state=state, dirs_walked=dirs_walked,
+                         cliargs=cliargs, logger=logger, reindex_dict=reindex_dict)
+    while True:
+        path = shard.get()
+        if path is None:
+            break
+        try:
+            if cliargs['debug'] or cliargs['verbose']:
+                logger.info("[proc-%s thread-%s] walkproc_thread: %s" % (procn, threadn, path))
+            scandir_listdir(threadn, path, num_sep, level, cliargs, logger, put_path, put_result)
+        except (OSError, IOError) as e:
+            logger.warning("[proc-%s thread-%s] OS/IO Exception caused by: %s" % (procn, threadn, e))
+        except UnicodeDecodeError as e:
+            logger.warning("[proc-%s thread-%s] Unicode Decode Exception caused by: %s (path: %s)"
+                           % (procn, threadn, e, path))
+        except Exception as e:
+            logger.error("[proc-%s thread-%s] Exception caused by: %s" % (procn, threadn, e))
+        finally:
+            with outstanding.get_lock():
+                outstanding.value -= 1
+                if outstanding.value == 0:
+                    walk_done.set()
+
+
+def walkproc_worker(procn, nthreads, shards, outstanding, walk_done, dirs_walked,
+                    num_sep, level, batchsize, cliargs, logger, reindex_dict):
+    """This is the walk process function.
+    It runs walk threads over the walk process frontier shard and
+    enqueues it's own batches to rq. Any batch remaining when the
+    walk is done is enqueued before the process exits.
+    """
+    global redis_conn, q_crawl, crawl_enqueuer, crawl_throttle
+    from diskover_bot_module import scrape_tree_meta
+    # own Redis connection, crawl bulk enqueuer and throttle rather
+    # than the copies of the parent's forked with the process
+    diskover_connections.connect_to_redis()
+    redis_conn = diskover_connections.redis_conn
+    q_crawl = Queue(listen[1], connection=redis_conn, default_timeout=config['redis_rq_timeout'])
+    crawl_enqueuer = get_bulk_enqueuer(q_crawl)
+    crawl_throttle = get_crawl_throttle(q_crawl)
+    if crawl_journal:
+        crawl_journal.redis = redis_conn
+    state = {'lock': Lock(), 'job': scrape_tree_meta, 'batch': [], 'batchsize': batchsize,
+             'totalfiles': 0}
+    threads = []
+    for i in range(nthreads):
+        t = Thread(target=walkproc_thread, args=(procn, i, shards, outstanding, walk_done, state,
+                                                 dirs_walked, num_sep, level, cliargs, logger,
+                                                 reindex_dict,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    # add any remaining in batch to queue
+    if len(state['batch']) > 0:
+        crawl_batch_enqueue(scrape_tree_meta, state['batch'], cliargs, logger)
+    crawl_enqueuer.close()
+    if crawl_throttle.stalls:
+        logger.info("[proc-%s] walk paused %s times for %s waiting for crawl queue to drain"
+                    % (procn, crawl_throttle.stalls, get_time(crawl_throttle.stalltime)))
+
+
+def treewalk_procs(top, num_sep, level, batchsize, cliargs, logger, reindex_dict, bar, widgets):
+    """This is the tree walk processes function.
+    It shards the walk frontier across walk processes which each
+    scandir and batch their own directories straight to rq. This
+    process only coordinates, tracking outstanding directories to
+    know when the walk is done and updating progress.
+    Returns the number of directories walked.
+    """
+    mp = get_mp_context()
+    nprocs = cliargs['walkprocs']
+    nthreads = max(1, cliargs['walkthreads'] // nprocs)
+    shards = [mp.Queue() for i in range(nprocs)]
+    outstanding = mp.Value('l', 0)
+    dirs_walked = mp.Value('l', 0)
+    walk_done = mp.Event()
+
+    walkproc_put_path(top, shards, outstanding)
+
+    procs = []
+    for i in range(nprocs):
+        p = mp.Process(target=walkproc_worker, args=(i, nthreads, shards, outstanding, walk_done,
+                                                     dirs_walked, num_sep, level, batchsize,
+                                                     cliargs, logger, reindex_dict,))
+        p.daemon = True
+        p.start()
+        procs.append(p)
+
+    bartimestamp = time.time()
+    lastdirs = 0
+    while not walk_done.wait(2):
+        # walk processes only exit once the walk is done, a dead one
+        # leaves it's dirs outstanding and the walk would never finish
+        dead = [p for p in procs if not p.is_alive()]
+        if dead and not walk_done.is_set():
+            for p in dead:
+                logger.error("Walk process %s exited with exit code %s before the walk was done"
+                             % (p.pid, p.exitcode))
+            logger.error("Stopping crawl, %s dirs outstanding" % outstanding.value)
+            for p in procs:
+                if p.is_alive():
+                    p.terminate()
+            for p in procs:
+                p.join()
+            sys.exit(1)
+        # update progress bar
+        totaldirs = dirs_walked.value
         if bar:
-            q_len = len(q_crawl)
             try:
-                bar.update(bar_max_val - q_len)
+                elapsed = round(time.time() - bartimestamp, 3)
+                dirspersec = round((totaldirs - lastdirs) / elapsed, 3)
+                widgets[4] = progressbar.FormatLabel(', ' + str(dirspersec) + ' dirs/sec) ')
+                bar.update(len(q_crawl))
             except (ZeroDivisionError, ValueError):
                 bar.update(0)
-        time.sleep(1)
-
-    if bar:
-        bar.finish()
+            finally:
+                bartimestamp = time.time()
+                lastdirs = totaldirs
+        elif cliargs['debug'] or cliargs['verbose']:
+            logger.info("walk processes: %s dirs walked, %s dirs outstanding"
+                        % (totaldirs, outstanding.value))
 
-    elapsed = time.time() - starttime
-    dirspersec = round(totaldirs / elapsed, 3)
-    elapsed = get_time(elapsed)
+    # tell walk threads to stop and wait for walk processes to send their last batches
+    for shard in shards:
+        for i in range(nthreads):
+            shard.put(None)
+    for p in procs:
+        p.join()
 
-    logger.info("Finished crawling in %s, dirs walked %s (%s dirs/sec)" %
-                (elapsed, totaldirs, dirspersec))
+    return dirs_walked.value
 
 
 def crawl_tree(path, cliargs, logger, reindex_dict):
@@ -1786,6 +2528,15 @@ def crawl_tree(path, cliargs, logger, reindex_dict):
         if cliargs['sizeondisk']:
             logger.info("Storing on disk size instead of file size using a blocksize of %s (-S)" % cliargs['blocksize'])
 
+        if cliargs['embedstats']:
+            logger.info("Embedding scandir stats in crawl batches, bots won't lstat (--embedstats)")
+
+        if cliargs['inodesort']:
+            logger.info("Sorting directory file listings by inode number (--inodesort)")
+
+        if crawl_journal:
+            logger.info("Keeping crawl journal in redis, crawl can be resumed with --resume (--journal)")
+
         if cliargs['adaptivebatch']:
             batchsize = ab_start
             cliargs['batchsize'] = batchsize
@@ -1828,9 +2579,27 @@ def crawl_tree(path, cliargs, logger, reindex_dict):
             starttime = start_socket_server_twc(rootdir_path, num_sep, level, batchsize, cliargs, logger, reindex_dict)
             return starttime
 
+        # load directory times and subdirs under rootdir from index2 for incremental crawl
+        if cliargs['incremental']:
+            logger.info("Incremental crawl, copying file docs for unchanged directories from %s (--incremental)"
+                        % cliargs['incremental'])
+            dirtimes, subdirs = index_get_docs(cliargs, logger, doctype='directory', index=cliargs['incremental'],
+                                               path=replace_path(path) if cliargs['replacepath'] else path,
+                                               dirtimes=True)
+            incremental_dirtimes.update(dirtimes)
+            incremental_subdirs.update(subdirs)
+
         starttime = time.time()
 
-        logger.info("Starting crawl using %s treewalk threads (maxdepth %s)" % (cliargs['walkthreads'], cliargs['maxdepth']))
+        if cliargs['walkprocs']:
+            logger.info("Starting crawl using %s treewalk processes with %s threads each (maxdepth %s)"
+                        % (cliargs['walkprocs'], max(1, cliargs['walkthreads'] // cliargs['walkprocs']),
+                           cliargs['maxdepth']))
+        else:
+            logger.info("Starting crawl using %s treewalk threads (maxdepth %s)" % (cliargs['walkthreads'], cliargs['maxdepth']))
+            if cliargs['verbose'] or cliargs['debug']:
+                logger.info("Treewalk order: %s, frontier maxmem: %s MB, max results: %s"
+                            % (config['treewalk_order'], config['treewalk_maxmem'], config['treewalk_maxresults']))
 
         # start tree walking
         treewalk(path, num_sep, level, batchsize, cliargs, logger, reindex_dict)
@@ -1839,6 +2608,8 @@ def crawl_tree(path, cliargs, logger, reindex_dict):
 
     except KeyboardInterrupt:
         print("Ctrl-c keyboard interrupt, shutting down...")
+        # remove any frontier segments spilled to disk
+        q_paths.close()
         sys.exit(0)
 
 
@@ -1851,6 +2622,7 @@ def hotdirs():
                          cliargs['hotdirs'], cliargs['index'])
     # look in index for all directory docs and add to queue
     dirlist = index_get_docs(cliargs, logger, doctype='directory', hotdirs=True, index=cliargs['index'])
+    enqueuer = get_bulk_enqueuer(q)
     dirbatch = []
     if cliargs['adaptivebatch']:
         batchsize = ab_start
@@ -1861,13 +2633,14 @@ def hotdirs():
     for d in dirlist:
         dirbatch.append(d)
         if len(dirbatch) >= batchsize:
-            q.enqueue(calc_hot_dirs, args=(dirbatch, cliargs,), result_ttl=config['redis_ttl'])
+            enqueuer.enqueue(calc_hot_dirs, (dirbatch, cliargs['crawlid'],))
             del dirbatch[:]
             if cliargs['adaptivebatch']:
                 batchsize = adaptive_batch(q, cliargs, batchsize)
 
     # add any remaining in batch to queue
-    q.enqueue(calc_hot_dirs, args=(dirbatch, cliargs,), result_ttl=config['redis_ttl'])
+    enqueuer.enqueue(calc_hot_dirs, (dirbatch, cliargs['crawlid'],))
+    enqueuer.close()
 
     if not cliargs['quiet'] and not cliargs['debug'] and not cliargs['verbose']:
         bar = progress_bar('Checking')
@@ -1876,13 +2649,17 @@ def hotdirs():
         bar = None
 
     # update progress bar until all bots are idle and q queue is empty
-    while worker_bots_busy([q]):
-        if bar:
-            try:
-                bar.update(len(q))
-            except (ZeroDivisionError, ValueError):
-                bar.update(0)
-        time.sleep(1)
+    jobdone = jobdone_subscribe()
+    try:
+        while worker_bots_busy([q]):
+            if bar:
+                try:
+                    bar.update(len(q))
+                except (ZeroDivisionError, ValueError):
+                    bar.update(0)
+            wait_for_jobdone(jobdone)
+    finally:
+        jobdone.close()
 
     if bar:
         bar.finish()
@@ -1899,6 +2676,9 @@ def worker_bots_busy(queues):
         if worker._state == "busy":
             workers_busy = True
             break
+    if not workers_busy:
+        # bots can be idle with buffered docs still being bulk added
+        workers_busy = bulk_pending_bots() > 0
     q_len = 0
     running_jobs = 0
     for qname in queues:
@@ -1912,6 +2692,42 @@ def worker_bots_busy(queues):
         return True
 
 
+def bulk_pending_bots():
+    """This is the bulk pending bots function.
+    It drops stale bots from the bulk pending set and returns how
+    many bots still have buffered docs not in es yet.
+    """
+    now = redis_conn.time()[0]
+    pipe = redis_conn.pipeline()
+    pipe.zremrangebyscore(bulkpending_key, '-inf', now - BULKPENDING_STALE)
+    pipe.zcard(bulkpending_key)
+    return pipe.execute()[1]
+
+
+def jobdone_subscribe():
+    """This is the job done subscribe function.
+    It subscribes to the messages worker bots publish when they
+    empty a queue and returns the pubsub for wait_for_jobdone.
+    Subscribe before checking worker_bots_busy so no message is
+    missed, and close the pubsub when done waiting.
+    """
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(jobdone_channel)
+    return pubsub
+
+
+def wait_for_jobdone(pubsub, timeout=1):
+    """This is the wait for job done function.
+    It waits until a worker bot empties a queue or timeout seconds
+    have passed, so callers can check worker_bots_busy again as soon
+    as the last job is done instead of sleeping.
+    """
+    if pubsub.get_message(timeout=timeout):
+        # drain any other messages, one check covers them all
+        while pubsub.get_message():
+            pass
+
+
 def wait_for_worker_bots(logger):
     """This is the wait for worker bots function.
     It loops waiting for worker bots to start.
@@ -2019,8 +2835,15 @@ def post_crawl_tasks():
     if cliargs['reindex'] or cliargs['reindexrecurs']:
         # wait for worker bots to be idle and all queues are empty
         logger.info('Waiting for diskover worker bots to be done with any jobs in rq...')
-        while worker_bots_busy([q, q_crawl, q_calc]):
-            time.sleep(1)
+        jobdone = jobdone_subscribe()
+        try:
+            while worker_bots_busy([q, q_crawl, q_calc]):
+                wait_for_jobdone(jobdone)
+        finally:
+            jobdone.close()
+
+    # bots are done with the crawl's jobs
+    delete_crawl_context(cliargs)
 
     # set Elasticsearch index settings back to default
     tune_es_for_crawl(defaults=True)
@@ -2040,7 +2863,7 @@ def pre_crawl_tasks():
     tune_es_for_crawl()
 
     # add disk space info to es index
-    if not cliargs['reindex'] and not cliargs['reindexrecurs']:
+    if not cliargs['reindex'] and not cliargs['reindexrecurs'] and not cliargs['resume']:
         if cliargs['crawlapi']:
             from diskover_crawlapi import api_add_diskspace
             api_add_diskspace(es, cliargs['index'], rootdir_path, api_ses, logger)
@@ -2051,6 +2874,9 @@ def pre_crawl_tasks():
 # load config file into config dictionary
 config, configfile = load_config()
 
+# compile excludes/includes from config
+exclude_matcher = ExcludeMatcher(config)
+
 # set adaptive batch sizes from config
 ab_start = config['adaptivebatch_startsize']
 ab_max = config['adaptivebatch_maxsize']
@@ -2059,6 +2885,14 @@ ab_step = config['adaptivebatch_stepsize']
 # load any available plugins
 plugins = load_plugins()
 
+# byte sized bulk requests
+if config['es_bulkbytes']:
+    bulk_sizer = BulkSizer(config['es_bulkbytes'], minbytes=config['es_bulkminbytes'],
+                           maxbytes=config['es_bulkmaxbytes'], target=config['es_bulklatency'],
+                           maxdocs=config['es_bulkmaxdocs'])
+else:
+    bulk_sizer = None
+
 import diskover_connections
 
 # create Elasticsearch connection
@@ -2071,20 +2905,59 @@ from diskover_connections import helpers
 diskover_connections.connect_to_redis()
 from diskover_connections import redis_conn
 
+# indexes checked for path hash doc ids by the dispatcher, index -> True/False
+pathids_indices = {}
+
+# store for docs which failed to bulk add
+if config['es_deadletter']:
+    dead_letters = DeadLetterStore(config['es_deadletter'], redis_conn)
+else:
+    dead_letters = None
+
 # Redis queue names
 listen = [config['redis_queue'], config['redis_queue_crawl'], config['redis_queue_calcdir']]
 
+# Redis pubsub channel worker bots publish to when they empty a queue
+jobdone_channel = config['redis_queue'] + ':jobdone'
+
+# Redis sorted set of worker bots with buffered docs not in es yet, scored by
+# when they last said so (Redis server time)
+bulkpending_key = config['redis_queue'] + ':bulkpending'
+
+# seconds after which bulk pending bots which stopped saying so are dropped (dead bots)
+BULKPENDING_STALE = 30
+
 # set up Redis q
 q = Queue(listen[0], connection=redis_conn, default_timeout=config['redis_rq_timeout'])
 q_crawl = Queue(listen[1], connection=redis_conn, default_timeout=config['redis_rq_timeout'])
 q_calc = Queue(listen[2], connection=redis_conn, default_timeout=config['redis_rq_timeout'])
 
-# queue for paths
-q_paths = PyQueue()
-q_paths_results = PyQueue()
-q_paths_in_progress = PyQueue()
+# bulk enqueuer for crawl batches
+crawl_enqueuer = get_bulk_enqueuer(q_crawl)
+
+# crawl queue backpressure for tree walk
+crawl_throttle = get_crawl_throttle(q_crawl)
+
+# queue for paths (walk frontier) and bounded queue for results so
+# treewalk threads can't race ahead of enqueuing batches to rq
+q_paths = WalkFrontier(order=config['treewalk_order'], maxmem=config['treewalk_maxmem'] * 1024 * 1024,
+                       spilldir=config['treewalk_spilldir'], hybridpaths=config['treewalk_hybridpaths'])
+q_paths_results = PyQueue(maxsize=config['treewalk_maxresults'])
 lock = Lock()
 
+# statx lstat for --embedstats file stats if set in config
+walk_lstat = None
+if config['treewalk_statbackend'] != "lstat":
+    walk_lstat = stat_functions(config['treewalk_statbackend'])[1]
+
+# directory times from index2 for --incremental
+incremental_dirtimes = {}
+# index2 subdir names keyed by parent dir path hash
+incremental_subdirs = {}
+
+# crawl journal for --journal/--resume
+crawl_journal = None
+
 
 if __name__ == "__main__":
     # check fast c version of scandir is installed
@@ -2104,6 +2977,29 @@ if __name__ == "__main__":
         if cliargs['splitfilesnum'] <= cliargs['chunkfilesnum'] + 1:
             print('Error: --splitfilesnum cannot be <= --chunkfilesnum. See -h for defaults.')
             sys.exit(1)
+    if cliargs['walkprocs'] < 0:
+        print('Error: --walkprocs cannot be < 0. See -h for defaults.')
+        sys.exit(1)
+    if cliargs['walkprocs'] and (cliargs['crawlapi'] or cliargs['storagent']):
+        print('Error: --walkprocs can only be used with scandir, not --crawlapi or --storagent.')
+        sys.exit(1)
+    if cliargs['walkprocs'] and not hasattr(os, 'fork'):
+        print('Error: --walkprocs is not supported on this platform.')
+        sys.exit(1)
+    if cliargs['journal'] or cliargs['resume']:
+        if cliargs['walkprocs'] or cliargs['crawlapi'] or cliargs['storagent'] or cliargs['listentwc']:
+            print('Error: --journal/--resume can only be used with scandir treewalk threads, not --walkprocs, '
+                  '--crawlapi, --storagent or -L.')
+            sys.exit(1)
+        if cliargs['reindex'] or cliargs['reindexrecurs']:
+            print('Error: --journal/--resume cannot be used with -r or -R.')
+            sys.exit(1)
+    if cliargs['incremental'] and (cliargs['crawlapi'] or cliargs['storagent']):
+        print('Error: --incremental can only be used with scandir, not --crawlapi or --storagent.')
+        sys.exit(1)
+    if cliargs['incremental'] and cliargs['incremental'].lower() == cliargs['index']:
+        print('Error: --incremental index2 cannot be the same as the index being crawled.')
+        sys.exit(1)
 
     # set up logging
     logger = log_setup(cliargs)
@@ -2119,9 +3015,21 @@ if __name__ == "__main__":
         list_plugins()
         sys.exit(0)
 
+    # jobs on an existing index use the doc ids and path fields it was created with, bots
+    # get them from the crawl context so they don't cache lookups of indexes which can be recreated
+    cliargs['pathtree'] = True
+    if (cliargs['reindex'] or cliargs['reindexrecurs'] or cliargs['resume'] or cliargs['dircalcsonly']
+            or cliargs['copytags'] or cliargs['hotdirs']) and es.indices.exists(index=cliargs['index']):
+        cliargs['pathids'] = index_pathids(cliargs['index'])
+        cliargs['pathtree'] = index_path_fields(es, cliargs['index'])
+    cliargs['hotdirspathids'] = bool(cliargs['hotdirs']) and es.indices.exists(index=cliargs['hotdirs']) \
+        and index_pathids(cliargs['hotdirs'])
+
     # run just dir calcs if cli arg
     if cliargs['dircalcsonly']:
+        set_crawl_context(cliargs)
         calc_dir_sizes(cliargs, logger)
+        delete_crawl_context(cliargs)
         sys.exit(0)
 
     try:
@@ -2153,8 +3061,10 @@ if __name__ == "__main__":
     if cliargs['finddupes']:
         from diskover_dupes import dupes_finder
         wait_for_worker_bots(logger)
+        set_crawl_context(cliargs)
         # Set up worker threads for duplicate file checker queue
         dupes_finder(es, q, cliargs, logger)
+        delete_crawl_context(cliargs)
         logger.info('DONE checking for dupes! Sayonara!')
         sys.exit(0)
 
@@ -2162,15 +3072,19 @@ if __name__ == "__main__":
     if cliargs['copytags']:
         from diskover_bot_module import tag_copier
         wait_for_worker_bots(logger)
+        # bots copy tags after the dispatcher exits, the context expires after redis contextttl
+        set_crawl_context(cliargs)
         logger.info('Copying tags from %s to %s', cliargs['copytags'], cliargs['index'])
         # look in index2 for all directory docs with tags and add to queue
+        enqueuer = get_bulk_enqueuer(q)
         dirlist = index_get_docs(cliargs, logger, doctype='directory', copytags=True, index=cliargs['copytags'])
-        for path in dirlist:
-            q.enqueue(tag_copier, args=(path, cliargs,), result_ttl=config['redis_ttl'])
+        for i in range(0, len(dirlist), config['es_chunksize']):
+            enqueuer.enqueue(tag_copier, (dirlist[i:i + config['es_chunksize']], cliargs['crawlid'],))
         # look in index2 for all file docs with tags and add to queue
         filelist = index_get_docs(cliargs, logger, doctype='file', copytags=True, index=cliargs['copytags'])
-        for path in filelist:
-            q.enqueue(tag_copier, args=(path, cliargs,), result_ttl=config['redis_ttl'])
+        for i in range(0, len(filelist), config['es_chunksize']):
+            enqueuer.enqueue(tag_copier, (filelist[i:i + config['es_chunksize']], cliargs['crawlid'],))
+        enqueuer.close()
         if len(dirlist) == 0 and len(filelist) == 0:
             logger.info('No tags to copy')
         else:
@@ -2178,10 +3092,28 @@ if __name__ == "__main__":
         logger.info('Dispatcher is DONE! Sayonara!')
         sys.exit(0)
 
+    # bulk add dead letter docs again if cli argument
+    if cliargs['replaydeadletters']:
+        if not dead_letters:
+            logger.error('No dead letter store set in config ([elasticsearch] deadletter), exiting')
+            sys.exit(1)
+        doclist = dead_letters.get(cliargs['index'])
+        logger.info('Replaying %s dead letter docs to %s', len(doclist), cliargs['index'])
+        # docs are removed from the store a chunk at a time once bulk added,
+        # docs which fail again are stored again by index_bulk_add
+        for i in range(0, len(doclist), config['es_chunksize']):
+            chunk = doclist[i:i + config['es_chunksize']]
+            index_bulk_add(es, chunk, config, cliargs)
+            dead_letters.remove(cliargs['index'], len(chunk))
+        logger.info('DONE replaying dead letter docs! Sayonara!')
+        sys.exit(0)
+
     # Calculate directory change percent from index2 to index if cli argument
     if cliargs['hotdirs']:
         wait_for_worker_bots(logger)
+        set_crawl_context(cliargs)
         hotdirs()
+        delete_crawl_context(cliargs)
         logger.info('DONE finding hotdirs! Sayonara!')
         sys.exit(0)
 
@@ -2251,14 +3183,45 @@ if __name__ == "__main__":
     if cliargs['indexemptydirs']:
         logger.warning('You are indexing empty directories (-e)')
 
+    # check index2 exists for incremental crawl
+    if cliargs['incremental'] and not es.indices.exists(index=cliargs['incremental']):
+        logger.error("Index2 %s for --incremental not found, exiting" % cliargs['incremental'])
+        sys.exit(1)
+
     # check if we are reindexing and remove existing docs in Elasticsearch
     # before crawling and reindexing
-    reindex_dict = {'file': [], 'directory': []}
+    reindex_dict = TagIndex()
     if cliargs['reindex']:
         reindex_dict = index_delete_path(rootdir_path, cliargs, logger, reindex_dict)
     elif cliargs['reindexrecurs']:
         reindex_dict = index_delete_path(rootdir_path, cliargs, logger, reindex_dict, recursive=True)
 
+    # finish cliargs bots use before publishing the crawl context, bots cache it
+    if cliargs['reindex']:
+        cliargs['maxdepth'] = 1
+    if cliargs['adaptivebatch']:
+        cliargs['batchsize'] = ab_start
+
+    # set up crawl journal, a resumed crawl keeps the crawl id it's journal was started with
+    if cliargs['journal'] or cliargs['resume']:
+        from diskover_journal import CrawlJournal
+        crawl_journal = CrawlJournal(redis_conn, cliargs['index'])
+        if cliargs['resume'] and crawl_journal.exists():
+            # journals started before crawl ids were saved used a fixed one
+            cliargs['crawlid'] = crawl_journal.meta().get('crawlid') or \
+                new_crawl_id(cliargs['index'], name='journal')
+
+    set_crawl_context(cliargs, reindex_dict)
+
+    if crawl_journal:
+        if cliargs['resume']:
+            if not es.indices.exists(index=cliargs['index']):
+                logger.error("Index %s not found, can't resume, exiting" % cliargs['index'])
+                sys.exit(1)
+            resume_crawl(rootdir_path, cliargs, logger)
+        else:
+            crawl_journal.start(rootdir_path, cliargs['crawlid'])
+
     pre_crawl_tasks()
 
     # start crawling
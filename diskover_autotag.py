@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Auto-tagging (-A) rules.
+The [autotag] config pattern dicts are compiled once into rules,
+each pattern list becomes one alternation regex and file rules
+reject on extension before checking names, paths and times.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from diskover_patterns import wildcard_regex
+import re
+import time
+
+TIME_KEYS = ('mtime', 'atime', 'ctime')
+
+
+def combine_wildcards(patterns):
+    """Return one regex matching any of the wildcard patterns,
+    or None if there are no patterns."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(wildcard_regex(p) for p in patterns))
+
+
+class AutoTagRule(object):
+    """Compiled [autotag] pattern dict."""
+
+    def __init__(self, pattern, tagtype='file'):
+        self.tag = pattern['tag']
+        self.tag_custom = pattern['tag_custom']
+        if tagtype == 'file':
+            # exact extensions don't need the regex
+            self.exts = frozenset(pattern.get('ext', []))
+            self.ext = combine_wildcards(pattern.get('ext'))
+        else:
+            self.exts = frozenset()
+            self.ext = None
+        self.name = combine_wildcards(pattern.get('name'))
+        self.name_exclude = combine_wildcards(pattern.get('name_exclude'))
+        self.path = combine_wildcards(pattern.get('path'))
+        self.path_exclude = combine_wildcards(pattern.get('path_exclude'))
+        # (index in times, min age in seconds) for times set in days
+        self.times = [(i, pattern[key] * 86400) for i, key in enumerate(TIME_KEYS)
+                      if pattern.get(key, 0) > 0]
+
+    def excluded(self, metadict):
+        """Return True if doc metadict matches the rule's name or
+        path excludes."""
+        if self.name_exclude is not None and self.name_exclude.search(metadict['filename']):
+            return True
+        if self.path_exclude is not None and self.path_exclude.search(metadict['path_parent']):
+            return True
+        return False
+
+    def match(self, metadict, times, now):
+        """Return True if doc metadict and times (mtime, atime, ctime)
+        match the rule, excludes aside."""
+        if self.ext is not None:
+            ext = metadict['extension']
+            if ext not in self.exts and not self.ext.search(ext):
+                return False
+        filename = metadict['filename']
+        if self.name is not None and not self.name.search(filename):
+            return False
+        path_parent = metadict['path_parent']
+        if self.path is not None and not self.path.search(path_parent):
+            return False
+        for i, age in self.times:
+            if times[i] and now - times[i] < age:
+                return False
+        return True
+
+
+class AutoTagger(object):
+    """Auto-tagger for file or directory docs, the first matching
+    rule tags the doc. A doc matching a rule's excludes is not
+    tagged by that rule or any after it."""
+
+    def __init__(self, patterns, tagtype='file'):
+        self.rules = [AutoTagRule(p, tagtype) for p in patterns]
+
+    def __len__(self):
+        return len(self.rules)
+
+    def tag(self, metadict, mtime, atime, ctime):
+        """Tag doc metadict and return it."""
+        times = (mtime, atime, ctime)
+        now = time.time()
+        for rule in self.rules:
+            if rule.excluded(metadict):
+                break
+            if rule.match(metadict, times, now):
+                metadict['tag'] = rule.tag
+                metadict['tag_custom'] = rule.tag_custom
+                break
+        return metadict
@@ -11,10 +11,18 @@ diskover is released under the Apache 2.0 license. See
 LICENSE for the full license text.
 """
 
-from diskover import config, escape_chars, index_bulk_add, plugins, IS_PY3, split_list, q_crawl
+from diskover import config, index_bulk_add, bulk_stats, path_doc_id, plugins, IS_PY3, split_list, q_crawl, \
+    exclude_matcher, jobdone_channel, bulkpending_key, dead_letters
+from diskover_context import get_context
+from diskover_namecache import NameCache
+from diskover_autotag import AutoTagger
+from diskover_stat import StatPool
+from diskover_query import path_depth, PathQuery
+from diskover_bulk import BulkBuffer
 from datetime import datetime
 from scandir import scandir
 from rq import SimpleWorker
+from rq.worker import WorkerStatus
 import argparse
 import os
 import hashlib
@@ -22,8 +30,8 @@ import socket
 import pwd
 import grp
 import time
-import re
 import warnings
+import logging
 
 import diskover_connections
 
@@ -35,12 +43,8 @@ from diskover_connections import es_conn as es
 diskover_connections.connect_to_redis()
 from diskover_connections import redis_conn
 
-
-# cache uid/gid names
-uids = []
-gids = []
-owners = {}
-groups = {}
+# bulk add and scroll errors, logged by the worker bot
+logger = logging.getLogger('diskover')
 
 
 def parse_cliargs_bot():
@@ -58,236 +62,108 @@ def parse_cliargs_bot():
     return args
 
 
+class DiskoverWorker(SimpleWorker):
+    """diskover rq worker bot.
+    Publishes to jobdone_channel when a job leaves it's queue
+    empty so the dispatcher knows bots are done without polling.
+    Buffered docs are sent before waiting on empty queues.
+    """
+
+    def execute_job(self, job, queue):
+        super(DiskoverWorker, self).execute_job(job, queue)
+        if queue.count == 0:
+            # set idle now instead of on next dequeue so the
+            # dispatcher doesn't see this bot as busy, buffered
+            # docs keep the bot's bulk pending key set until sent
+            self.set_state(WorkerStatus.IDLE)
+            self.connection.publish(jobdone_channel, queue.name)
+            if plugins:
+                self.log.debug('Plugin stats: %s', plugins.stats_summary())
+
+    def dequeue_job_and_maintain_ttl(self, timeout):
+        if bulk_buffer and not any(queue.count for queue in self.queues):
+            # no more jobs, send buffered docs before blocking
+            bulk_buffer.flush()
+        return super(DiskoverWorker, self).dequeue_job_and_maintain_ttl(timeout)
+
+
 def get_worker_name():
     """This is the get worker name function.
     It returns worker name hostname.pid .
     """
     return '{0}.{1}'.format(socket.gethostname().partition('.')[0], os.getpid())
+
+
+def job_context(cliargs, reindex_dict=None):
+    """This is the job context function.
+    It returns cliargs and reindex_dict for a job. Jobs from the
+    dispatcher carry a crawl id in place of cliargs and the crawl
+    context is fetched from Redis (and cached).
+    """
+    if isinstance(cliargs, dict):
+        return cliargs, reindex_dict
+    return get_context(redis_conn, cliargs)
         
 
+# lstat pool for file meta
+stat_pool = StatPool(config['bots_statthreads'], backend=config['bots_statbackend'])
+
+# auto tag rules compiled from config
+file_autotagger = AutoTagger(config['autotag_files'], 'file')
+dir_autotagger = AutoTagger(config['autotag_dirs'], 'directory')
+
+
 def auto_tag(metadict, tagtype, mtime, atime, ctime):
     """This is the auto tag function.
-    It checks diskover config for any auto tag patterns
+    It checks the compiled auto tag rules from diskover config
     and updates the meta dict for file or directory
     to include the new tags.
     """
-    extpass = True
-    namepass = True
-    pathpass = True
-    timepass = True
-
     if tagtype == 'file':
-        for pattern in config['autotag_files']:
-            try:
-                for name in pattern['name_exclude']:
-                    if name == metadict['filename']:
-                        return metadict
-
-                    if name.startswith('*') and name.endswith('*'):
-                        name = name.replace('*', '')
-                    elif name.startswith('*'):
-                        name = name + '$'
-                    elif name.endswith('*'):
-                        name = '^' + name
-
-                    if re.search(name, metadict['filename']):
-                        return metadict
-            except KeyError:
-                pass
-
-            try:
-                for path in pattern['path_exclude']:
-                    if path == metadict['path_parent']:
-                        return metadict
-
-                    if path.startswith('*') and path.endswith('*'):
-                        path = path.replace('*', '')
-                    elif path.startswith('*'):
-                        path = path + '$'
-                    elif path.endswith('*'):
-                        path = '^' + path
-
-                    if re.search(path, metadict['path_parent']):
-                        return metadict
-            except KeyError:
-                pass
-
-            try:
-                for ext in pattern['ext']:
-                    if ext == metadict['extension']:
-                        extpass = True
-                        break
-
-                    if ext.startswith('*') and ext.endswith('*'):
-                        ext = ext.replace('*', '')
-                    elif ext.startswith('*'):
-                        ext = ext + '$'
-                    elif ext.endswith('*'):
-                        ext = '^' + ext
-
-                    if re.search(ext, metadict['extension']):
-                        extpass = True
-                        break
-                    else:
-                        extpass = False
-            except KeyError:
-                pass
-
-            try:
-                for name in pattern['name']:
-                    if name == metadict['filename']:
-                        namepass = True
-                        break
-
-                    if name.startswith('*') and name.endswith('*'):
-                        name = name.replace('*', '')
-                    elif name.startswith('*'):
-                        name = name + '$'
-                    elif name.endswith('*'):
-                        name = '^' + name
-
-                    if re.search(name, metadict['filename']):
-                        namepass = True
-                        break
-                    else:
-                        namepass = False
-            except KeyError:
-                pass
+        return file_autotagger.tag(metadict, mtime, atime, ctime)
+    elif tagtype == 'directory':
+        return dir_autotagger.tag(metadict, mtime, atime, ctime)
+    return metadict
 
-            try:
-                for path in pattern['path']:
-                    if path == metadict['path_parent']:
-                        pathpass = True
-                        break
-
-                    if path.startswith('*') and path.endswith('*'):
-                        path = path.replace('*', '')
-                    elif path.startswith('*'):
-                        path = path + '$'
-                    elif path.endswith('*'):
-                        path = '^' + path
-
-                    if re.search(path, metadict['path_parent']):
-                        pathpass = True
-                        break
-                    else:
-                        pathpass = False
-            except KeyError:
-                pass
 
-            timepass = time_check(pattern, mtime, atime, ctime)
-            if extpass and namepass and pathpass and timepass:
-                metadict['tag'] = pattern['tag']
-                metadict['tag_custom'] = pattern['tag_custom']
-                return metadict
+def owner_group_name(name):
+    """This is the owner group name function.
+    It removes the domain from owner or group name if set in config.
+    """
+    if config['ownersgroups_domain'] == "true" and config['ownersgroups_keepdomain'] != "true":
+        # names without the domain separator are kept as they are
+        parts = name.split(config['ownersgroups_domainsep'])
+        if len(parts) > 1:
+            if config['ownersgroups_domainfirst'] == "true":
+                name = parts[1]
+            else:
+                name = parts[0]
+    return name
 
-    elif tagtype == 'directory':
-        for pattern in config['autotag_dirs']:
-            try:
-                for name in pattern['name_exclude']:
-                    if name == metadict['filename']:
-                        return metadict
-
-                    if name.startswith('*') and name.endswith('*'):
-                        name = name.replace('*', '')
-                    elif name.startswith('*'):
-                        name = name + '$'
-                    elif name.endswith('*'):
-                        name = '^' + name
-
-                    if re.search(name, metadict['filename']):
-                        return metadict
-            except KeyError:
-                pass
 
-            try:
-                for path in pattern['path_exclude']:
-                    if path == metadict['path_parent']:
-                        return metadict
-
-                    if path.startswith('*') and path.endswith('*'):
-                        path = path.replace('*', '')
-                    elif path.startswith('*'):
-                        path = path + '$'
-                    elif path.endswith('*'):
-                        path = '^' + path
-                    
-                    if re.search(path, metadict['path_parent']):
-                        return metadict
-            except KeyError:
-                pass
+def get_owner_name(uid):
+    return owner_group_name(pwd.getpwuid(uid).pw_name)
 
-            try:
-                for name in pattern['name']:
-                    if name == metadict['filename']:
-                        namepass = True
-                        break
-
-                    if name.startswith('*') and name.endswith('*'):
-                        name = name.replace('*', '')
-                    elif name.startswith('*'):
-                        name = name + '$'
-                    elif name.endswith('*'):
-                        name = '^' + name
-
-                    if re.search(name, metadict['filename']):
-                        namepass = True
-                        break
-                    else:
-                        namepass = False
-            except KeyError:
-                pass
 
-            try:
-                for path in pattern['path']:
-                    if path == metadict['path_parent']:
-                        pathpass = True
-                        break
-
-                    if path.startswith('*') and path.endswith('*'):
-                        path = path.replace('*', '')
-                    elif path.startswith('*'):
-                        path = path + '$'
-                    elif path.endswith('*'):
-                        path = '^' + path
-
-                    if re.search(path, metadict['path_parent']):
-                        pathpass = True
-                        break
-                    else:
-                        pathpass = False
-            except KeyError:
-                pass
+def get_group_name(gid):
+    return owner_group_name(grp.getgrgid(gid).gr_name)
 
-            timepass = time_check(pattern, mtime, atime, ctime)
-            if extpass and namepass and pathpass and timepass:
-                metadict['tag'] = pattern['tag']
-                metadict['tag_custom'] = pattern['tag_custom']
-                return metadict
 
-    return metadict
+# cache uid/gid names, shared with other bots in redis
+owners = NameCache(get_owner_name, redis_conn=redis_conn if config['ownersgroups_cachettl'] else None,
+                   prefix='diskover:owner:', ttl=config['ownersgroups_cachettl'])
+groups = NameCache(get_group_name, redis_conn=redis_conn if config['ownersgroups_cachettl'] else None,
+                   prefix='diskover:group:', ttl=config['ownersgroups_cachettl'])
 
 
-def time_check(pattern, mtime, atime, ctime):
-    """This is the time check function.
-    It is used by the auto_tag functions.
+def preload_owner_group_names():
+    """This is the preload owner group names function.
+    It enumerates all users and groups (getpwall/getgrall) into the
+    uid/gid name caches. Returns number of users and groups.
     """
-    timepass = True
-
-    d = {'mtime': mtime, 'atime': atime, 'ctime': ctime}
-    for key, value in d.items():
-        try:
-            if pattern[key] > 0 and value:
-                # Convert time in days to seconds
-                time_sec = pattern[key] * 86400
-                file_time_sec = time.time() - value
-                if file_time_sec < time_sec:
-                    timepass = False
-                    break
-        except KeyError:
-            pass
-
-    return timepass
+    owners.preload((p.pw_uid, owner_group_name(p.pw_name)) for p in pwd.getpwall())
+    groups.preload((g.gr_gid, owner_group_name(g.gr_name)) for g in grp.getgrall())
+    return len(owners), len(groups)
 
 
 def get_owner_group_names(uid, gid, cliargs):
@@ -296,70 +172,10 @@ def get_owner_group_names(uid, gid, cliargs):
     with uid/gid -> name cacheing.
     Returns owner and group.
     """
-
-    # try to get owner user name
-    # first check cache
-    if uid in uids:
-        owner = owners[uid]
-    # not in cache
-    else:
-        # check if we should just get uid or try to get owner name
-        if config['ownersgroups_uidgidonly'] == "true" or cliargs['crawlapi']:
-            owner = uid
-        else:
-            try:
-                # check if domain in name
-                if config['ownersgroups_domain'] == "true":
-                    # check if we should remove the domain from owner
-                    if config['ownersgroups_keepdomain'] == "true":
-                        owner = pwd.getpwuid(uid).pw_name
-                    else:
-                        if config['ownersgroups_domainfirst'] == "true":
-                            owner = pwd.getpwuid(uid).pw_name.split(config['ownersgroups_domainsep'])[1]
-                        else:
-                            owner = pwd.getpwuid(uid).pw_name.split(config['ownersgroups_domainsep'])[0]
-                else:
-                    owner = pwd.getpwuid(uid).pw_name
-            # if we can't find the owner's user name, use the uid number
-            except KeyError:
-                owner = uid
-        # store it in cache
-        if not uid in uids:
-            uids.append(uid)
-            owners[uid] = owner
-
-    # try to get group name
-    # first check cache
-    if gid in gids:
-        group = groups[gid]
-    # not in cache
-    else:
-        # check if we should just get gid or try to get group name
-        if config['ownersgroups_uidgidonly'] == "true" or cliargs['crawlapi']:
-            group = gid
-        else:
-            try:
-                # check if domain in name
-                if config['ownersgroups_domain'] == "true":
-                    # check if we should remove the domain from group
-                    if config['ownersgroups_keepdomain'] == "true":
-                        group = grp.getgrgid(gid).gr_name
-                    else:
-                        if config['ownersgroups_domainfirst'] == "true":
-                            group = grp.getgrgid(gid).gr_name.split(config['ownersgroups_domainsep'])[1]
-                        else:
-                            group = grp.getgrgid(gid).gr_name.split(config['ownersgroups_domainsep'])[0]
-                else:
-                    group = grp.getgrgid(gid).gr_name
-            # if we can't find the group's name, use the gid number
-            except KeyError:
-                group = gid
-        # store in cache
-        if not gid in gids:
-            gids.append(gid)
-            groups[gid] = group
-
-    return owner, group
+    # check if we should just get uid/gid or try to get owner/group names
+    if config['ownersgroups_uidgidonly'] == "true" or cliargs['crawlapi']:
+        return uid, gid
+    return owners.get(uid), groups.get(gid)
 
 
 def get_dir_meta(worker_name, path, cliargs, reindex_dict, statsembeded=False):
@@ -418,29 +234,28 @@ def get_dir_meta(worker_name, path, cliargs, reindex_dict, statsembeded=False):
             "change_percent_items_subdirs": "",
             "worker_name": worker_name,
             "indexing_date": indextime_utc,
+            "depth": path_depth(parentdir) + 1 if filename else 0,
             "_type": "directory"
         }
 
+        if cliargs['pathids']:
+            dirmeta_dict['_id'] = path_doc_id('directory', dirpath)
+
         # check plugins for adding extra meta data to dirmeta_dict
-        for plugin in plugins:
-            try:
-                # check if plugin is for directory doc
-                mappings = {'mappings': {'directory': {'properties': {}}}}
-                plugin.add_mappings(mappings)
-                dirmeta_dict.update(plugin.add_meta(dirpath))
-            except KeyError:
-                pass
+        if plugins.for_type('directory'):
+            meta = plugins.add_meta('directory', [dirpath])[0]
+            if meta:
+                dirmeta_dict.update(meta)
 
         # add any autotags to dirmeta_dict
-        if cliargs['autotag'] and len(config['autotag_dirs']) > 0:
+        if cliargs['autotag'] and dir_autotagger:
             dirmeta_dict = auto_tag(dirmeta_dict, 'directory', mtime, atime, ctime)
 
-        # search for and copy over any existing tags from reindex_dict
-        for sublist in reindex_dict['directory']:
-            if sublist[0] == dirpath:
-                dirmeta_dict['tag'] = sublist[1]
-                dirmeta_dict['tag_custom'] = sublist[2]
-                break
+        # copy over any existing tags from reindex_dict
+        if reindex_dict:
+            tags = reindex_dict.get('directory', dirpath)
+            if tags:
+                dirmeta_dict['tag'], dirmeta_dict['tag_custom'] = tags
 
     except (OSError, IOError) as e:
         warnings.warn("OS/IO Exception caused by: %s" % e)
@@ -452,131 +267,163 @@ def get_dir_meta(worker_name, path, cliargs, reindex_dict, statsembeded=False):
     return dirmeta_dict
 
 
-def get_file_meta(worker_name, path, cliargs, reindex_dict, statsembeded=False):
-    """This is the get file meta data function.
-    It scrapes file meta and ignores files smaller
-    than minsize Bytes, newer than mtime
-    and in excluded_files. Returns file meta dict.
+def get_files_meta(worker_name, root_path, files, cliargs, reindex_dict, statsembeded=False):
+    """This is the get files meta data function.
+    It scrapes file meta for files in directory root_path and
+    ignores files smaller than minsize Bytes, newer than mtime
+    and in excluded_files. files are file names, or (path, stats)
+    tuples if statsembeded. Fields which are the same for all the
+    files are only computed once. Returns list of file meta dicts.
     """
+    fmetas = []
 
-    try:
-        # check if stats embeded in path
-        if statsembeded:
-            metadata = path[1]
-            fullpath = path[0]
-        else:
-            fullpath = path
+    if statsembeded:
+        paths = [f[0] for f in files]
+    else:
+        paths = [os.path.join(root_path, f) for f in files]
+
+    # get tags of all files in one lookup
+    if reindex_dict:
+        reindex_dict.prefetch('file', paths)
+
+    # Convert time in days (mtime cli arg) to seconds
+    time_sec = cliargs['mtime'] * 86400
+    now = time.time()
+
+    # get time
+    indextime_utc = datetime.utcnow().isoformat()
+
+    # get absolute path of parent directory
+    parentdir = os.path.abspath(root_path)
+
+    autotag = cliargs['autotag'] and file_autotagger
+    # paths and times of docs for plugins and auto tags
+    docpaths = []
+    doctimes = []
+
+    # times converted to utc for es, files in a directory often share them
+    utc_times = {}
+
+    # file metadata dictionary template
+    template = {
+        "path_parent": parentdir,
+        "tag": "",
+        "tag_custom": "",
+        "dupe_md5": "",
+        "worker_name": worker_name,
+        "indexing_date": indextime_utc,
+        "depth": path_depth(parentdir) + 1,
+        "_type": "file"
+    }
 
+    # check if files are in exluded_files list
+    included = []
+    for i, fullpath in enumerate(paths):
         filename = os.path.basename(fullpath)
+        if not file_excluded(filename):
+            included.append((i, fullpath, filename))
 
-        # check if file is in exluded_files list
-        if file_excluded(filename):
-            return None
-        extension = os.path.splitext(filename)[1][1:].lower()
-
-        if statsembeded:
-            # get embeded stats from path
-            mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime, blocks = metadata
-        else:
-            # use lstat to get meta and not follow sym links
-            s = os.lstat(fullpath)
-            mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime = s
-            blocks = s.st_blocks
-        
-        # Are we storing file size or on disk size
-        if cliargs['sizeondisk']:
-            size = blocks * cliargs['blocksize']
-
-        # Skip files smaller than minsize cli flag
-        if size < cliargs['minsize']:
-            return None
-
-        # Convert time in days (mtime cli arg) to seconds
-        time_sec = cliargs['mtime'] * 86400
-        file_mtime_sec = time.time() - mtime
-        
-        if time_sec < 0:
-            # Only process files modified less than x days ago
-            if file_mtime_sec > (time_sec * -1):
-                return None
-        else:
-            # Only process files modified at least x days ago
-            if file_mtime_sec < time_sec:
-                return None
-
-        # convert times to utc for es
-        mtime_utc = datetime.utcfromtimestamp(mtime).isoformat()
-        atime_utc = datetime.utcfromtimestamp(atime).isoformat()
-        ctime_utc = datetime.utcfromtimestamp(ctime).isoformat()
-
-        # get owner and group names
-        owner, group = get_owner_group_names(uid, gid, cliargs)
-
-        # create md5 hash of file using metadata filesize and mtime
-        # or just filesize if cli arg set
-        if cliargs['filehashsizeonly']:
-            filestring = str(size)
-        else:
-            filestring = str(size) + str(mtime)
-        filehash = hashlib.md5(filestring.encode('utf-8')).hexdigest()
-
-        # get time
-        indextime_utc = datetime.utcnow().isoformat()
-
-        # get absolute path of parent directory
-        parentdir = os.path.abspath(os.path.join(fullpath, os.pardir))
+    if not statsembeded:
+        # use lstat to get meta and not follow sym links,
+        # stat pool lstats files concurrently if bot has stat threads
+        stats = stat_pool.lstat_many([f[1] for f in included], blocks=cliargs['sizeondisk'])
 
-        # create file metadata dictionary
-        filemeta_dict = {
-            "filename": filename,
-            "extension": extension,
-            "path_parent": parentdir,
-            "filesize": size,
-            "owner": owner,
-            "group": group,
-            "last_modified": mtime_utc,
-            "last_access": atime_utc,
-            "last_change": ctime_utc,
-            "hardlinks": nlink,
-            "inode": str(ino),
-            "filehash": filehash,
-            "tag": "",
-            "tag_custom": "",
-            "dupe_md5": "",
-            "worker_name": worker_name,
-            "indexing_date": indextime_utc,
-            "_type": "file"
-        }
+    for n, (i, fullpath, filename) in enumerate(included):
+        try:
+            extension = os.path.splitext(filename)[1][1:].lower()
 
-        # check plugins for adding extra meta data to filemeta_dict
-        for plugin in plugins:
-            try:
-                # check if plugin is for file doc
-                mappings = {'mappings': {'file': {'properties': {}}}}
-                plugin.add_mappings(mappings)
-                filemeta_dict.update(plugin.add_meta(fullpath))
-            except KeyError:
-                pass
+            if statsembeded:
+                # get embeded stats from path
+                mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime, blocks = files[i][1]
+            else:
+                s = stats[n]
+                if isinstance(s, Exception):
+                    raise s
+                mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime = s
+                blocks = s.st_blocks
+
+            # Are we storing file size or on disk size
+            if cliargs['sizeondisk']:
+                size = blocks * cliargs['blocksize']
+
+            # Skip files smaller than minsize cli flag
+            if size < cliargs['minsize']:
+                continue
+
+            file_mtime_sec = now - mtime
+            if time_sec < 0:
+                # Only process files modified less than x days ago
+                if file_mtime_sec > (time_sec * -1):
+                    continue
+            else:
+                # Only process files modified at least x days ago
+                if file_mtime_sec < time_sec:
+                    continue
 
-        # add any autotags to filemeta_dict
-        if cliargs['autotag'] and len(config['autotag_files']) > 0:
-            filemeta_dict = auto_tag(filemeta_dict, 'file', mtime, atime, ctime)
+            # convert times to utc for es
+            for t in (mtime, atime, ctime):
+                if t not in utc_times:
+                    utc_times[t] = datetime.utcfromtimestamp(t).isoformat()
 
-        # search for and copy over any existing tags from reindex_dict
-        for sublist in reindex_dict['file']:
-            if sublist[0] == fullpath:
-                filemeta_dict['tag'] = sublist[1]
-                filemeta_dict['tag_custom'] = sublist[2]
-                break
+            # get owner and group names
+            owner, group = get_owner_group_names(uid, gid, cliargs)
 
-    except (OSError, IOError) as e:
-        warnings.warn("OS/IO Exception caused by: %s" % e)
-        return False
-    except Exception as e:
-        warnings.warn("Exception caused by: %s" % e)
-        return False
+            # create md5 hash of file using metadata filesize and mtime
+            # or just filesize if cli arg set
+            if cliargs['filehashsizeonly']:
+                filestring = str(size)
+            else:
+                filestring = str(size) + str(mtime)
+            filehash = hashlib.md5(filestring.encode('utf-8')).hexdigest()
+
+            # create file metadata dictionary
+            filemeta_dict = template.copy()
+            filemeta_dict["filename"] = filename
+            filemeta_dict["extension"] = extension
+            filemeta_dict["filesize"] = size
+            filemeta_dict["owner"] = owner
+            filemeta_dict["group"] = group
+            filemeta_dict["last_modified"] = utc_times[mtime]
+            filemeta_dict["last_access"] = utc_times[atime]
+            filemeta_dict["last_change"] = utc_times[ctime]
+            filemeta_dict["hardlinks"] = nlink
+            filemeta_dict["inode"] = str(ino)
+            filemeta_dict["filehash"] = filehash
+            if cliargs['pathids']:
+                filemeta_dict["_id"] = path_doc_id('file', fullpath)
+
+        except (OSError, IOError) as e:
+            warnings.warn("OS/IO Exception caused by: %s" % e)
+            continue
+        except Exception as e:
+            warnings.warn("Exception caused by: %s" % e)
+            continue
+
+        fmetas.append(filemeta_dict)
+        docpaths.append(fullpath)
+        doctimes.append((mtime, atime, ctime))
+
+    # add extra meta data from plugins to file docs, for all docs at a time
+    if plugins.for_type('file'):
+        metas = plugins.add_meta('file', docpaths)
+        for i, meta in enumerate(metas):
+            if meta:
+                fmetas[i].update(meta)
+
+    if autotag or reindex_dict:
+        for i, filemeta_dict in enumerate(fmetas):
+            # add any autotags to filemeta_dict
+            if autotag:
+                mtime, atime, ctime = doctimes[i]
+                auto_tag(filemeta_dict, 'file', mtime, atime, ctime)
+
+            # copy over any existing tags from reindex_dict
+            if reindex_dict:
+                tags = reindex_dict.get('file', docpaths[i])
+                if tags:
+                    filemeta_dict['tag'], filemeta_dict['tag_custom'] = tags
 
-    return filemeta_dict
+    return fmetas
 
 
 def calc_dir_size(dirlist, cliargs):
@@ -586,7 +433,9 @@ def calc_dir_size(dirlist, cliargs):
     to create a total filesize and item count for each dir, 
     then updates dir doc's filesize and items fields.
     """
+    cliargs, reindex_dict = job_context(cliargs)
     doclist = []
+    pathquery = PathQuery(cliargs['pathtree'])
 
     for path in dirlist:
         totalsize = 0
@@ -594,71 +443,28 @@ def calc_dir_size(dirlist, cliargs):
         totalitems_files = 0
         totalitems_subdirs = 0
         # file doc search with aggregate for sum filesizes
-        # escape special characters
-        newpath = escape_chars(path[1])
-        # create wildcard string and check for / (root) path
-        if newpath == '\/':
-            newpathwildcard = '\/*'
-        else:
-            newpathwildcard = newpath + '\/*'
-
-        # check if / (root) path
-        if newpath == '\/':
-            data = {
-                "size": 0,
-                "query": {
-                    "query_string": {
-                        "query": "path_parent: " + newpath + "*",
-                        "analyze_wildcard": "true"
+        data = {
+            "size": 0,
+            "query": pathquery.subtree(path[1]),
+            "aggs": {
+                "filesizes": {
+                    "filter": { "term": { "_type": "file" } },
+                    "aggs": {
+                        "total_size": { "sum": { "field": "filesize" } }
                     }
                 },
-                "aggs": {
-                    "filesizes": {
-                        "filter": { "term": { "_type": "file" } },
-                        "aggs": {
-                            "total_size": { "sum": { "field": "filesize" } }
-                        }
-                    },
-                    "total_file_count": {
-                        "filter": {
-                            "term": { "_type": "file" }
-                        }
-                    },
-                    "total_dir_count": {
-                        "filter": {
-                            "term": { "_type": "directory" }
-                        }
-                    }
-                }
-            }
-        else:
-            data = {
-                "size": 0,
-                "query": {
-                    "query_string": {
-                        'query': 'path_parent: ' + newpath + ' OR path_parent: ' + newpathwildcard,
-                        'analyze_wildcard': 'true'
+                "total_file_count": {
+                    "filter": {
+                        "term": { "_type": "file" }
                     }
                 },
-                "aggs": {
-                    "filesizes": {
-                        "filter": { "term": { "_type": "file" } },
-                        "aggs": {
-                            "total_size": { "sum": { "field": "filesize" } }
-                        }
-                    },
-                    "total_file_count": {
-                        "filter": {
-                            "term": { "_type": "file" }
-                        }
-                    },
-                    "total_dir_count": {
-                        "filter": {
-                            "term": { "_type": "directory" }
-                        }
+                "total_dir_count": {
+                    "filter": {
+                        "term": { "_type": "directory" }
                     }
                 }
             }
+        }
 
         # search ES and start scroll
         res = es.search(index=cliargs['index'], body=data, doc_type='file,directory', request_timeout=config['es_timeout'])
@@ -690,37 +496,151 @@ def calc_dir_size(dirlist, cliargs):
     index_bulk_add(es, doclist, config, cliargs)
 
 
+def copy_file_docs(worker_name, path, cliargs):
+    """This is the copy file docs function.
+    It gets the file docs directly in directory path from
+    index2 (--incremental) and yields them as file meta dicts
+    for index, a scroll page at a time.
+    """
+    data = {
+        "query": {
+            "term": {"path_parent": path}
+        }
+    }
+
+    res = es.search(index=cliargs['incremental'], doc_type='file', scroll='1m',
+                    size=config['es_scrollsize'], body=data, request_timeout=config['es_timeout'])
+    scroll_id = res.get('_scroll_id')
+
+    # get time now in utc
+    indextime_utc = datetime.utcnow().isoformat()
+
+    try:
+        while res['hits']['hits'] and len(res['hits']['hits']) > 0:
+            for hit in res['hits']['hits']:
+                filemeta_dict = hit['_source']
+                filemeta_dict['worker_name'] = worker_name
+                filemeta_dict['indexing_date'] = indextime_utc
+                filemeta_dict['_type'] = 'file'
+                filemeta_dict['depth'] = path_depth(filemeta_dict['path_parent']) + 1
+                if cliargs['pathids']:
+                    filemeta_dict['_id'] = path_doc_id('file', os.path.join(filemeta_dict['path_parent'],
+                                                                            filemeta_dict['filename']))
+                yield filemeta_dict
+            # last page
+            if len(res['hits']['hits']) < config['es_scrollsize']:
+                break
+            # use es scroll api
+            res = es.scroll(scroll_id=scroll_id, scroll='1m',
+                            request_timeout=config['es_timeout'])
+            scroll_id = res.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id:
+            try:
+                es.clear_scroll(scroll_id=scroll_id)
+            except Exception as e:
+                logger.warning("Clearing scroll of %s docs in %s failed: %s" % (cliargs['incremental'], path, e))
+
+
+def send_bulk_batch(batch):
+    """This is the send bulk batch function.
+    It bulk adds a batch of buffered docs and the worker doc for it.
+    """
+    starttime = time.time()
+    index_bulk_add(es, batch.docs, config, batch.cliargs, sizes=batch.sizes)
+    if not batch.cliargs['noworkerdocs']:
+        data = {"worker_name": worker, "dir_count": batch.dir_count,
+                "file_count": batch.file_count, "bulk_time": round(time.time() - starttime, 6),
+                "crawl_time": round(batch.crawl_time, 6),
+                "indexing_date": datetime.utcnow().isoformat()}
+        data.update(bulk_stats())
+        es.index(index=batch.cliargs['index'], doc_type='worker', body=data)
+
+
+def bulk_batch_failed(batch, e):
+    """This is the bulk batch failed function.
+    It warns about a batch of buffered docs which failed to bulk add
+    and keeps the docs in the dead letter store if there is one.
+    """
+    logger.error("Bulk add of %s buffered docs to %s failed: %s" % (len(batch.docs), batch.cliargs['index'], e))
+    if dead_letters:
+        dead_letters.add(batch.cliargs['index'], [(doc, 'N/A', str(e)) for doc in batch.docs])
+
+
+def bulk_pending(pending):
+    """This is the bulk pending function.
+    It keeps the bot in the bulk pending sorted set, scored with the
+    Redis server time, while it has buffered docs not in es yet so
+    the dispatcher waits for them, and removes it once they are
+    sent. The dispatcher drops the bot if it stops refreshing it.
+    """
+    if pending:
+        redis_conn.zadd(bulkpending_key, {worker: redis_conn.time()[0]})
+    else:
+        redis_conn.zrem(bulkpending_key, worker)
+        redis_conn.publish(jobdone_channel, worker)
+
+
+# docs buffered across jobs and bulk added in a flusher thread
+if config['bots_bulkbuffer'] == "true":
+    bulk_buffer = BulkBuffer(send_bulk_batch, maxdocs=config['bots_bulkdocs'] or config['es_chunksize'],
+                             maxbytes=config['bots_bulkbytes'], maxage=config['bots_bulkage'],
+                             on_error=bulk_batch_failed, signal=bulk_pending)
+else:
+    bulk_buffer = None
+
+
 def es_bulk_add(worker_name, dirlist, filelist, cliargs, totalcrawltime=None):
     if cliargs['chunkfiles']:
+        if bulk_buffer and any('chunkpath' in d for d in dirlist):
+            # chunked dir's doc may still be buffered
+            bulk_buffer.flush()
         updated_dirlist = []
+        chunkdocs = {}
+        if cliargs['pathids']:
+            # get chunked dirs docs by id in one request, mget is realtime so no refresh
+            chunkpaths = [d['chunkpath'] for d in dirlist if 'chunkpath' in d]
+            if chunkpaths:
+                res = es.mget(index=cliargs['index'], doc_type='directory',
+                              body={'ids': [path_doc_id('directory', p) for p in chunkpaths]},
+                              _source_include=['crawl_time'], request_timeout=config['es_timeout'])
+                for path, doc in zip(chunkpaths, res['docs']):
+                    if doc.get('found'):
+                        chunkdocs[path] = (doc['_id'], doc['_source']['crawl_time'])
         # check for existing directory docs in index and update crawl time only (dirchunk)
         for d in dirlist:
             try:
                 path = d['chunkpath']  # this key determins if its part of a chunked dir
                 crawltime = d['crawl_time']
-                f = os.path.basename(path)
-                # parent path
-                p = os.path.abspath(os.path.join(path, os.pardir))
-
-                data = {
-                    "size": 1,
-                    "_source": ['crawl_time'],
-                    "query": {
-                        "query_string": {
-                            "query": "filename: \"" + f + "\" AND path_parent: \"" + p + "\""
+
+                if cliargs['pathids']:
+                    if path not in chunkdocs:
+                        continue
+                    docid, current_crawltime = chunkdocs[path]
+                else:
+                    f = os.path.basename(path)
+                    # parent path
+                    p = os.path.abspath(os.path.join(path, os.pardir))
+
+                    data = {
+                        "size": 1,
+                        "_source": ['crawl_time'],
+                        "query": {
+                            "query_string": {
+                                "query": "filename: \"" + f + "\" AND path_parent: \"" + p + "\""
+                            }
                         }
                     }
-                }
 
-                es.indices.refresh(index=cliargs['index'])
-                res = es.search(index=cliargs['index'], doc_type='directory', body=data,
-                                request_timeout=config['es_timeout'])
+                    es.indices.refresh(index=cliargs['index'])
+                    res = es.search(index=cliargs['index'], doc_type='directory', body=data,
+                                    request_timeout=config['es_timeout'])
 
-                if len(res['hits']['hits']) == 0:
-                    continue
+                    if len(res['hits']['hits']) == 0:
+                        continue
 
-                docid = res['hits']['hits'][0]['_id']
-                current_crawltime = res['hits']['hits'][0]['_source']['crawl_time']
+                    docid = res['hits']['hits'][0]['_id']
+                    current_crawltime = res['hits']['hits'][0]['_source']['crawl_time']
                 udpated_crawltime = current_crawltime + crawltime
 
                 # update crawltime in index
@@ -738,6 +658,10 @@ def es_bulk_add(worker_name, dirlist, filelist, cliargs, totalcrawltime=None):
 
         dirlist = updated_dirlist
 
+    if bulk_buffer:
+        bulk_buffer.add(cliargs, dirlist, filelist, totalcrawltime)
+        return
+
     starttime = time.time()
 
     docs = dirlist + filelist
@@ -748,39 +672,46 @@ def es_bulk_add(worker_name, dirlist, filelist, cliargs, totalcrawltime=None):
                 "file_count": len(filelist), "bulk_time": round(time.time() - starttime, 6),
                 "crawl_time": round(totalcrawltime, 6),
                 "indexing_date": datetime.utcnow().isoformat()}
+        data.update(bulk_stats())
         es.index(index=cliargs['index'], doc_type='worker', body=data)
 
 
-def file_meta_collector(files, root_path, statsembeded, cliargs, reindex_dict):
-    fmetas = []
-    for file in files:
-        if statsembeded:
-            fmeta = get_file_meta(worker, file, cliargs, reindex_dict, statsembeded=True)
-            fmetas.append(fmeta)
-        else:
-            fmeta = get_file_meta(worker, os.path.join(root_path, file), cliargs,
-                                reindex_dict, statsembeded=False)
-            fmetas.append(fmeta)
-    return fmetas
+def file_meta_collector(files, root_path, statsembeded, cliargs, reindex_dict=None):
+    cliargs, reindex_dict = job_context(cliargs, reindex_dict)
+    return get_files_meta(worker, root_path, files, cliargs, reindex_dict, statsembeded=statsembeded)
 
 
-def scrape_tree_meta(paths, cliargs, reindex_dict):
+def scrape_tree_meta(paths, cliargs, reindex_dict=None):
     global worker
+    # crawl id (or cliargs and reindex_dict) for split files jobs
+    jobcontext = (cliargs, reindex_dict)
+    cliargs, reindex_dict = job_context(cliargs, reindex_dict)
     tree_dirs = []
     tree_files = []
     totalcrawltime = 0
     num_workers = len(SimpleWorker.all(connection=redis_conn))
 
+    if reindex_dict:
+        # get tags of all dirs in batch in one lookup
+        reindex_dict.prefetch('directory', [p[0][0] if type(p[0]) is tuple else p[0] for p in paths])
+
     for path in paths:
         starttime = time.time()
         root, dirs, files = path
 
         # check if dirchunk or stats embeded in data from 
-        # diskover tree walk client or crawlapi
+        # diskover tree walk client, crawlapi or --embedstats
+        # or unchanged dir (dcopy) from --incremental
+        dircopy = False
         if type(root) is tuple:
             if root[1] == 'dchunk':
                 dirchunk = True
+                # dir chunks with stats embeded in files
+                statsembeded = len(root) > 2 and root[2]
+            elif root[1] == 'dcopy':
+                dircopy = True
                 statsembeded = False
+                dirchunk = False
             else:
                 statsembeded = True
                 dirchunk = False
@@ -788,48 +719,53 @@ def scrape_tree_meta(paths, cliargs, reindex_dict):
             statsembeded = False
             dirchunk = False
 
-        if statsembeded:
+        if dirchunk:
             root_path = root[0]
-            dmeta = get_dir_meta(worker, root, cliargs, reindex_dict, statsembeded=True)
-        else:
-            if dirchunk:
-                root_path = root[0]
-                dmeta = {'chunkpath': root_path}
+            dmeta = {'chunkpath': root_path}
+        elif dircopy:
+            root_path = root[0]
+            if root[2]:
+                dmeta = get_dir_meta(worker, (root_path, root[2]), cliargs, reindex_dict, statsembeded=True)
             else:
-                root_path = root
                 dmeta = get_dir_meta(worker, root_path, cliargs, reindex_dict, statsembeded=False)
+        elif statsembeded:
+            root_path = root[0]
+            dmeta = get_dir_meta(worker, root, cliargs, reindex_dict, statsembeded=True)
+        else:
+            root_path = root
+            dmeta = get_dir_meta(worker, root_path, cliargs, reindex_dict, statsembeded=False)
 
         if dmeta:
             filecount = 0
             # check if the directory has a ton of files in it and farm out meta collection to other worker bots
             files_count = len(files)
-            if cliargs['splitfiles'] and files_count >= cliargs['splitfilesnum']:
+            if dircopy:
+                # copy file docs from index2 for unchanged dir
+                for fmeta in copy_file_docs(worker, root_path, cliargs):
+                    tree_files.append(fmeta)
+                    filecount += 1
+            elif cliargs['splitfiles'] and files_count >= cliargs['splitfilesnum']:
                 fmetas = []
                 for filelist in split_list(files, int(files_count/num_workers)):
                     fmetas.append(q_crawl.enqueue(file_meta_collector, 
-                                    args=(filelist, root_path, statsembeded, cliargs, reindex_dict,), 
+                                    args=(filelist, root_path, statsembeded,) + jobcontext, 
                                     result_ttl=config['redis_ttl']))
                 n = 0
                 while n < len(fmetas):
-                    if fmetas[n].result:
+                    # result is an empty list if all files were skipped
+                    if fmetas[n].result is not None:
                         for fmeta in fmetas[n].result:
-                            if fmeta:
-                                tree_files.append(fmeta)
-                                filecount += 1
+                            tree_files.append(fmeta)
+                            filecount += 1
                         n += 1
                     else:
                         time.sleep(.05)
                 del fmetas[:]
             else:
-                for file in files:
-                    if statsembeded:
-                        fmeta = get_file_meta(worker, file, cliargs, reindex_dict, statsembeded=True)
-                    else:
-                        fmeta = get_file_meta(worker, os.path.join(root_path, file), cliargs,
-                                            reindex_dict, statsembeded=False)
-                    if fmeta:
-                        tree_files.append(fmeta)
-                        filecount += 1
+                for fmeta in get_files_meta(worker, root_path, files, cliargs, reindex_dict,
+                                            statsembeded=statsembeded):
+                    tree_files.append(fmeta)
+                    filecount += 1
 
             # update crawl time
             elapsed = time.time() - starttime
@@ -856,19 +792,7 @@ def scrape_tree_meta(paths, cliargs, reindex_dict):
 def file_excluded(filename):
     """Return True if path or ext in excluded_files set,
     False if not in the set"""
-    # return if filename in included list (whitelist)
-    if filename in config['included_files']:
-        return False
-    # check for filename in excluded_files set
-    if filename in config['excluded_files']:
-        return True
-    # check for extension in and . (dot) files in excluded_files
-    extension = os.path.splitext(filename)[1][1:].lower()
-    if (not extension and 'NULLEXT' in config['excluded_files']) or \
-                            '*.' + extension in config['excluded_files'] or \
-            (filename.startswith('.') and u'.*' in config['excluded_files']):
-        return True
-    return False
+    return exclude_matcher.file_excluded(filename)
 
 
 def dupes_process_hashkeys(hashgroups, cliargs):
@@ -877,6 +801,7 @@ def dupes_process_hashkeys(hashgroups, cliargs):
     """
     from diskover_dupes import verify_dupes, index_dupes
 
+    cliargs, reindex_dict = job_context(cliargs)
     for filehash_filelist in hashgroups:
         # process the duplicate files in hashgroup
         dupes = verify_dupes(filehash_filelist, cliargs)
@@ -884,58 +809,78 @@ def dupes_process_hashkeys(hashgroups, cliargs):
             index_dupes(dupes, cliargs)
 
 
-def tag_copier(path, cliargs):
+def tag_copier(paths, cliargs):
     """This is the tag copier worker function.
-    It gets a path from the Queue and searches index for the
-    same path and copies any existing tags (from index2)
+    It gets a list of paths from the Queue and searches index for
+    the same paths and copies any existing tags (from index2)
     Updates index's doc's tag and tag_custom fields.
+    Docs in --pathids indexes are got by id with one mget for each
+    doc type instead of a search for each path.
     """
+    cliargs, reindex_dict = job_context(cliargs)
 
     doclist = []
 
-    # doc search (matching path) in index for existing tags from index2
-    # filename
-    f = os.path.basename(path[0])
-    # parent path
-    p = os.path.abspath(os.path.join(path[0], os.pardir))
+    if cliargs['pathids']:
+        for doctype in ('directory', 'file'):
+            typepaths = [path for path in paths if path[3] == doctype]
+            if not typepaths:
+                continue
+            res = es.mget(index=cliargs['index'], doc_type=doctype,
+                          body={'ids': [path_doc_id(doctype, path[0]) for path in typepaths]},
+                          _source=False, request_timeout=config['es_timeout'])
+            for path, doc in zip(typepaths, res['docs']):
+                if doc.get('found'):
+                    doclist.append(tag_update(cliargs, path, doc['_id']))
+    else:
+        for path in paths:
+            # doc search (matching path) in index for existing tags from index2
+            # filename
+            f = os.path.basename(path[0])
+            # parent path
+            p = os.path.abspath(os.path.join(path[0], os.pardir))
 
-    data = {
-        "size": 1,
-        "_source": ['tag', 'tag_custom'],
-        "query": {
-            "query_string": {
-                "query": "filename: \"" + f + "\" AND path_parent: \"" + p + "\""
+            data = {
+                "size": 1,
+                "_source": ['tag', 'tag_custom'],
+                "query": {
+                    "query_string": {
+                        "query": "filename: \"" + f + "\" AND path_parent: \"" + p + "\""
+                    }
+                }
             }
-        }
-    }
 
-    # check if file or directory
-    if path[3] == 'directory':
-        # search ES
-        res = es.search(index=cliargs['index'], doc_type='directory', body=data,
-                        request_timeout=config['es_timeout'])
-    else:
-        res = es.search(index=cliargs['index'], doc_type='file', body=data,
-                        request_timeout=config['es_timeout'])
+            # check if file or directory
+            if path[3] == 'directory':
+                # search ES
+                res = es.search(index=cliargs['index'], doc_type='directory', body=data,
+                                request_timeout=config['es_timeout'])
+            else:
+                res = es.search(index=cliargs['index'], doc_type='file', body=data,
+                                request_timeout=config['es_timeout'])
+
+            # skip path if no matching path in index
+            if len(res['hits']['hits']) == 0:
+                continue
+
+            doclist.append(tag_update(cliargs, path, res['hits']['hits'][0]['_id']))
 
-    # mark task done if no matching path in index and continue
-    if len(res['hits']['hits']) == 0:
-        return True
+    if doclist:
+        index_bulk_add(es, doclist, config, cliargs)
 
-    # existing tag in index2
-    docid = res['hits']['hits'][0]['_id']
 
-    # update tag and tag_custom fields in index
-    d = {
+def tag_update(cliargs, path, docid):
+    """This is the tag update function.
+    It returns the bulk update setting doc docid's tag and
+    tag_custom fields to path's tags from index2.
+    """
+    return {
         '_op_type': 'update',
         '_index': cliargs['index'],
         '_type': path[3],
         '_id': docid,
         'doc': {'tag': path[1], 'tag_custom': path[2]}
     }
-    doclist.append(d)
-
-    index_bulk_add(es, doclist, config, cliargs)
 
 
 def calc_hot_dirs(dirlist, cliargs):
@@ -945,39 +890,53 @@ def calc_hot_dirs(dirlist, cliargs):
     between the two. If path not in index2, change percent is 100%.
     Updates index's directory doc's change_percent fields.
     """
+    cliargs, reindex_dict = job_context(cliargs)
     doclist = []
+    fields = ['filesize', 'items', 'items_files', 'items_subdirs']
+
+    if dirlist and cliargs['hotdirspathids']:
+        # get index2 docs by id in one request
+        res = es.mget(index=cliargs['hotdirs'], doc_type='directory',
+                      body={'ids': [path_doc_id('directory', path[1]) for path in dirlist]},
+                      _source_include=fields, request_timeout=config['es_timeout'])
+        sources = [doc['_source'] if doc.get('found') else None for doc in res['docs']]
+    else:
+        sources = []
+        for path in dirlist:
+            # doc search (matching path) in index2
+            # filename
+            f = os.path.basename(path[1])
+            # parent path
+            p = os.path.abspath(os.path.join(path[1], os.pardir))
 
-    for path in dirlist:
-        # doc search (matching path) in index2
-        # filename
-        f = os.path.basename(path[1])
-        # parent path
-        p = os.path.abspath(os.path.join(path[1], os.pardir))
-
-        data = {
-            "size": 1,
-            "_source": ['filesize', 'items', 'items_files', 'items_subdirs'],
-            "query": {
-                "query_string": {
-                    "query": "filename: \"" + f + "\" AND path_parent: \"" + p + "\""
+            data = {
+                "size": 1,
+                "_source": fields,
+                "query": {
+                    "query_string": {
+                        "query": "filename: \"" + f + "\" AND path_parent: \"" + p + "\""
+                    }
                 }
             }
-        }
 
-        # search ES
-        res = es.search(index=cliargs['hotdirs'], doc_type='directory', body=data,
-                        request_timeout=config['es_timeout'])
+            # search ES
+            res = es.search(index=cliargs['hotdirs'], doc_type='directory', body=data,
+                            request_timeout=config['es_timeout'])
+            if len(res['hits']['hits']) == 0:
+                sources.append(None)
+            else:
+                sources.append(res['hits']['hits'][0]['_source'])
 
+    for path, source in zip(dirlist, sources):
         # calculate change percent
 
         # set change percent to 100% if no matching path in index2
-        if len(res['hits']['hits']) == 0:
+        if source is None:
             changepercent_filesize = 100.0
             changepercent_items = 100.0
             changepercent_items_files = 100.0
             changepercent_items_subdirs = 100.0
         else:
-            source = res['hits']['hits'][0]['_source']
             # ((new - old) / old) * 100
             try:
                 # check if path size in index2 was 0 bytes and set change percent to 100%
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Worker bot bulk buffer and bulk request sizing.
+Docs from crawl jobs are buffered across jobs and bulk added to
+Elasticsearch by a flusher thread, so a bot keeps stat-ing files
+while earlier docs upload and small directories don't each make
+their own small bulk request. Bulk requests can be sized by bytes
+instead of doc count, adapting to how fast es takes them.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from threading import Thread, Event, Lock
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+import sys
+import time
+import warnings
+
+if sys.version_info >= (3, 0):
+    STRING_TYPES = (str, bytes)
+else:
+    STRING_TYPES = (basestring,)
+
+# estimated serialized size of a field's name, quotes and separators
+# and of a number or other non string value
+FIELD_SIZE = 24
+
+
+def doc_size(doc):
+    """Return estimated size in bytes of doc once serialized, the
+    length of it's string values plus FIELD_SIZE for each field.
+    Cheaper than serializing, docs are sized once when buffered."""
+    size = 0
+    for value in doc.values():
+        size += FIELD_SIZE
+        if isinstance(value, STRING_TYPES):
+            size += len(value)
+    return size
+
+
+# bulk item statuses worth sending again, es busy or down (N/A for
+# connection errors) and version conflicts of updates to docs
+# another bot is updating
+RETRY_STATUSES = frozenset([409, 429, 502, 503, 504, 'N/A'])
+
+
+def bulk_retryable(status):
+    """Return True if a bulk item that failed with status can be
+    sent again."""
+    return status in RETRY_STATUSES
+
+
+class BulkSizer(object):
+    """Bulk request size in bytes, additive increase multiplicative
+    decrease. The size goes up by step while requests take less than
+    target seconds and is halved when a request is slower than that
+    or es rejects docs, between minbytes and maxbytes. Requests also
+    have at most maxdocs docs.
+    """
+
+    def __init__(self, start=5242880, minbytes=1048576, maxbytes=52428800, target=2.0, maxdocs=10000):
+        self.bytes = start
+        self.minbytes = minbytes
+        self.maxbytes = maxbytes
+        self.target = target
+        self.maxdocs = maxdocs
+        self.step = max(minbytes, start // 4)
+        self.lock = Lock()
+        # docs in last request and totals
+        self.docs = 0
+        self.requests = 0
+        self.rejections = 0
+
+    def chunks(self, docs, sizes=None):
+        """Yield lists of docs for each bulk request. sizes are the
+        doc sizes if already known."""
+        chunk = []
+        size = 0
+        for i, doc in enumerate(docs):
+            chunk.append(doc)
+            size += sizes[i] if sizes is not None else doc_size(doc)
+            if size >= self.bytes or len(chunk) >= self.maxdocs:
+                yield chunk
+                chunk = []
+                size = 0
+        if chunk:
+            yield chunk
+
+    def update(self, docs, seconds, rejected=False):
+        """Adapt size from a bulk request of docs which took seconds."""
+        with self.lock:
+            self.docs = docs
+            self.requests += 1
+            if rejected:
+                self.rejections += 1
+            if rejected or seconds > self.target:
+                self.bytes = max(self.minbytes, self.bytes // 2)
+            else:
+                self.bytes = min(self.maxbytes, self.bytes + self.step)
+
+
+class BulkBatch(object):
+    """Docs for one index waiting to be bulk added."""
+
+    def __init__(self, cliargs):
+        self.cliargs = cliargs
+        self.docs = []
+        # size of each doc in docs
+        self.sizes = []
+        self.dir_count = 0
+        self.file_count = 0
+        self.crawl_time = 0
+        self.size = 0
+        self.starttime = time.time()
+
+
+class BulkBuffer(object):
+    """Bulk buffer sending batches of docs with send(batch) in a
+    flusher thread. A batch is sent once it has maxdocs docs or
+    maxbytes bytes, or is maxage seconds old. Up to queuesize full
+    batches wait for the flusher before add blocks. Batches send
+    raised an exception for are passed to on_error(batch, e) in the
+    flusher thread. signal(pending) is called with True when docs
+    are buffered and every second while any are not sent yet, and
+    with False once all buffered docs have been sent.
+    """
+
+    def __init__(self, send, maxdocs=500, maxbytes=10485760, maxage=5.0, queuesize=2,
+                 on_error=None, signal=None):
+        self.send = send
+        self.maxdocs = maxdocs
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.on_error = on_error
+        self.signal = signal
+        self.batch = None
+        self.lock = Lock()
+        self.signal_lock = Lock()
+        self.batches = Queue(queuesize)
+        self.stop = Event()
+        # docs buffered or waiting for the flusher
+        self.pending = 0
+        self.flusher = None
+        self.ager = None
+
+    def _start(self):
+        if self.flusher is None or not self.flusher.is_alive():
+            self.stop.clear()
+            self.flusher = Thread(target=self._flush_worker)
+            self.flusher.daemon = True
+            self.flusher.start()
+        if self.ager is None or not self.ager.is_alive():
+            self.ager = Thread(target=self._age_worker)
+            self.ager.daemon = True
+            self.ager.start()
+
+    def _signal(self):
+        if self.signal is None:
+            return
+        # pending is read under the lock so the last call is current
+        with self.signal_lock:
+            self.signal(self.pending > 0)
+
+    def _flush_worker(self):
+        while True:
+            batch = self.batches.get()
+            try:
+                if batch is None:
+                    return
+                try:
+                    self.send(batch)
+                except Exception as e:
+                    if self.on_error is not None:
+                        self.on_error(batch, e)
+                    else:
+                        warnings.warn('Bulk add of %s buffered docs failed: %s' % (len(batch.docs), e))
+                with self.lock:
+                    self.pending -= len(batch.docs)
+                    done = self.pending == 0
+                if done:
+                    self._signal()
+            except Exception as e:
+                warnings.warn('Bulk buffer flusher exception caused by: %s' % e)
+            finally:
+                self.batches.task_done()
+
+    def _age_worker(self):
+        while not self.stop.wait(min(self.maxage, 1.0) if self.maxage > 0 else 1.0):
+            try:
+                if self.pending:
+                    self._signal()
+                if self.maxage <= 0:
+                    continue
+                with self.lock:
+                    batch = self.batch
+                    if batch is None or time.time() - batch.starttime < self.maxage:
+                        continue
+                    self.batch = None
+                self.batches.put(batch)
+            except Exception as e:
+                warnings.warn('Bulk buffer timer exception caused by: %s' % e)
+
+    def add(self, cliargs, dirlist, filelist, crawltime=0):
+        """Buffer dir and file docs for cliargs index."""
+        if not dirlist and not filelist:
+            return
+        self._start()
+        full = []
+        with self.lock:
+            first = self.pending == 0
+            self.pending += len(dirlist) + len(filelist)
+            if self.batch is not None and self.batch.cliargs['index'] != cliargs['index']:
+                full.append(self.batch)
+                self.batch = None
+            if self.batch is None:
+                self.batch = BulkBatch(cliargs)
+            batch = self.batch
+            sizes = [doc_size(doc) for doc in dirlist]
+            sizes.extend(doc_size(doc) for doc in filelist)
+            batch.size += sum(sizes)
+            batch.sizes.extend(sizes)
+            batch.docs.extend(dirlist)
+            batch.docs.extend(filelist)
+            batch.dir_count += len(dirlist)
+            batch.file_count += len(filelist)
+            batch.crawl_time += crawltime or 0
+            if len(batch.docs) >= self.maxdocs or batch.size >= self.maxbytes:
+                full.append(batch)
+                self.batch = None
+        if first:
+            self._signal()
+        # blocks while the flusher is behind
+        for batch in full:
+            self.batches.put(batch)
+
+    def flush(self):
+        """Send buffered docs and wait for all batches to be sent."""
+        with self.lock:
+            batch = self.batch
+            self.batch = None
+        if batch is not None:
+            self._start()
+            self.batches.put(batch)
+        self.batches.join()
+
+    def close(self):
+        """Flush and stop the flusher and timer threads."""
+        try:
+            self.flush()
+        finally:
+            self.stop.set()
+            if self.flusher is not None and self.flusher.is_alive():
+                self.batches.put(None)
+                self.flusher.join()
+            if self.ager is not None:
+                self.ager.join()
+            self.flusher = None
+            self.ager = None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Crawl context registry.
+The dispatcher publishes cliargs and reindex_dict to Redis once
+under a crawl id and rq jobs carry just the crawl id, worker bots
+fetch the context on their first job and cache it.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import uuid
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+CONTEXT_KEY = 'diskover:context:'
+
+# crawl contexts cached by bots
+MAX_CACHED = 16
+contexts = OrderedDict()
+contexts_lock = Lock()
+
+
+def new_crawl_id(index, name=None):
+    """Return a crawl id for index. The id is unique to the crawl
+    unless name is given."""
+    return '%s.%s' % (index, name or uuid.uuid4().hex)
+
+
+def crawl_id_index(crawl_id):
+    """Return the index name of crawl id."""
+    return crawl_id.rsplit('.', 1)[0]
+
+
+def publish_context(redis_conn, crawl_id, cliargs, reindex_dict, ttl=0):
+    """Publish crawl context to Redis, expiring after ttl seconds."""
+    data = pickle.dumps({'cliargs': cliargs, 'reindex_dict': reindex_dict},
+                        pickle.HIGHEST_PROTOCOL)
+    redis_conn.set(CONTEXT_KEY + crawl_id, data, ex=ttl or None)
+    with contexts_lock:
+        contexts.pop(crawl_id, None)
+
+
+def delete_context(redis_conn, crawl_id):
+    """Delete crawl context from Redis once the crawl has ended."""
+    redis_conn.delete(CONTEXT_KEY + crawl_id)
+    with contexts_lock:
+        contexts.pop(crawl_id, None)
+
+
+def get_context(redis_conn, crawl_id):
+    """Return (cliargs, reindex_dict) for crawl id, from the cache
+    or else from Redis."""
+    with contexts_lock:
+        if crawl_id in contexts:
+            return contexts[crawl_id]
+    data = redis_conn.get(CONTEXT_KEY + crawl_id)
+    if data is None:
+        raise KeyError('crawl context %s not found in redis, expired or crawl ended' % crawl_id)
+    context = pickle.loads(data)
+    context = (context['cliargs'], context['reindex_dict'])
+    with contexts_lock:
+        contexts[crawl_id] = context
+        while len(contexts) > MAX_CACHED:
+            contexts.popitem(last=False)
+    return context
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Dead letter store for bulk docs es permanently failed to add,
+kept in a Redis list or NDJSON file so they can be replayed
+(--replaydeadletters) once the cause is fixed.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from threading import Lock
+import json
+import os
+
+KEY_PREFIX = 'diskover:deadletter:'
+
+
+class DeadLetterStore(object):
+    """Failed bulk docs. target is redis to keep them in Redis
+    list diskover:deadletter:<index>, or the path of a NDJSON file
+    with a line for each doc.
+    """
+
+    def __init__(self, target, redis_conn=None):
+        self.target = target
+        self.redis = redis_conn if target == 'redis' else None
+        self.lock = Lock()
+
+    def add(self, index, failures):
+        """Store (doc, status, error) failures of index bulk adds."""
+        lines = [json.dumps({'index': index, 'status': status, 'error': error, 'doc': doc}, default=str)
+                 for doc, status, error in failures]
+        if not lines:
+            return
+        if self.redis is not None:
+            self.redis.rpush(KEY_PREFIX + index, *lines)
+            return
+        with self.lock:
+            with open(self.target, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def get(self, index):
+        """Return list of stored docs for index, oldest first."""
+        if self.redis is not None:
+            values = self.redis.lrange(KEY_PREFIX + index, 0, -1)
+            return [json.loads(v.decode('utf-8'))['doc'] for v in values]
+        docs = []
+        with self.lock:
+            if not os.path.exists(self.target):
+                return docs
+            with open(self.target) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry['index'] == index:
+                        docs.append(entry['doc'])
+        return docs
+
+    def remove(self, index, count):
+        """Remove the oldest count stored docs for index, once they
+        have been added again. Docs stored since are kept."""
+        if count <= 0:
+            return
+        if self.redis is not None:
+            self.redis.ltrim(KEY_PREFIX + index, count, -1)
+            return
+        with self.lock:
+            if not os.path.exists(self.target):
+                return
+            keep = []
+            with open(self.target) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    if count > 0 and json.loads(line)['index'] == index:
+                        count -= 1
+                        continue
+                    keep.append(line)
+            with open(self.target, 'w') as f:
+                f.writelines(keep)
@@ -11,7 +11,8 @@ diskover is released under the Apache 2.0 license. See
 LICENSE for the full license text.
 """
 
-from diskover import index_bulk_add, config, es, progress_bar, redis_conn, worker_bots_busy, ab_start, adaptive_batch
+from diskover import index_bulk_add, config, es, progress_bar, redis_conn, worker_bots_busy, ab_start, adaptive_batch, \
+    jobdone_subscribe, wait_for_jobdone, get_bulk_enqueuer
 from diskover_bot_module import dupes_process_hashkeys
 from rq import SimpleWorker
 import base64
@@ -338,6 +339,7 @@ def dupes_finder(es, q, cliargs, logger):
     if cliargs['verbose'] or cliargs['debug']:
         logger.info('Batch size: %s' % batchsize)
 
+    enqueuer = get_bulk_enqueuer(q)
     n = 0
     hashgroups = []
     for key, value in filehashes.items():
@@ -347,7 +349,7 @@ def dupes_finder(es, q, cliargs, logger):
         n += 1
         if n >= batchsize:
             # send to rq for bots to process hashgroups list
-            q.enqueue(dupes_process_hashkeys, args=(hashgroups, cliargs,), result_ttl=config['redis_ttl'])
+            enqueuer.enqueue(dupes_process_hashkeys, (hashgroups, cliargs['crawlid'],))
             if cliargs['debug'] or cliargs['verbose']:
                 logger.info("enqueued batchsize: %s (batchsize: %s)" % (n, batchsize))
             del hashgroups[:]
@@ -359,7 +361,8 @@ def dupes_finder(es, q, cliargs, logger):
 
     # enqueue dir calc job for any remaining in dirlist
     if n > 0:
-        q.enqueue(dupes_process_hashkeys, args=(hashgroups, cliargs,), result_ttl=config['redis_ttl'])
+        enqueuer.enqueue(dupes_process_hashkeys, (hashgroups, cliargs['crawlid'],))
+    enqueuer.close()
 
     logger.info('%s possible dupe file hashes have been enqueued, worker bots processing dupes...' % possibledupescount)
 
@@ -370,14 +373,18 @@ def dupes_finder(es, q, cliargs, logger):
         bar = None
 
     # update progress bar until bots are idle and queue is empty
-    while worker_bots_busy([q]):
-        if bar:
-            q_len = len(q)
-            try:
-                bar.update(q_len)
-            except (ZeroDivisionError, ValueError):
-                bar.update(0)
-        time.sleep(1)
+    jobdone = jobdone_subscribe()
+    try:
+        while worker_bots_busy([q]):
+            if bar:
+                q_len = len(q)
+                try:
+                    bar.update(q_len)
+                except (ZeroDivisionError, ValueError):
+                    bar.update(0)
+            wait_for_jobdone(jobdone)
+    finally:
+        jobdone.close()
 
     if bar:
         bar.finish()
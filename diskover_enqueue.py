@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Pipelined bulk enqueue of rq jobs.
+Jobs are buffered and enqueued many at a time in one Redis
+pipeline instead of one round trip per job.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from rq.job import Job
+from threading import Thread, Event, Lock
+import warnings
+
+
+class BulkEnqueuer(object):
+    """Bulk enqueuer for a rq queue.
+    Jobs are flushed to Redis once size jobs are buffered, by a
+    timer thread every interval seconds and on flush or close.
+    Jobs stay buffered until the pipeline they are in succeeds.
+    """
+
+    def __init__(self, queue, result_ttl, size=100, interval=1.0):
+        self.queue = queue
+        self.result_ttl = result_ttl
+        self.size = size
+        self.interval = interval
+        self.jobs = []
+        self.lock = Lock()
+        # serializes flushes so jobs reach rq in order
+        self.flush_lock = Lock()
+        self.stop = Event()
+        self.timer = None
+
+    def _timer(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # jobs are kept and sent again on the next flush
+                warnings.warn('Bulk enqueue of rq jobs failed, retrying: %s' % e)
+
+    def enqueue(self, func, args, pipeline_func=None):
+        """Buffer job func(*args) to be enqueued and return it.
+        pipeline_func(pipe) is called in the same Redis transaction
+        as the job is enqueued in, for any other writes which have
+        to happen with it.
+        """
+        job = Job.create(func, args=args, connection=self.queue.connection,
+                         result_ttl=self.result_ttl, origin=self.queue.name)
+        # pickle job now, args can be changed by caller once we return
+        job.data
+        if self.size <= 1:
+            self._enqueue([(job, pipeline_func)])
+            return job
+        with self.lock:
+            self.jobs.append((job, pipeline_func))
+            full = len(self.jobs) >= self.size
+            if self.timer is None and self.interval > 0:
+                self.stop.clear()
+                self.timer = Thread(target=self._timer)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                # job is buffered, the timer or next flush sends it
+                warnings.warn('Bulk enqueue of rq jobs failed, retrying: %s' % e)
+        return job
+
+    def _enqueue(self, jobs):
+        pipe = self.queue.connection.pipeline()
+        for job, pipeline_func in jobs:
+            self.queue.enqueue_job(job, pipeline=pipe)
+            if pipeline_func:
+                pipeline_func(pipe)
+        pipe.execute()
+
+    def flush(self):
+        """Enqueue all buffered jobs. If the pipeline fails the
+        jobs are kept buffered and the exception is raised."""
+        with self.flush_lock:
+            with self.lock:
+                jobs = self.jobs
+                self.jobs = []
+            if jobs:
+                try:
+                    self._enqueue(jobs)
+                except Exception:
+                    # put jobs back ahead of any buffered since
+                    with self.lock:
+                        self.jobs[:0] = jobs
+                    raise
+
+    def close(self):
+        """Stop the timer thread and enqueue all buffered jobs."""
+        with self.lock:
+            timer = self.timer
+            self.timer = None
+        if timer:
+            self.stop.set()
+            timer.join()
+        self.flush()
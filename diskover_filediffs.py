@@ -15,7 +15,8 @@ diskover is released under the Apache 2.0 license. See
 LICENSE for the full license text.
 """
 
-from diskover import config, escape_chars
+from diskover import config
+from diskover_query import PathQuery
 try:
     from elasticsearch5 import Elasticsearch, helpers, RequestsHttpConnection, \
         Urllib3HttpConnection, exceptions
@@ -105,39 +106,17 @@ def replace_path(path, frompath, topath):
 
 
 def get_files_gen(eshost, esver7, index, path):
-    newpath = escape_chars(path)
-    if newpath == '\/':
-        newpathwildcard = '\/*'
-    else:
-        newpathwildcard = newpath + '\/*'
     logger.info('Searching for all file docs in %s for path %s...', index, path)
     eshost.indices.refresh(index)
+    data = {
+        '_source': ['path_parent', 'filename', 'filesize', 'last_modified', 'last_access', 'last_change'],
+        'query': PathQuery.for_index(eshost, index).path_tree(path)
+    }
     if esver7:
-        data = {
-            '_source': ['path_parent', 'filename', 'filesize', 'last_modified', 'last_access', 'last_change'],
-            'query': {
-                'query_string': {
-                    'query': '((path_parent: ' + newpath + ') OR '
-                                                            '(path_parent: ' + newpathwildcard + ') OR (filename: "'
-                                + os.path.basename(path) + '" AND path_parent: "'
-                                + os.path.abspath(os.path.join(path, os.pardir)) + '")) AND type:file',
-                }
-            }
-        }
+        data['query'] = {'bool': {'must': [data['query'], {'term': {'type': 'file'}}]}}
         res = eshost.search(index=index, scroll='1m', size=config['es_scrollsize'], 
                             body=data, request_timeout=config['es_timeout'])
     else:
-        data = {
-            '_source': ['path_parent', 'filename', 'filesize', 'last_modified', 'last_access', 'last_change'],
-            'query': {
-                'query_string': {
-                    'query': '(path_parent: ' + newpath + ') OR '
-                                                            '(path_parent: ' + newpathwildcard + ') OR (filename: "'
-                                + os.path.basename(path) + '" AND path_parent: "'
-                                + os.path.abspath(os.path.join(path, os.pardir)) + '")',
-                }
-            }
-        }
         res = eshost.search(index=index, doc_type='file', scroll='1m',
                         size=config['es_scrollsize'], body=data, request_timeout=config['es_timeout'])
 
@@ -160,39 +139,17 @@ def get_files_gen(eshost, esver7, index, path):
 
 
 def get_files(eshost, esver7, index, path):
-    newpath = escape_chars(path)
-    if newpath == '\/':
-        newpathwildcard = '\/*'
-    else:
-        newpathwildcard = newpath + '\/*'
     logger.info('Searching for all file docs in %s for path %s...', index, path)
     eshost.indices.refresh(index)
+    data = {
+        '_source': ['path_parent', 'filename', 'filesize', 'last_modified', 'last_access', 'last_change'],
+        'query': PathQuery.for_index(eshost, index).path_tree(path)
+    }
     if esver7:
-        data = {
-            '_source': ['path_parent', 'filename', 'filesize', 'last_modified', 'last_access', 'last_change'],
-            'query': {
-                'query_string': {
-                    'query': '((path_parent: ' + newpath + ') OR '
-                                                            '(path_parent: ' + newpathwildcard + ') OR (filename: "'
-                                + os.path.basename(path) + '" AND path_parent: "'
-                                + os.path.abspath(os.path.join(path, os.pardir)) + '")) AND type:file',
-                }
-            }
-        }
+        data['query'] = {'bool': {'must': [data['query'], {'term': {'type': 'file'}}]}}
         res = eshost.search(index=index, scroll='1m', size=config['es_scrollsize'], 
                             body=data, request_timeout=config['es_timeout'])
     else:
-        data = {
-            '_source': ['path_parent', 'filename', 'filesize', 'last_modified', 'last_access', 'last_change'],
-            'query': {
-                'query_string': {
-                    'query': '(path_parent: ' + newpath + ') OR '
-                                                            '(path_parent: ' + newpathwildcard + ') OR (filename: "'
-                                + os.path.basename(path) + '" AND path_parent: "'
-                                + os.path.abspath(os.path.join(path, os.pardir)) + '")',
-                }
-            }
-        }
         res = eshost.search(index=index, doc_type='file', scroll='1m',
                         size=config['es_scrollsize'], body=data, request_timeout=config['es_timeout'])
     filelist = []
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Tree walk frontier (paths waiting to be listed by treewalk threads).
+Supports breadth first, depth first or hybrid ordering and keeps
+memory bounded by spilling segments of paths to local disk.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from collections import deque
+from threading import Condition, Lock
+import os
+import sys
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class WalkFrontier(object):
+    """Walk frontier with the put, get, task_done and join methods
+    treewalk uses from Queue.
+
+    order is bfs (FIFO), dfs (LIFO) or hybrid. Hybrid walks breadth
+    first until hybridpaths paths are waiting, enough to keep all
+    the walk threads busy, then depth first so the frontier doesn't
+    keep growing across wide trees.
+
+    When the paths in memory use more than maxmem bytes, the half of
+    them which would be walked last is spilled to a segment file in
+    spilldir and loaded back when memory runs out of paths. Ordering
+    is kept per segment, so with spilling it is approximate.
+    """
+
+    def __init__(self, order='bfs', maxmem=0, spilldir=None, hybridpaths=1000):
+        if order not in ('bfs', 'dfs', 'hybrid'):
+            raise ValueError('unknown treewalk order %s' % order)
+        self.order = order
+        self.maxmem = maxmem
+        self.spilldir = spilldir or tempfile.gettempdir()
+        self.hybridpaths = hybridpaths
+        self.paths = deque()
+        self.mem = 0
+        self.segments = deque()
+        self.spilled = 0
+        self.unfinished_tasks = 0
+        self.mutex = Lock()
+        self.not_empty = Condition(self.mutex)
+        self.all_tasks_done = Condition(self.mutex)
+
+    def _fifo(self):
+        return self.order == 'bfs' or (self.order == 'hybrid' and len(self.paths) < self.hybridpaths)
+
+    def _spill(self):
+        # spill the half of the paths which would be walked last
+        n = len(self.paths) // 2
+        if n == 0:
+            return
+        if self._fifo():
+            segment = [self.paths.pop() for i in range(n)]
+            segment.reverse()
+        else:
+            segment = [self.paths.popleft() for i in range(n)]
+        for path in segment:
+            self.mem -= sys.getsizeof(path)
+        fd, segfile = tempfile.mkstemp(prefix='diskover-frontier-', dir=self.spilldir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(segment, f, pickle.HIGHEST_PROTOCOL)
+        self.segments.append((segfile, n))
+        self.spilled += n
+
+    def _load(self):
+        # bfs loads the oldest segment, dfs the newest
+        if self._fifo():
+            segfile, n = self.segments.popleft()
+        else:
+            segfile, n = self.segments.pop()
+        with open(segfile, 'rb') as f:
+            segment = pickle.load(f)
+        os.remove(segfile)
+        self.spilled -= n
+        for path in segment:
+            self.mem += sys.getsizeof(path)
+        self.paths.extend(segment)
+
+    def qsize(self):
+        with self.mutex:
+            return len(self.paths) + self.spilled
+
+    def put(self, path):
+        with self.mutex:
+            self.paths.append(path)
+            self.mem += sys.getsizeof(path)
+            self.unfinished_tasks += 1
+            if self.maxmem and self.mem > self.maxmem:
+                self._spill()
+            self.not_empty.notify()
+
+    def get(self):
+        with self.not_empty:
+            while not self.paths and not self.segments:
+                self.not_empty.wait()
+            if not self.paths:
+                self._load()
+            if self._fifo():
+                path = self.paths.popleft()
+            else:
+                path = self.paths.pop()
+            self.mem -= sys.getsizeof(path)
+            return path
+
+    def task_done(self):
+        with self.all_tasks_done:
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks <= 0:
+                if self.unfinished_tasks < 0:
+                    raise ValueError('task_done() called too many times')
+                self.all_tasks_done.notify_all()
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    def close(self):
+        """Remove any spilled segment files."""
+        with self.mutex:
+            for segfile, n in self.segments:
+                try:
+                    os.remove(segfile)
+                except OSError:
+                    pass
+            self.segments.clear()
+            self.spilled = 0
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Crawl journal used by --journal and --resume.
+The journal is a Redis hash of the walk frontier, every directory
+that has been found but whose listing hasn't been enqueued to the
+worker bots yet. Changes are committed in the same Redis transaction
+as the crawl batch job they belong to, so the journal always matches
+what is in rq.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from threading import Lock
+import json
+import os
+import sys
+
+IS_PY3 = sys.version_info >= (3, 0)
+
+# journal directory states
+PENDING = 'p'  # found, not listed yet
+CHUNKED = 'c'  # listing, file chunks sent to bots
+LISTED = 'l'  # listed and subdirs journaled
+LISTED_CHUNKED = 'lc'  # listed and subdirs journaled, file chunks sent to bots
+
+
+def encode_path(path):
+    """Return path as bytes for Redis."""
+    if IS_PY3:
+        return os.fsencode(path)
+    if isinstance(path, unicode):
+        return path.encode('utf-8')
+    return path
+
+
+def decode_path(path):
+    """Return path from Redis as str."""
+    if IS_PY3:
+        return os.fsdecode(path)
+    return path.decode('utf-8')
+
+
+class CrawlJournal(object):
+    """Crawl journal of the walk frontier kept in Redis.
+    Tree walk threads record state changes which are buffered and
+    taken by commit to be written along with the crawl batch job.
+    """
+
+    def __init__(self, redis_conn, index):
+        self.redis = redis_conn
+        self.key = 'diskover:journal:' + index
+        self.meta_key = self.key + ':meta'
+        self.lock = Lock()
+        self.changes = {}
+        # paths to walk on resume
+        self.frontier = []
+        # listed dirs being relisted on resume, their subdirs are already journaled
+        self.relist = set()
+
+    def exists(self):
+        """Return True if there is a journal to resume."""
+        return self.redis.exists(self.meta_key) > 0
+
+    def meta(self):
+        """Return the journal meta dict."""
+        return json.loads(self.redis.get(self.meta_key).decode('utf-8'))
+
+    def start(self, rootdir, crawl_id):
+        """Start a new journal for crawl crawl_id of rootdir."""
+        pipe = self.redis.pipeline()
+        pipe.delete(self.key)
+        pipe.set(self.meta_key, json.dumps({'rootdir': rootdir, 'crawlid': crawl_id}))
+        pipe.hset(self.key, encode_path(rootdir), PENDING)
+        pipe.execute()
+
+    def load(self):
+        """Load the journal frontier for resume.
+        Returns list of paths which had file chunks sent to bots
+        before the crawl stopped.
+        """
+        chunked = []
+        for path, state in self.redis.hscan_iter(self.key, count=10000):
+            path = decode_path(path)
+            state = state.decode('utf-8')
+            self.frontier.append(path)
+            if state in (LISTED, LISTED_CHUNKED):
+                self.relist.add(path)
+            if state in (CHUNKED, LISTED_CHUNKED):
+                chunked.append(path)
+        return chunked
+
+    def clear(self):
+        """Remove the journal once the walk is done."""
+        self.redis.delete(self.key, self.meta_key)
+
+    def chunked(self, path):
+        """Record file chunks of path sent to bots."""
+        with self.lock:
+            self.changes[path] = CHUNKED
+
+    def listed(self, path, subdirs, chunked=False):
+        """Record path listed and it's subdirs found.
+        Returns False if the subdirs were already journaled before a
+        resume and shouldn't be walked again.
+        """
+        with self.lock:
+            self.changes[path] = LISTED_CHUNKED if chunked else LISTED
+            if path in self.relist:
+                self.relist.discard(path)
+                return False
+            for d in subdirs:
+                self.changes[d] = PENDING
+        return True
+
+    def done(self, path):
+        """Record path listing added to a crawl batch."""
+        with self.lock:
+            self.changes[path] = None
+
+    def commit(self):
+        """Take the buffered changes for a crawl batch job.
+        Returns a function which writes them to the Redis pipeline
+        the job is enqueued in.
+        """
+        with self.lock:
+            changes = self.changes
+            self.changes = {}
+        states = {}
+        removed = []
+        for path, state in changes.items():
+            if state is None:
+                removed.append(encode_path(path))
+            else:
+                states[encode_path(path)] = state
+
+        def write(pipe):
+            if states:
+                pipe.hmset(self.key, states)
+            if removed:
+                pipe.hdel(self.key, *removed)
+        return write
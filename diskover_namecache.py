@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+uid/gid -> owner/group name cache for worker bots.
+Names are cached in a dict per bot and shared between bots in
+Redis, so slow passwd/group lookups (LDAP, SSSD) are done once.
+ids with no name are cached too.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from threading import Lock
+
+
+class NameCache(object):
+    """id -> name cache.
+    lookup(id) returns the name or raises KeyError if there is no
+    name for id, which is cached as id. When redis_conn is given,
+    names are shared in Redis keys prefix<id> expiring after ttl
+    seconds.
+    """
+
+    def __init__(self, lookup, redis_conn=None, prefix='', ttl=0):
+        self.lookup = lookup
+        self.redis = redis_conn
+        self.prefix = prefix
+        self.ttl = ttl
+        self.names = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def preload(self, entries):
+        """Add (id, name) entries, ids already cached are kept."""
+        with self.lock:
+            for i, name in entries:
+                self.names.setdefault(i, name)
+
+    def get(self, i):
+        """Return name for id, or id if it has no name."""
+        try:
+            return self.names[i]
+        except KeyError:
+            pass
+        name = None
+        if self.redis is not None:
+            value = self.redis.get(self.prefix + str(i))
+            if value is not None:
+                # empty value is a cached id with no name
+                name = value.decode('utf-8') or i
+        if name is None:
+            try:
+                name = value = self.lookup(i)
+            except KeyError:
+                name = i
+                value = ''
+            if self.redis is not None:
+                self.redis.set(self.prefix + str(i), value, ex=self.ttl or None)
+        with self.lock:
+            self.names[i] = name
+        return name
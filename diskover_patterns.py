@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Wildcard pattern matching used for excludes/includes and auto-tagging.
+Patterns are compiled once from the config instead of being turned
+into regular expressions for every file and directory.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+import os
+import re
+
+# characters which make an exclude affix a regular expression
+REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+def compile_regex(pattern):
+    """This is the compile regex function.
+    It compiles pattern as a regular expression, or as a literal string
+    if it isn't a valid regular expression.
+    """
+    try:
+        return re.compile(pattern)
+    except re.error:
+        return re.compile(re.escape(pattern))
+
+
+def combine_regex(patterns):
+    """This is the combine regex function.
+    It combines regular expression strings into one alternation
+    regex, or returns None if there are no patterns.
+    """
+    parts = []
+    for p in patterns:
+        # check each part compiles on it's own, else match it literally
+        parts.append('(?:%s)' % compile_regex(p).pattern)
+    if not parts:
+        return None
+    return re.compile('|'.join(parts))
+
+
+def wildcard_regex(pattern):
+    """This is the wildcard regex function.
+    It returns a regular expression string for a config wildcard
+    pattern, *contains*, *suffix or prefix* (or a regular expression
+    without wildcards), which also matches pattern exactly.
+    """
+    if len(pattern) > 1 and pattern.startswith('*') and pattern.endswith('*'):
+        regex = compile_regex(pattern.replace('*', '')).pattern
+    elif pattern.startswith('*'):
+        regex = compile_regex(pattern[1:]).pattern + '$'
+    elif pattern.endswith('*'):
+        regex = '^' + compile_regex(pattern[:-1]).pattern
+    else:
+        regex = compile_regex(pattern).pattern
+    return '(?:%s)|(?:^%s$)' % (regex, re.escape(pattern))
+
+
+class AffixTable(object):
+    """Prefix or suffix lookup table.
+    Affixes are kept in sets bucketed by length, which answers the
+    same question as a trie with one set lookup per distinct affix
+    length instead of one string compare per pattern.
+    """
+
+    def __init__(self, affixes, suffix=False):
+        self.suffix = suffix
+        buckets = {}
+        for a in affixes:
+            if a:
+                buckets.setdefault(len(a), set()).add(a)
+        self.buckets = sorted(buckets.items())
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def match(self, s):
+        """Return True if s starts (or ends) with any of the affixes."""
+        s_len = len(s)
+        for n, affixes in self.buckets:
+            if n > s_len:
+                break
+            if (s[-n:] if self.suffix else s[:n]) in affixes:
+                return True
+        return False
+
+
+class ExcludeMatcher(object):
+    """Compiled [excludes]/[includes] config matcher.
+    Built once from the config and shared by the tree walk and worker
+    bots. Exact dir names and paths are set lookups, dir prefix*
+    and *suffix wildcards are affix table lookups and all *contains*
+    wildcards, and prefix*/*suffix wildcards with regex characters
+    (matched as regular expressions as before), are one alternation
+    regex.
+    """
+
+    def __init__(self, config):
+        self.included_dirs = frozenset(config['included_dirs'])
+        self.included_files = frozenset(config['included_files'])
+
+        excluded_dirs = config['excluded_dirs']
+        self.exclude_dotdirs = u'.*' in excluded_dirs
+        exact = set()
+        prefixes = []
+        suffixes = []
+        contains = []
+        for d in excluded_dirs:
+            if d == '.*':
+                continue
+            if len(d) > 1 and d.startswith('*') and d.endswith('*'):
+                contains.append(d.replace('*', ''))
+            elif d.startswith('*'):
+                if REGEX_CHARS.intersection(d[1:]):
+                    contains.append(d[1:] + '$')
+                else:
+                    suffixes.append(d[1:])
+            elif d.endswith('*'):
+                if REGEX_CHARS.intersection(d[:-1]):
+                    contains.append('^' + d[:-1])
+                else:
+                    prefixes.append(d[:-1])
+            else:
+                exact.add(d)
+        self.excluded_dirs = frozenset(exact)
+        self.dir_prefixes = AffixTable(prefixes)
+        self.dir_suffixes = AffixTable(suffixes, suffix=True)
+        self.dir_contains = combine_regex(contains)
+
+        excluded_files = config['excluded_files']
+        self.excluded_files = frozenset(excluded_files)
+        self.exclude_dotfiles = u'.*' in excluded_files
+        self.exclude_noext = 'NULLEXT' in excluded_files
+        self.excluded_exts = frozenset(f[2:] for f in excluded_files if f.startswith('*.'))
+
+    def dir_excluded(self, path):
+        """Return True if dir path is excluded, False if not or
+        if it's included (whitelisted)."""
+        name = os.path.basename(path)
+        # return if directory in included list (whitelist)
+        if name in self.included_dirs or path in self.included_dirs:
+            return False
+        if name in self.excluded_dirs or path in self.excluded_dirs:
+            return True
+        # skip any dirs which start with . (dot) and in excluded_dirs
+        if self.exclude_dotdirs and name.startswith('.'):
+            return True
+        if self.dir_prefixes and (self.dir_prefixes.match(name) or self.dir_prefixes.match(path)):
+            return True
+        if self.dir_suffixes and (self.dir_suffixes.match(name) or self.dir_suffixes.match(path)):
+            return True
+        if self.dir_contains and (self.dir_contains.search(name) or self.dir_contains.search(path)):
+            return True
+        return False
+
+    def file_excluded(self, filename):
+        """Return True if file name or ext is excluded, False if not
+        or if it's included (whitelisted)."""
+        # return if filename in included list (whitelist)
+        if filename in self.included_files:
+            return False
+        if filename in self.excluded_files:
+            return True
+        # check for . (dot) files and extension in excluded_files
+        if self.exclude_dotfiles and filename.startswith('.'):
+            return True
+        extension = os.path.splitext(filename)[1][1:].lower()
+        if extension:
+            return extension in self.excluded_exts
+        return self.exclude_noext
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Plugin registry and executor.
+Loaded plugins are classified once as file, directory or both doc
+type plugins. Plugins can also have an add_meta_batch(paths) function
+returning a list of meta dicts, one for each path, which is used
+instead of add_meta(path) to get meta for many docs at a time.
+Worker bots can run plugin calls in a thread or process pool with
+a timeout for all the calls for a batch of docs.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import time
+import warnings
+
+# plugins run by executor pool workers
+executor_plugins = []
+
+
+def plugin_for_type(plugin, doctype):
+    """Return True if plugin adds meta to doctype docs.
+    Plugins raise KeyError adding their mappings to other doc types.
+    """
+    mappings = {'mappings': {doctype: {'properties': {}}}}
+    try:
+        plugin.add_mappings(mappings)
+    except KeyError:
+        return False
+    return True
+
+
+def run_plugin(i, method, arg, plugins=None):
+    """Call plugin i's method with arg, plugins defaults to the
+    executor pool's plugins.
+    Returns (status, result, seconds), status is ok or error with
+    the error message as result.
+    """
+    if plugins is None:
+        plugins = executor_plugins
+    starttime = time.time()
+    try:
+        result = getattr(plugins[i], method)(arg)
+    except KeyError:
+        result = {}
+    except Exception as e:
+        return 'error', str(e), time.time() - starttime
+    return 'ok', result, time.time() - starttime
+
+
+class PluginRegistry(object):
+    """Loaded plugins, iterates over all of them like the plugin list.
+    Plugin calls run inline unless start_executor is called.
+    """
+
+    def __init__(self, plugins, names=None):
+        self.plugins = list(plugins)
+        self.names = list(names or ['plugin%s' % i for i in range(len(self.plugins))])
+        self.doctype_plugins = {
+            'file': [i for i, p in enumerate(self.plugins) if plugin_for_type(p, 'file')],
+            'directory': [i for i, p in enumerate(self.plugins) if plugin_for_type(p, 'directory')]
+        }
+        self.executor = 'inline'
+        self.workers = 0
+        self.timeout = None
+        self.pool = None
+        # plugin name -> [calls, seconds, errors, timeouts]
+        self.stats = dict((name, [0, 0., 0, 0]) for name in self.names)
+
+    def __iter__(self):
+        return iter(self.plugins)
+
+    def __len__(self):
+        return len(self.plugins)
+
+    def for_type(self, doctype):
+        """Return plugins for doctype docs."""
+        return [self.plugins[i] for i in self.doctype_plugins[doctype]]
+
+    def start_executor(self, executor='inline', workers=4, timeout=0):
+        """Run plugin calls inline, or in a thread or process pool of
+        workers. Calls not done timeout seconds after the add_meta
+        they were made for started are skipped, hung processes are
+        replaced but hung threads keep their pool worker.
+        """
+        global executor_plugins
+        if executor not in ('inline', 'thread', 'process'):
+            raise ValueError('unknown plugins executor %s' % executor)
+        executor_plugins = self.plugins
+        self.executor = executor
+        self.workers = workers
+        self.timeout = timeout or None
+        if self.plugins:
+            self._start_pool()
+
+    def _start_pool(self):
+        if self.executor == 'thread':
+            self.pool = ThreadPool(self.workers)
+        elif self.executor == 'process':
+            self.pool = multiprocessing.Pool(self.workers)
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+    def _submit(self, i, method, arg):
+        if self.pool is None:
+            return run_plugin(i, method, arg, self.plugins)
+        if self.executor == 'thread':
+            return self.pool.apply_async(run_plugin, (i, method, arg, self.plugins))
+        # process pool workers have the plugins from when they were forked
+        return self.pool.apply_async(run_plugin, (i, method, arg))
+
+    def _result(self, call, deadline):
+        if self.pool is None:
+            return call
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - time.time())
+        try:
+            return call.get(timeout)
+        except multiprocessing.TimeoutError:
+            return 'timeout', None, timeout
+
+    def add_meta(self, doctype, paths):
+        """Return list of plugin meta dicts for doctype doc paths.
+        Meta from a plugin call which failed or timed out is left out
+        and the docs are indexed without it, for file and directory
+        docs alike. All the calls share one timeout.
+        """
+        metas = [{} for p in paths]
+        deadline = time.time() + self.timeout if self.timeout else None
+        # (plugin, path index or None for batch, call)
+        calls = []
+        for i in self.doctype_plugins[doctype]:
+            if hasattr(self.plugins[i], 'add_meta_batch'):
+                calls.append((i, None, self._submit(i, 'add_meta_batch', paths)))
+            else:
+                for n, path in enumerate(paths):
+                    calls.append((i, n, self._submit(i, 'add_meta', path)))
+
+        timeouts = 0
+        for i, n, call in calls:
+            status, result, elapsed = self._result(call, deadline)
+            name = self.names[i]
+            stats = self.stats[name]
+            stats[0] += 1
+            stats[1] += elapsed
+            if status == 'ok':
+                if n is None:
+                    for meta, m in zip(metas, result):
+                        if m:
+                            meta.update(m)
+                elif result:
+                    metas[n].update(result)
+            elif status == 'error':
+                stats[2] += 1
+                if n is None:
+                    warnings.warn("Plugin %s batch exception caused by: %s" % (name, result))
+                else:
+                    warnings.warn("Plugin %s exception caused by: %s" % (name, result))
+            else:
+                stats[3] += 1
+                timeouts += 1
+                warnings.warn("Plugin %s timed out after %s sec for %s"
+                              % (name, self.timeout, paths[n] if n is not None else 'batch'))
+
+        # replace any hung plugin processes
+        if timeouts and self.executor == 'process':
+            self.close()
+            self._start_pool()
+
+        return metas
+
+    def stats_summary(self):
+        """Return per plugin stats string."""
+        summary = []
+        for name in self.names:
+            calls, seconds, errors, timeouts = self.stats[name]
+            if calls:
+                summary.append('%s: %s calls, %s ms avg, %s errors, %s timeouts'
+                               % (name, calls, round(seconds / calls * 1000, 3), errors, timeouts))
+        return '; '.join(summary)
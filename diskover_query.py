@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Path query builder.
+Indexes created by this version map path_parent with a
+path_hierarchy tokenized subfield (path_parent.tree) holding the
+parent path and all it's ancestors, and docs have a depth field.
+Queries for docs under a path are then term lookups and maxdepth
+a range, instead of query_string wildcards and regexps which are
+still used for older indexes.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+import os
+import sys
+
+IS_PY3 = sys.version_info >= (3, 0)
+
+# index settings and path_parent mapping for the path tree field
+PATH_TREE_ANALYSIS = {
+    "analyzer": {
+        "path_tree": {
+            "type": "custom",
+            "tokenizer": "path_tree"
+        }
+    },
+    "tokenizer": {
+        "path_tree": {
+            "type": "path_hierarchy",
+            "delimiter": "/"
+        }
+    }
+}
+
+PATH_PARENT_MAPPING = {
+    "type": "keyword",
+    "fields": {
+        "tree": {
+            "type": "text",
+            "analyzer": "path_tree",
+            "search_analyzer": "keyword",
+            "norms": False,
+            "index_options": "docs"
+        }
+    }
+}
+
+# index -> True if it has the path tree and depth fields, bots get this from the crawl context
+path_field_indices = {}
+
+
+def escape_chars(text):
+    """This is the escape special characters function.
+    It returns escaped path strings for es queries.
+    """
+    # escape any backslash chars
+    text = text.replace('\\', '\\\\')
+    # escape any characters in chr_dict
+    chr_dict = {'\n': '\\n', '\t': '\\t',
+                '/': '\\/', '(': '\\(', ')': '\\)', '[': '\\[', ']': '\\]', '$': '\\$',
+                ' ': '\\ ', '&': '\\&', '<': '\\<', '>': '\\>', '+': '\\+', '-': '\\-',
+                '|': '\\|', '!': '\\!', '{': '\\{', '}': '\\}', '^': '\\^', '~': '\\~',
+                '?': '\\?', ':': '\\:', '=': '\\=', '\'': '\\\'', '"': '\\"', '@': '\\@',
+                '.': '\\.', '#': '\\#', '*': '\\*', '　': '\\　'}
+    def char_trans(text, chr_dict):
+        for key, value in chr_dict.items():
+            text = text.replace(key, value)
+        return text
+    if IS_PY3:
+        text_esc = text.translate(str.maketrans(chr_dict))
+    else:
+        text_esc = char_trans(text, chr_dict)
+    return text_esc
+
+
+def path_depth(path):
+    """Return number of components in path, 0 for /."""
+    return len([p for p in path.split('/') if p])
+
+
+def mapping_properties(mapping):
+    """Return list of properties dicts in an index mapping, one for
+    each doc type (es 5) or just the one (es 7)."""
+    mappings = mapping.get('mappings', {})
+    if 'properties' in mappings:
+        return [mappings['properties']]
+    return [m['properties'] for m in mappings.values() if isinstance(m, dict) and 'properties' in m]
+
+
+def index_path_fields(es, index):
+    """Return True if index has the path_parent.tree and depth fields."""
+    if index not in path_field_indices:
+        found = False
+        for mapping in es.indices.get_mapping(index=index).values():
+            for props in mapping_properties(mapping):
+                if 'tree' in props.get('path_parent', {}).get('fields', {}) and 'depth' in props:
+                    found = True
+        path_field_indices[index] = found
+    return path_field_indices[index]
+
+
+class PathQuery(object):
+    """Builds path queries, with term/range queries on the path tree
+    and depth fields if tree is True else query_string wildcards.
+    """
+
+    def __init__(self, tree=False):
+        self.tree = tree
+
+    @classmethod
+    def for_index(cls, es, index):
+        """Return PathQuery for the fields index has."""
+        return cls(index_path_fields(es, index))
+
+    def parent(self, path):
+        """Docs directly in path."""
+        return {"term": {"path_parent": path}}
+
+    def doc(self, path):
+        """The doc for path itself."""
+        return {
+            "bool": {
+                "filter": [
+                    {"term": {"filename": os.path.basename(path)}},
+                    {"term": {"path_parent": os.path.abspath(os.path.join(path, os.pardir))}}
+                ]
+            }
+        }
+
+    def subtree(self, path):
+        """Docs in path and all it's subdirs."""
+        if self.tree:
+            if path == '/':
+                return {"match_all": {}}
+            return {"term": {"path_parent.tree": path}}
+        newpath = escape_chars(path)
+        # check for / (root) path
+        if newpath == '\\/':
+            query = 'path_parent: ' + newpath + '*'
+        else:
+            query = 'path_parent: ' + newpath + ' OR path_parent: ' + newpath + '\\/*'
+        return {"query_string": {"query": query, "analyze_wildcard": "true"}}
+
+    def path_tree(self, path, recursive=True):
+        """The doc for path and docs in path, and in all it's subdirs
+        if recursive."""
+        if recursive:
+            docs = self.subtree(path)
+        else:
+            docs = self.parent(path)
+        return {"bool": {"should": [docs, self.doc(path)], "minimum_should_match": 1}}
+
+    def maxdepth(self, rootdir, maxdepth):
+        """Docs at most maxdepth dirs below rootdir."""
+        # path_parent components
+        n = rootdir.count(os.path.sep) + maxdepth - 1
+        if self.tree:
+            return {"range": {"depth": {"lte": n + 1}}}
+        return {"regexp": {"path_parent": '(/[^/]+){1,' + str(n) + '}|/?'}}
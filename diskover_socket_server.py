@@ -11,7 +11,7 @@ diskover is released under the Apache 2.0 license. See
 LICENSE for the full license text.
 """
 
-from diskover import q_crawl, adaptive_batch, config, get_time
+from diskover import q_crawl, adaptive_batch, config, get_time, crawl_batch_enqueue, crawl_enqueuer
 from diskover_bot_module import scrape_tree_meta
 import socket
 import subprocess
@@ -156,8 +156,7 @@ def socket_thread_handler_twc(threadnum, q, q_kill, lock, rootdir, num_sep, leve
                     batch.append((root, dirs, files))
                     batch_len = len(batch)
                     if batch_len >= batchsize or (cliargs['adaptivebatch'] and totalfiles >= config['adaptivebatch_maxfiles']):
-                        q_crawl.enqueue(scrape_tree_meta, args=(batch, cliargs, reindex_dict,), 
-                                            result_ttl=config['redis_ttl'])
+                        crawl_batch_enqueue(scrape_tree_meta, batch, cliargs, logger)
                         if cliargs['debug'] or cliargs['verbose']:
                             logger.info("enqueued batchsize: %s (batchsize: %s)" % (batch_len, batchsize))
                         del batch[:]
@@ -169,8 +168,9 @@ def socket_thread_handler_twc(threadnum, q, q_kill, lock, rootdir, num_sep, leve
 
                 if len(batch) > 0:
                     # add any remaining in batch to queue
-                    q_crawl.enqueue(scrape_tree_meta, args=(batch, cliargs, reindex_dict,), result_ttl=config['redis_ttl'])
+                    crawl_batch_enqueue(scrape_tree_meta, batch, cliargs, logger)
                     del batch[:]
+                crawl_enqueuer.flush()
 
             # close connection to client
             clientsock.close()
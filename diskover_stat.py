@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Concurrent lstat for worker bots.
+On high latency file systems (nfs) a bot spends most of it's time
+waiting on lstat, a pool of threads keeps many lstats in flight.
+On Linux lstat can also be done with statx(2) asking only for the
+fields the crawl needs, without syncing attributes with the server
+(AT_STATX_DONT_SYNC) on network/cluster file systems, or with io_uring
+submitting statx for a whole batch of files in one system call.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from multiprocessing.pool import ThreadPool
+import ctypes
+import ctypes.util
+import errno
+import mmap
+import os
+import sys
+import time
+import warnings
+
+IS_PY3 = sys.version_info >= (3, 0)
+
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+AT_STATX_DONT_SYNC = 0x4000
+
+STATX_TYPE = 0x1
+STATX_MODE = 0x2
+STATX_NLINK = 0x4
+STATX_UID = 0x8
+STATX_GID = 0x10
+STATX_ATIME = 0x20
+STATX_MTIME = 0x40
+STATX_CTIME = 0x80
+STATX_INO = 0x100
+STATX_SIZE = 0x200
+STATX_BLOCKS = 0x400
+
+# fields unpacked from lstat for file docs, blocks only for on disk size
+STATX_CRAWL = STATX_TYPE | STATX_MODE | STATX_NLINK | STATX_UID | STATX_GID | \
+    STATX_ATIME | STATX_MTIME | STATX_CTIME | STATX_INO | STATX_SIZE
+
+
+class StatxTimestamp(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_int64),
+                ('tv_nsec', ctypes.c_uint32),
+                ('reserved', ctypes.c_int32)]
+
+
+class StatxStruct(ctypes.Structure):
+    _fields_ = [('stx_mask', ctypes.c_uint32),
+                ('stx_blksize', ctypes.c_uint32),
+                ('stx_attributes', ctypes.c_uint64),
+                ('stx_nlink', ctypes.c_uint32),
+                ('stx_uid', ctypes.c_uint32),
+                ('stx_gid', ctypes.c_uint32),
+                ('stx_mode', ctypes.c_uint16),
+                ('spare0', ctypes.c_uint16),
+                ('stx_ino', ctypes.c_uint64),
+                ('stx_size', ctypes.c_uint64),
+                ('stx_blocks', ctypes.c_uint64),
+                ('stx_attributes_mask', ctypes.c_uint64),
+                ('stx_atime', StatxTimestamp),
+                ('stx_btime', StatxTimestamp),
+                ('stx_ctime', StatxTimestamp),
+                ('stx_mtime', StatxTimestamp),
+                ('stx_rdev_major', ctypes.c_uint32),
+                ('stx_rdev_minor', ctypes.c_uint32),
+                ('stx_dev_major', ctypes.c_uint32),
+                ('stx_dev_minor', ctypes.c_uint32),
+                ('spare2', ctypes.c_uint64 * 14)]
+
+
+def load_statx():
+    """Return libc statx function or None if not available."""
+    libc_name = ctypes.util.find_library('c')
+    if not libc_name:
+        return None
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        statx = libc.statx
+    except (OSError, AttributeError):
+        return None
+    statx.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint,
+                      ctypes.POINTER(StatxStruct)]
+    statx.restype = ctypes.c_int
+    return statx
+
+
+class Statx(object):
+    """lstat using statx(2) for fields in mask.
+    Returns os.stat_result like os.lstat, fields not in mask are
+    whatever the file system returned (or 0).
+    """
+
+    def __init__(self, mask=STATX_CRAWL, dontsync=True):
+        self.statx = load_statx()
+        if self.statx is None:
+            raise OSError(errno.ENOSYS, 'statx not available')
+        self.mask = mask
+        self.flags = AT_SYMLINK_NOFOLLOW
+        if dontsync:
+            self.flags |= AT_STATX_DONT_SYNC
+
+    def __call__(self, path):
+        if not isinstance(path, bytes):
+            path = os.fsencode(path) if IS_PY3 else path.encode('utf-8')
+        buf = StatxStruct()
+        if self.statx(AT_FDCWD, path, self.flags, self.mask, ctypes.byref(buf)) != 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return statx_result(buf)
+
+
+def statx_result(buf):
+    """Return os.stat_result from statx struct buf."""
+    atime = buf.stx_atime.tv_sec + buf.stx_atime.tv_nsec / 1e9
+    mtime = buf.stx_mtime.tv_sec + buf.stx_mtime.tv_nsec / 1e9
+    ctime = buf.stx_ctime.tv_sec + buf.stx_ctime.tv_nsec / 1e9
+    dev = os.makedev(buf.stx_dev_major, buf.stx_dev_minor)
+    return os.stat_result((buf.stx_mode, buf.stx_ino, dev, buf.stx_nlink, buf.stx_uid,
+                           buf.stx_gid, buf.stx_size, buf.stx_atime.tv_sec,
+                           buf.stx_mtime.tv_sec, buf.stx_ctime.tv_sec),
+                          {'st_atime': atime, 'st_mtime': mtime, 'st_ctime': ctime,
+                           'st_blocks': buf.stx_blocks, 'st_blksize': buf.stx_blksize})
+
+
+# io_uring, x86_64 and aarch64 (and most other arches) system call numbers
+SYS_IO_URING_SETUP = 425
+SYS_IO_URING_ENTER = 426
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+IORING_FEAT_SINGLE_MMAP = 0x1
+IORING_ENTER_GETEVENTS = 0x1
+IORING_OP_STATX = 21
+
+
+class IoSqringOffsets(ctypes.Structure):
+    _fields_ = [('head', ctypes.c_uint32),
+                ('tail', ctypes.c_uint32),
+                ('ring_mask', ctypes.c_uint32),
+                ('ring_entries', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('dropped', ctypes.c_uint32),
+                ('array', ctypes.c_uint32),
+                ('resv1', ctypes.c_uint32),
+                ('user_addr', ctypes.c_uint64)]
+
+
+class IoCqringOffsets(ctypes.Structure):
+    _fields_ = [('head', ctypes.c_uint32),
+                ('tail', ctypes.c_uint32),
+                ('ring_mask', ctypes.c_uint32),
+                ('ring_entries', ctypes.c_uint32),
+                ('overflow', ctypes.c_uint32),
+                ('cqes', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('resv1', ctypes.c_uint32),
+                ('user_addr', ctypes.c_uint64)]
+
+
+class IoUringParams(ctypes.Structure):
+    _fields_ = [('sq_entries', ctypes.c_uint32),
+                ('cq_entries', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('sq_thread_cpu', ctypes.c_uint32),
+                ('sq_thread_idle', ctypes.c_uint32),
+                ('features', ctypes.c_uint32),
+                ('wq_fd', ctypes.c_uint32),
+                ('resv', ctypes.c_uint32 * 3),
+                ('sq_off', IoSqringOffsets),
+                ('cq_off', IoCqringOffsets)]
+
+
+class IoUringSqe(ctypes.Structure):
+    _fields_ = [('opcode', ctypes.c_uint8),
+                ('flags', ctypes.c_uint8),
+                ('ioprio', ctypes.c_uint16),
+                ('fd', ctypes.c_int32),
+                ('addr2', ctypes.c_uint64),
+                ('addr', ctypes.c_uint64),
+                ('len', ctypes.c_uint32),
+                ('statx_flags', ctypes.c_uint32),
+                ('user_data', ctypes.c_uint64),
+                ('pad', ctypes.c_uint64 * 3)]
+
+
+class IoUringCqe(ctypes.Structure):
+    _fields_ = [('user_data', ctypes.c_uint64),
+                ('res', ctypes.c_int32),
+                ('flags', ctypes.c_uint32)]
+
+
+class UringStat(object):
+    """Batch lstat using io_uring statx operations (Linux 5.6+).
+    A batch of up to entries statx ops is submitted and waited on
+    with one io_uring_enter system call. Raises OSError if io_uring
+    or it's statx op isn't available.
+    """
+
+    def __init__(self, mask=STATX_CRAWL, dontsync=True, entries=256):
+        self.mask = mask
+        self.flags = AT_SYMLINK_NOFOLLOW
+        if dontsync:
+            self.flags |= AT_STATX_DONT_SYNC
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc.syscall.restype = ctypes.c_long
+        params = IoUringParams()
+        self.fd = self.libc.syscall(SYS_IO_URING_SETUP, ctypes.c_uint(entries), ctypes.byref(params))
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, 'io_uring_setup: %s' % os.strerror(e))
+        try:
+            self._map(params)
+            # check statx op works
+            if isinstance(self.lstat_many(['/'])[0], Exception):
+                raise OSError(errno.EINVAL, 'io_uring statx not supported')
+        except Exception:
+            self.close()
+            raise
+
+    def _map(self, p):
+        self.entries = p.sq_entries
+        sq_size = p.sq_off.array + p.sq_entries * 4
+        cq_size = p.cq_off.cqes + p.cq_entries * ctypes.sizeof(IoUringCqe)
+        if p.features & IORING_FEAT_SINGLE_MMAP:
+            sq_size = cq_size = max(sq_size, cq_size)
+        self.sq_ring = mmap.mmap(self.fd, sq_size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE,
+                                 offset=IORING_OFF_SQ_RING)
+        if p.features & IORING_FEAT_SINGLE_MMAP:
+            self.cq_ring = self.sq_ring
+        else:
+            self.cq_ring = mmap.mmap(self.fd, cq_size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE,
+                                     offset=IORING_OFF_CQ_RING)
+        self.sqes_map = mmap.mmap(self.fd, p.sq_entries * ctypes.sizeof(IoUringSqe), mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE, offset=IORING_OFF_SQES)
+        self.sq_tail = ctypes.c_uint32.from_buffer(self.sq_ring, p.sq_off.tail)
+        self.sq_mask = ctypes.c_uint32.from_buffer(self.sq_ring, p.sq_off.ring_mask).value
+        self.sq_array = (ctypes.c_uint32 * p.sq_entries).from_buffer(self.sq_ring, p.sq_off.array)
+        self.sqes = (IoUringSqe * p.sq_entries).from_buffer(self.sqes_map)
+        self.cq_head = ctypes.c_uint32.from_buffer(self.cq_ring, p.cq_off.head)
+        self.cq_tail = ctypes.c_uint32.from_buffer(self.cq_ring, p.cq_off.tail)
+        self.cq_mask = ctypes.c_uint32.from_buffer(self.cq_ring, p.cq_off.ring_mask).value
+        self.cqes = (IoUringCqe * p.cq_entries).from_buffer(self.cq_ring, p.cq_off.cqes)
+
+    def close(self):
+        # ctypes views into the rings have to go before the maps close
+        for attr in ('sq_tail', 'sq_array', 'sqes', 'cq_head', 'cq_tail', 'cqes'):
+            self.__dict__.pop(attr, None)
+        for attr in ('sqes_map', 'cq_ring', 'sq_ring'):
+            m = self.__dict__.pop(attr, None)
+            if m is not None and not m.closed:
+                m.close()
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _batch(self, paths):
+        n = len(paths)
+        bufs = (StatxStruct * n)()
+        names = [ctypes.create_string_buffer(
+            p if isinstance(p, bytes) else (os.fsencode(p) if IS_PY3 else p.encode('utf-8'))) for p in paths]
+        tail = self.sq_tail.value
+        for i in range(n):
+            idx = (tail + i) & self.sq_mask
+            sqe = self.sqes[idx]
+            ctypes.memset(ctypes.byref(sqe), 0, ctypes.sizeof(IoUringSqe))
+            sqe.opcode = IORING_OP_STATX
+            sqe.fd = AT_FDCWD
+            sqe.addr = ctypes.addressof(names[i])
+            sqe.len = self.mask
+            sqe.statx_flags = self.flags
+            sqe.addr2 = ctypes.addressof(bufs[i])
+            sqe.user_data = i
+            self.sq_array[idx] = idx
+        # io_uring_enter is a full barrier, the kernel sees the new tail
+        self.sq_tail.value = tail + n
+
+        results = [None] * n
+        submitted = 0
+        done = 0
+        while done < n:
+            ret = self.libc.syscall(SYS_IO_URING_ENTER, self.fd, ctypes.c_uint(n - submitted),
+                                    ctypes.c_uint(1), ctypes.c_uint(IORING_ENTER_GETEVENTS), None, 0)
+            if ret < 0:
+                e = ctypes.get_errno()
+                if e in (errno.EINTR, errno.EAGAIN, errno.EBUSY):
+                    continue
+                raise OSError(e, 'io_uring_enter: %s' % os.strerror(e))
+            submitted += ret
+            head = self.cq_head.value
+            tail = self.cq_tail.value
+            while head != tail:
+                cqe = self.cqes[head & self.cq_mask]
+                i = cqe.user_data
+                if cqe.res < 0:
+                    results[i] = OSError(-cqe.res, os.strerror(-cqe.res), paths[i])
+                else:
+                    results[i] = statx_result(bufs[i])
+                done += 1
+                head += 1
+            self.cq_head.value = head
+        return results
+
+    def lstat_many(self, paths):
+        """Return list of lstat results for paths, or the exception
+        for paths that couldn't be lstat'ed."""
+        results = []
+        for i in range(0, len(paths), self.entries):
+            results.extend(self._batch(paths[i:i + self.entries]))
+        return results
+
+
+def stat_functions(backend='lstat'):
+    """Return (lstat, lstat with blocks) functions for stat backend
+    lstat or statx, statx falls back to lstat if not available."""
+    if backend in ('statx', 'uring'):
+        try:
+            return Statx(STATX_CRAWL), Statx(STATX_CRAWL | STATX_BLOCKS)
+        except OSError:
+            warnings.warn('statx not available, using lstat')
+    elif backend != 'lstat':
+        raise ValueError('unknown stat backend %s' % backend)
+    return os.lstat, os.lstat
+
+
+class StatPool(object):
+    """Bounded lstat thread pool.
+    Paths are split into as many chunks as the current concurrency
+    and each chunk is lstat'ed by a pool thread, results are in path
+    order. Concurrency is additive increase, multiplicative decrease:
+    it goes up by one for each batch while lstat latency stays near
+    the lowest seen and is halved when latency rises above twice that.
+    """
+
+    def __init__(self, threads=0, backend='lstat', minbatch=8):
+        self.threads = threads
+        self.stat, self.stat_blocks = stat_functions(backend)
+        # io_uring batch engines, else falls back to statx in threads
+        self.uring = None
+        if backend == 'uring':
+            try:
+                self.uring = (UringStat(STATX_CRAWL), UringStat(STATX_CRAWL | STATX_BLOCKS))
+            except (OSError, AttributeError, ValueError) as e:
+                warnings.warn('io_uring statx not available, using statx (%s)' % e)
+        self.minbatch = minbatch
+        self.concurrency = threads
+        self.pool = None
+        # lowest per lstat latency seen, drifts up so it follows the fs
+        self.minlatency = None
+        self.latency = 0
+
+    def _lstat(self, stat, path):
+        try:
+            return stat(path)
+        except (OSError, IOError) as e:
+            return e
+
+    def _lstat_chunk(self, args):
+        stat, paths = args
+        starttime = time.time()
+        stats = [self._lstat(stat, p) for p in paths]
+        return stats, time.time() - starttime
+
+    def _adjust(self, latency):
+        self.latency = latency
+        if self.minlatency is None or latency < self.minlatency:
+            self.minlatency = latency
+        if latency > self.minlatency * 2:
+            self.concurrency = max(1, self.concurrency // 2)
+        else:
+            self.concurrency = min(self.threads, self.concurrency + 1)
+        self.minlatency *= 1.05
+
+    def lstat_many(self, paths, blocks=True):
+        """Return list of lstat results for paths, or the exception
+        for paths that couldn't be lstat'ed. st_blocks is only
+        needed if blocks."""
+        if self.uring:
+            return self.uring[1 if blocks else 0].lstat_many(paths)
+        stat = self.stat_blocks if blocks else self.stat
+        if self.threads < 2 or len(paths) < self.minbatch:
+            return [self._lstat(stat, p) for p in paths]
+        if self.pool is None:
+            self.pool = ThreadPool(self.threads)
+        chunksize = -(-len(paths) // self.concurrency)
+        chunks = [(stat, paths[i:i + chunksize]) for i in range(0, len(paths), chunksize)]
+        stats = []
+        elapsed = 0
+        for chunk_stats, chunk_elapsed in self.pool.map(self._lstat_chunk, chunks):
+            stats.extend(chunk_stats)
+            elapsed += chunk_elapsed
+        self._adjust(elapsed / len(paths))
+        return stats
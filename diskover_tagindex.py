@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Tag index used when reindexing (-r/-R) to copy existing tags
+over to the new docs. Tags are looked up by a hash of the doc
+path instead of scanning a list of every doc being reindexed.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+import hashlib
+import json
+import sys
+
+import diskover_connections
+
+IS_PY3 = sys.version_info >= (3, 0)
+
+DOCTYPE_PREFIX = {'file': b'f', 'directory': b'd'}
+
+
+def tag_key(doctype, path):
+    """Return tag index key for doc path, doctype prefix and
+    the first 8 bytes of the path md5."""
+    if IS_PY3 or isinstance(path, unicode):
+        path = path.encode('utf-8', 'surrogateescape' if IS_PY3 else 'strict')
+    return DOCTYPE_PREFIX[doctype] + hashlib.md5(path).digest()[:8]
+
+
+class TagIndex(object):
+    """Tags (tag, tag_custom) of tagged docs keyed by path hash.
+    Held in memory and sent to bots in the crawl context, or for
+    large tag sets stored in a Redis hash which bots read with one
+    HMGET per batch of dirs or dir of files (prefetch).
+    """
+
+    def __init__(self):
+        self.tags = {}
+        self.key = None
+        self.count = 0
+        self.prefetched = {'file': {}, 'directory': {}}
+
+    def __len__(self):
+        return self.count
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['prefetched'] = {'file': {}, 'directory': {}}
+        return state
+
+    def add(self, doctype, path, tag, tag_custom):
+        """Add doc tags, docs without any tags are skipped."""
+        if not tag and not tag_custom:
+            return
+        key = tag_key(doctype, path)
+        if key not in self.tags:
+            self.count += 1
+        self.tags[key] = (tag, tag_custom)
+
+    def store(self, redis_conn, key, ttl=0, chunksize=10000):
+        """Move tags to Redis hash key, expiring after ttl seconds."""
+        pipe = redis_conn.pipeline()
+        pipe.delete(key)
+        chunk = {}
+        for k, tags in self.tags.items():
+            chunk[k] = json.dumps(tags)
+            if len(chunk) >= chunksize:
+                pipe.hmset(key, chunk)
+                chunk = {}
+        if chunk:
+            pipe.hmset(key, chunk)
+        if ttl:
+            pipe.expire(key, ttl)
+        pipe.execute()
+        self.tags = {}
+        self.key = key
+
+    def prefetch(self, doctype, paths):
+        """Get tags for doc paths from Redis in one HMGET, replacing
+        any previously prefetched for doctype."""
+        if self.key is None or not paths:
+            return
+        keys = [tag_key(doctype, p) for p in paths]
+        values = diskover_connections.redis_conn.hmget(self.key, keys)
+        self.prefetched[doctype] = dict(zip(keys, values))
+
+    def get(self, doctype, path):
+        """Return (tag, tag_custom) for doc path or None."""
+        key = tag_key(doctype, path)
+        if self.key is None:
+            return self.tags.get(key)
+        try:
+            value = self.prefetched[doctype][key]
+        except KeyError:
+            value = diskover_connections.redis_conn.hget(self.key, key)
+        if value is None:
+            return None
+        return tuple(json.loads(value.decode('utf-8')))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""diskover - Elasticsearch file system crawler
+diskover is a file system crawler that index's
+your file metadata into Elasticsearch.
+See README.md or https://github.com/shirosaidev/diskover
+for more information.
+
+Backpressure between tree walking and the rq crawl queue.
+High/low watermarks on queue length and estimated queued job bytes
+stop the tree walk from filling Redis faster than bots drain it.
+
+Copyright (C) Chris Park 2017-2020
+diskover is released under the Apache 2.0 license. See
+LICENSE for the full license text.
+"""
+
+from threading import Lock
+import time
+
+
+class QueueThrottle(object):
+    """rq queue throttle with high/low watermarks.
+    Queue bytes are estimated from a moving average of the pickled
+    job size times the queue length, so only the queue length needs
+    to be read from Redis.
+    """
+
+    def __init__(self, queue, highwater=0, lowwater=0, maxbytes=0, interval=.5):
+        self.queue = queue
+        self.highwater = highwater
+        self.lowwater = lowwater or highwater // 2
+        self.maxbytes = maxbytes
+        if highwater and self.lowwater:
+            self.lowbytes = maxbytes * self.lowwater // highwater
+        else:
+            self.lowbytes = maxbytes // 2
+        self.interval = interval
+        self.jobbytes = 0
+        self.stalls = 0
+        self.stalltime = 0
+        self.lock = Lock()
+
+    def enabled(self):
+        return bool(self.highwater or self.maxbytes)
+
+    def add(self, job):
+        """Add enqueued job size to the job bytes moving average."""
+        if not self.enabled():
+            return
+        size = len(job.data)
+        with self.lock:
+            if self.jobbytes:
+                self.jobbytes = .9 * self.jobbytes + .1 * size
+            else:
+                self.jobbytes = size
+
+    def queue_bytes(self, q_len):
+        """Return estimated bytes of q_len jobs."""
+        return int(self.jobbytes * q_len)
+
+    def above_high(self, q_len):
+        return bool((self.highwater and q_len >= self.highwater) or
+                    (self.maxbytes and self.queue_bytes(q_len) >= self.maxbytes))
+
+    def above_low(self, q_len):
+        return bool((self.highwater and q_len > self.lowwater) or
+                    (self.maxbytes and self.queue_bytes(q_len) > self.lowbytes))
+
+    def wait(self):
+        """Wait if the queue is above the high watermark until it
+        drains below the low watermark. Returns seconds stalled."""
+        if not self.enabled():
+            return 0
+        q_len = len(self.queue)
+        if not self.above_high(q_len):
+            return 0
+        starttime = time.time()
+        while self.above_low(q_len):
+            time.sleep(self.interval)
+            q_len = len(self.queue)
+        stalled = time.time() - starttime
+        with self.lock:
+            self.stalls += 1
+            self.stalltime += stalled
+        return stalled
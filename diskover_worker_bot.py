@@ -11,13 +11,14 @@ diskover is released under the Apache 2.0 license. See
 LICENSE for the full license text.
 """
 
-from diskover import listen, version, config
-from rq import SimpleWorker, Connection
+from diskover import listen, version, config, plugins
+from rq import Connection
 from redis import exceptions
 from datetime import datetime
+import logging
 
 import diskover_bot_module
-from diskover_bot_module import redis_conn
+from diskover_bot_module import redis_conn, DiskoverWorker
 
 
 if __name__ == "__main__":
@@ -36,11 +37,32 @@ if __name__ == "__main__":
     
     \033[0m""" % (version))
 
+    # log diskover errors (bulk adds) alongside rq worker logs
+    diskover_logger = logging.getLogger('diskover')
+    diskover_logger.setLevel(cliargs_bot['loglevel'].upper())
+    loghandler = logging.StreamHandler()
+    loghandler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s][%(name)s] %(message)s'))
+    diskover_logger.addHandler(loghandler)
+
+    # preload uid/gid names
+    if config['ownersgroups_preload'] == "true":
+        users, groups = diskover_bot_module.preload_owner_group_names()
+        print('Preloaded %s user and %s group names' % (users, groups))
+
+    # run plugins in a thread/process pool
+    if plugins and config['plugins_executor'] != "inline":
+        plugins.start_executor(config['plugins_executor'], config['plugins_workers'], config['plugins_timeout'])
+        print('Running plugins in %s pool of %s' % (config['plugins_executor'], config['plugins_workers']))
+
     with Connection(redis_conn):
         if cliargs_bot['listen']:
             listen = cliargs_bot['listen']
-        w = SimpleWorker(listen)
-        if cliargs_bot['burst']:
-            w.work(burst=True, logging_level=cliargs_bot['loglevel'])
-        else:
-            w.work(logging_level=cliargs_bot['loglevel'])
\ No newline at end of file
+        w = DiskoverWorker(listen)
+        try:
+            if cliargs_bot['burst']:
+                w.work(burst=True, logging_level=cliargs_bot['loglevel'])
+            else:
+                w.work(logging_level=cliargs_bot['loglevel'])
+        finally:
+            if diskover_bot_module.bulk_buffer:
+                diskover_bot_module.bulk_buffer.close()
\ No newline at end of file